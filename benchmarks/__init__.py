@@ -0,0 +1,2 @@
+"""Benchmarks of building Constellations. Run `python -m benchmarks.run --help` from the repository
+root for usage."""
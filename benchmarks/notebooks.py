@@ -0,0 +1,304 @@
+"""Makes the notebooks the benchmarks build: synthetic ones of any size and mix of Stars, and ones
+rebuilt from the Constellations the site ships with."""
+from __future__ import annotations
+
+import math
+import random
+from typing import List, Mapping, Optional
+
+# The kinds of Stars synthetic notebooks can have.
+STAR_KINDS = ("markdown", "matplotlib", "dataframe", "plotly", "vega", "code", "latex")
+
+# How often each kind of Star appears by default, relative to the others.
+DEFAULT_MIX = {
+    "markdown": 4,
+    "matplotlib": 2,
+    "dataframe": 1,
+    "plotly": 1,
+    "vega": 1,
+    "code": 2,
+    "latex": 1,
+}
+
+SETUP_CODE = """#constellate: setup
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+"""
+
+_WORDS = (
+    "constellation star notebook figure data plot theme render cell setup code value series "
+    "matrix sample estimate model chain distribution random mean variance"
+).split()
+
+
+def _lines(text: str) -> List[str]:
+    """Splits text into lines the way notebooks store cell sources."""
+    return text.splitlines(True)
+
+
+def markdown_cell(text: str) -> dict:
+    return {"cell_type": "markdown", "metadata": {}, "source": _lines(text)}
+
+
+def code_cell(code: str, outputs: Optional[List[dict]] = None) -> dict:
+    """Returns a code cell. Execution counts are filled in by notebook()."""
+    return {
+        "cell_type": "code",
+        "execution_count": None,
+        "metadata": {},
+        "outputs": [] if outputs is None else outputs,
+        "source": _lines(code),
+    }
+
+
+def notebook(cells: List[dict]) -> dict:
+    """Returns a notebook with the cells, numbered as if they ran in order."""
+    count = 0
+    for cell in cells:
+        if cell["cell_type"] == "code":
+            count += 1
+            cell["execution_count"] = count
+    return {
+        "cells": cells,
+        "metadata": {"language_info": {"name": "python"}},
+        "nbformat": 4,
+        "nbformat_minor": 5,
+    }
+
+
+def _data_output(mime_type: str, data) -> dict:
+    return {
+        "data": {mime_type: data},
+        "execution_count": None,
+        "metadata": {},
+        "output_type": "execute_result",
+    }
+
+
+def _markdown_text(rng: random.Random, i: int, n_stars: int, words: int) -> str:
+    """Returns the Markdown of Star i, with headings that give the outline sections and
+    subsections."""
+    if i == 0:
+        heading = "# Synthetic Constellation\n\n"
+    elif i % 10 == 0:
+        heading = f"## Section {i // 10}\n\n"
+    elif i % 5 == 0:
+        heading = f"### Subsection {i}\n\n"
+    else:
+        heading = ""
+    body = " ".join([rng.choice(_WORDS) for _ in range(words)])
+    return f"{heading}Star {i} of {n_stars}: {body}.\n"
+
+
+def _star_cells(
+    kind: str, rng: random.Random, i: int, n_stars: int, points: int, rows: int, words: int
+) -> List[dict]:
+    cells = [markdown_cell(_markdown_text(rng, i, n_stars, words))]
+    if kind == "matplotlib":
+        cells.append(
+            code_cell(
+                "#constellate: matplotlib\n"
+                f"x = np.linspace(0, 10, {points})\n"
+                f"plt.plot(x, np.sin({i + 1} * x))\n"
+                f"plt.title('Star {i}')"
+            )
+        )
+    elif kind == "dataframe":
+        cells.append(
+            code_cell(
+                f"#constellate: dataframe df_{i}\n"
+                f"rng = np.random.default_rng({i})\n"
+                f"df_{i} = pd.DataFrame({{'x': np.arange({rows}), 'y': rng.normal(size={rows}), "
+                f"'label': [f'row {{j}}' for j in range({rows})]}})\n"
+                f"df_{i}"
+            )
+        )
+    elif kind == "plotly":
+        # the figure comes from the output, so the code is never run and plotly isn't needed
+        xs = [j / points for j in range(points)]
+        figure = {
+            "data": [
+                {
+                    "type": "scatter",
+                    "mode": "lines",
+                    "x": xs,
+                    "y": [math.sin((i + 1) * x) for x in xs],
+                }
+            ],
+            "layout": {"title": {"text": f"Star {i}"}},
+        }
+        cells.append(
+            code_cell(
+                "#constellate: plotly\n"
+                "import plotly.express as px\n"
+                f"px.line(x=xs, y=ys, title='Star {i}')",
+                [_data_output("application/vnd.plotly.v1+json", figure)],
+            )
+        )
+    elif kind == "vega":
+        chart = {
+            "$schema": "https://vega.github.io/schema/vega-lite/v4.17.0.json",
+            "data": {"values": [{"x": j, "y": rng.random()} for j in range(points)]},
+            "mark": "line",
+            "encoding": {
+                "x": {"field": "x", "type": "quantitative"},
+                "y": {"field": "y", "type": "quantitative"},
+            },
+        }
+        cells.append(
+            code_cell(
+                "#constellate: vega\n"
+                "import altair as alt\n"
+                "alt.Chart(source).mark_line().encode(x='x', y='y')",
+                [_data_output("application/vnd.vegalite.v4+json", chart)],
+            )
+        )
+    elif kind == "code":
+        cells.append(
+            code_cell(
+                f"total_{i} = sum([k * k for k in range({i + 1})])\ntotal_{i}",
+                [_data_output("text/plain", [str(sum([k * k for k in range(i + 1)]))])],
+            )
+        )
+    elif kind == "latex":
+        cells.append(
+            markdown_cell(
+                "#constellate: latex\n$$\n"
+                f"\\sum_{{k=0}}^{{{i}}} k^2 = \\frac{{{i}({i} + 1)(2 \\cdot {i} + 1)}}{{6}}\n$$"
+            )
+        )
+    elif kind != "markdown":
+        raise ValueError(f"Unknown kind of Star {kind}")
+    return cells
+
+
+def synthetic_notebook(
+    n_stars: int,
+    mix: Optional[Mapping[str, float]] = None,
+    points: int = 200,
+    rows: int = 100,
+    words: int = 60,
+    seed: int = 0,
+) -> dict:
+    """Returns a notebook with a setup cell and n_stars Stars of random kinds.
+
+    The first Star is always Markdown with the title. Every Star's code is different, so none share
+    an ID or a cached render.
+
+    Parameters
+    ----------
+    n_stars : int
+        The number of Stars.
+    mix : Optional[Mapping[str, float]]
+        How often each kind of Star in STAR_KINDS appears, relative to the others. Kinds that
+        aren't given don't appear. Defaults to DEFAULT_MIX.
+    points : int
+        The number of points in each plot.
+    rows : int
+        The number of rows in each DataFrame.
+    words : int
+        The number of words of Markdown in each Star.
+    seed : int
+        The seed of the random choices, so the same arguments give the same notebook.
+    """
+    mix = DEFAULT_MIX if mix is None else mix
+    unknown = set(mix) - set(STAR_KINDS)
+    if unknown:
+        raise ValueError(f"Unknown kinds of Stars: {', '.join(sorted(unknown))}")
+    kinds = [kind for kind in STAR_KINDS if mix.get(kind, 0) > 0]
+    if not kinds:
+        raise ValueError("The mix has no kinds of Stars")
+
+    rng = random.Random(seed)
+    cells = [code_cell(SETUP_CODE)]
+    for i in range(n_stars):
+        kind = "markdown" if i == 0 else rng.choices(kinds, [mix[k] for k in kinds])[0]
+        cells.extend(_star_cells(kind, rng, i, n_stars, points, rows, words))
+    return notebook(cells)
+
+
+# The kinds of serialized Stars notebook_from_constellation() can make cells for.
+_PARSED_KINDS = (
+    "pure_markdown",
+    "markdown_latex",
+    "markdown_matplotlib",
+    "markdown_panel",
+    "markdown_plotly",
+    "markdown_vega",
+    "markdown_dataframe",
+    "markdown_code",
+)
+
+
+def _directive(kind: str, code: str) -> str:
+    return f"#constellate: {kind}\n{code}"
+
+
+def notebook_from_constellation(constellation: Mapping) -> dict:
+    """Returns a notebook that parses into the same Stars as a serialized Constellation.
+
+    Outputs that Stars take their artifacts from, like Plotly figures, are included, but rendered
+    ones, like Matplotlib images, aren't.
+
+    Raises
+    ------
+    ValueError
+        If the Constellation has a kind of Star that can't be parsed from notebooks.
+    """
+    cells = []
+    # shared setup cells are listed under every plot type
+    seen = set()
+    for key, setup_cells in constellation.items():
+        if not key.startswith("setup_"):
+            continue
+        for code in setup_cells:
+            if code in seen:
+                continue
+            seen.add(code)
+            if not code.lstrip().startswith("#constellate: setup"):
+                code = _directive(key, code)
+            cells.append(code_cell(code))
+
+    for star in constellation["stars"]:
+        kind = star["kind"]
+        if kind not in _PARSED_KINDS:
+            raise ValueError(f"Stars of kind {kind} can't be parsed from notebooks")
+        cells.append(markdown_cell(star["markdown"]))
+        if kind == "pure_markdown":
+            pass
+        elif kind == "markdown_latex":
+            cells.append(markdown_cell(_directive("latex", star["latex"])))
+        elif kind == "markdown_matplotlib":
+            cells.append(code_cell(_directive("matplotlib", star["matplotlib"])))
+        elif kind == "markdown_panel":
+            cells.append(code_cell(_directive("panel", star["panel"])))
+        elif kind == "markdown_plotly":
+            cells.append(
+                code_cell(
+                    _directive("plotly", star["plotly"]),
+                    [_data_output("application/vnd.plotly.v1+json", star["figure"])],
+                )
+            )
+        elif kind == "markdown_vega":
+            cells.append(
+                code_cell(
+                    _directive("vega", star["vega"]),
+                    [_data_output("application/vnd.vegalite.v4+json", star["chart"])],
+                )
+            )
+        elif kind == "markdown_dataframe":
+            cells.append(code_cell(_directive(f"dataframe {star['df_expr']}", star["code"])))
+        elif kind == "markdown_code" and star["lang"] in ("python", "py"):
+            output = star.get("output", "")
+            # outputs are kept as they were in the notebook, which may have split them into lines
+            output = output if isinstance(output, list) else _lines(output)
+            cells.append(
+                code_cell(
+                    _directive("plain", star["code"]),
+                    [_data_output("text/plain", output)],
+                )
+            )
+        elif kind == "markdown_code":
+            cells.append(markdown_cell(f"```{star['lang']}\n{star['code']}\n```"))
+    return notebook(cells)
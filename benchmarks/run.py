@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""Times each stage of building Constellations, on synthetic notebooks and the site's fixtures.
+
+Run from the repository root:
+
+    python -m benchmarks.run --stars 10 --stars 100 -o results.json
+    python -m benchmarks.run --compare results.json
+
+The stages are timed separately:
+
+- read: loading the notebook's JSON (fixtures only, which are read from disk)
+- read_cells: reading the notebook's cells one at a time, as building does, dropping the outputs
+  parsing doesn't use (fixtures only)
+- from_ipynb_model: parsing the notebook into Stars, including formatting their code, without any
+  formatted code to reuse, and Constellation.__init__
+- init: Constellation.__init__ on its own, which hashes every Star into its ID and makes the outline
+- save_all: running the setup and rendering the Matplotlib figures and DataFrames, without a cache
+- to_file: serializing the Constellation and writing it
+
+Each stage is run --repeat times, and the results are written as JSON, so runs of different versions
+can be compared with --compare.
+"""
+from __future__ import annotations
+
+import json
+import platform
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Mapping, MutableMapping, Optional, Sequence
+
+import click
+
+from constellate.constellate.constellation import ISOLATION_MODES, Constellation
+from constellate.constellate.formatting import FORMATTERS, CodeFormatter
+from constellate.constellate.ipynb import iter_cells
+from constellate.constellate.jsonio import JSON_BACKENDS
+from constellate.constellate.tables import records_table
+
+from .notebooks import DEFAULT_MIX, STAR_KINDS, notebook_from_constellation, synthetic_notebook
+
+# Bumped when the format of the results changes.
+RESULTS_VERSION = 1
+
+REPO_DIR = Path(__file__).parent.parent
+FIXTURES_DIR = REPO_DIR / "constellate-server" / "public" / "constellations-avail"
+
+
+def _time(func: Callable[[], object], repeat: int) -> Mapping[str, object]:
+    """Runs func repeat times and returns the times, in seconds, and their summary. The best time
+    is the most stable for comparisons: the others include noise like other processes and, for the
+    first run, imports."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "best": min(times),
+        "median": statistics.median(times),
+        "runs": times,
+    }
+
+
+def _star_counts(con: Constellation) -> Mapping[str, int]:
+    counts: MutableMapping[str, int] = {}
+    for star in con.stars:
+        counts[star.star_type] = counts.get(star.star_type, 0) + 1
+    return counts
+
+
+def bench_notebook(
+    name: str,
+    nb: dict,
+    repeat: int,
+    save_all: bool,
+    workers: int,
+    isolation: str,
+    formatter: str = "yapf",
+    json_backend: str = "auto",
+    compact: bool = False,
+    read: Optional[Callable[[], object]] = None,
+    read_cells: Optional[Callable[[], object]] = None,
+    fill_artifacts: Optional[Callable[[Constellation], None]] = None,
+) -> dict:
+    """Times each stage of building a notebook and returns the result for the report.
+
+    Parameters
+    ----------
+    name : str
+        What to call the notebook in the report.
+    nb : dict
+        The notebook.
+    repeat : int
+        How many times to run each stage.
+    save_all : bool
+        Whether to time rendering. Otherwise, Stars get their artifacts from fill_artifacts, and
+        without it, writing the Constellation isn't timed either.
+    workers, isolation
+        Passed to Constellation.save_all().
+    formatter : str
+        What to format code with. Each parse gets a new CodeFormatter, so nothing is reused.
+    json_backend, compact
+        Passed to Constellation.to_file().
+    read : Optional[Callable[[], object]]
+        If given, timed as reading the notebook.
+    read_cells : Optional[Callable[[], object]]
+        If given, timed as reading the notebook's cells one at a time.
+    fill_artifacts : Optional[Callable[[Constellation], None]]
+        If given, gives the Constellation's Stars artifacts from elsewhere, when rendering isn't
+        timed or fails.
+    """
+    stages = {}
+    if read is not None:
+        stages["read"] = _time(read, repeat)
+    if read_cells is not None:
+        stages["read_cells"] = _time(read_cells, repeat)
+    stages["from_ipynb_model"] = _time(
+        lambda: Constellation.from_ipynb_model(nb, CodeFormatter(formatter)), repeat
+    )
+
+    con = Constellation.from_ipynb_model(nb, CodeFormatter(formatter))
+    stages["init"] = _time(
+        lambda: Constellation(con.setup, con.stars, con.shared_setup), repeat
+    )
+
+    result = {"name": name, "stars": len(con.stars), "kinds": _star_counts(con)}
+    if not save_all and fill_artifacts is None:
+        result["stages"] = stages
+        return result
+    elif save_all:
+        try:
+            stages["save_all"] = _time(
+                lambda: con.save_all(workers=workers, isolation=isolation), repeat
+            )
+        except Exception as e:
+            # like a fixture whose code needs packages that aren't installed
+            result["errors"] = {"save_all": repr(e)}
+            if fill_artifacts is None:
+                result["stages"] = stages
+                return result
+            fill_artifacts(con)
+    elif fill_artifacts is not None:
+        fill_artifacts(con)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        savefile = Path(tmp_dir) / f"{con.slug}.constellate"
+        stages["to_file"] = _time(
+            lambda: con.to_file(savefile, compact=compact, json_backend=json_backend), repeat
+        )
+        result["output_bytes"] = savefile.stat().st_size
+
+    result["stages"] = stages
+    return result
+
+
+def _fixture_artifacts(constellation: Mapping) -> Callable[[Constellation], None]:
+    """Returns a function that gives a Constellation parsed from a fixture the images and
+    DataFrames the fixture was built with, and compacts its Plotly figures like save_all()."""
+
+    def fill(con: Constellation):
+        for star, star_id, fixture_star in zip(con.stars, con.ids, constellation["stars"]):
+            if star.star_type == "markdown_matplotlib":
+                for color_mode in ("light", "dark"):
+                    con.mpl_images[f"{star_id}_{color_mode}"] = fixture_star[color_mode]
+            elif star.star_type == "markdown_dataframe":
+                star.df_table = records_table(fixture_star.get("df_json", []))
+        con._save_all_plotly()
+
+    return fill
+
+
+def bench_fixture(
+    path: Path,
+    repeat: int,
+    save_all: bool,
+    workers: int,
+    isolation: str,
+    formatter: str,
+    json_backend: str,
+    compact: bool,
+) -> dict:
+    """Times building the notebook a fixture was built from. See bench_notebook()."""
+    name = f"fixture:{path.stem}"
+    with open(path, "r") as infile:
+        constellation = json.load(infile)
+    try:
+        nb = notebook_from_constellation(constellation)
+    except ValueError as e:
+        return {"name": name, "skipped": str(e)}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        nb_path = Path(tmp_dir) / f"{path.stem}.ipynb"
+        with open(nb_path, "w") as outfile:
+            json.dump(nb, outfile, indent=1)
+
+        def read():
+            with open(nb_path, "r") as infile:
+                return json.load(infile)
+
+        def read_cells():
+            with open(nb_path, "r") as infile:
+                return list(iter_cells(infile))
+
+        result = bench_notebook(
+            name,
+            nb,
+            repeat,
+            save_all,
+            workers,
+            isolation,
+            formatter,
+            json_backend,
+            compact,
+            read=read,
+            read_cells=read_cells,
+            fill_artifacts=_fixture_artifacts(constellation),
+        )
+        result["input_bytes"] = nb_path.stat().st_size
+    return result
+
+
+def _environment() -> dict:
+    env = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+    try:
+        from git import Repo
+
+        repo = Repo(REPO_DIR)
+        env["commit"] = repo.head.commit.hexsha
+        env["dirty"] = repo.is_dirty()
+    except Exception:
+        # not a git checkout, or git isn't installed
+        pass
+    return env
+
+
+def _parse_mix(mix: Sequence[str]) -> Optional[Mapping[str, float]]:
+    if not mix:
+        return None
+    parsed = {}
+    for item in mix:
+        kind, _, weight = item.partition("=")
+        if kind not in STAR_KINDS:
+            raise click.BadParameter(
+                f"{kind} isn't one of {', '.join(STAR_KINDS)}", param_hint="--mix"
+            )
+        try:
+            parsed[kind] = float(weight) if weight else 1.0
+        except ValueError:
+            raise click.BadParameter(f"{weight} isn't a number", param_hint="--mix")
+    return parsed
+
+
+def compare(baseline: Mapping, results: Mapping) -> List[str]:
+    """Returns lines comparing the best time of each stage of each benchmark with a baseline."""
+    baseline_cases = {case["name"]: case for case in baseline.get("results", [])}
+    lines = []
+    for case in results["results"]:
+        old = baseline_cases.get(case["name"])
+        if old is None or "stages" not in case or "stages" not in old:
+            continue
+        for stage, timing in case["stages"].items():
+            if stage in old["stages"]:
+                before = old["stages"][stage]["best"]
+                after = timing["best"]
+                ratio = after / before if before > 0 else float("inf")
+                lines.append(
+                    f"{case['name']:<40} {stage:<18} {before:9.4f}s -> {after:9.4f}s  {ratio:6.2f}x"
+                )
+    return lines
+
+
+def _summary(results: Mapping) -> List[str]:
+    lines = []
+    for case in results["results"]:
+        if "skipped" in case:
+            lines.append(f"{case['name']:<40} skipped: {case['skipped']}")
+            continue
+        stages = "  ".join(
+            [f"{stage} {timing['best']:.4f}s" for stage, timing in case["stages"].items()]
+        )
+        lines.append(f"{case['name']:<40} {stages}")
+        for stage, error in case.get("errors", {}).items():
+            lines.append(f"{'':<40} {stage} failed: {error}")
+    return lines
+
+
+@click.command()
+@click.option(
+    "--stars",
+    multiple=True,
+    type=click.IntRange(min=1),
+    help="number of Stars in a synthetic notebook to benchmark (can be repeated)",
+)
+@click.option(
+    "--mix",
+    multiple=True,
+    help=f"KIND=WEIGHT: how often a kind of Star appears in synthetic notebooks (can be repeated). Kinds: {', '.join(STAR_KINDS)}",
+)
+@click.option("--points", default=200, type=click.IntRange(min=1), help="points per plot")
+@click.option("--rows", default=100, type=click.IntRange(min=1), help="rows per DataFrame")
+@click.option("--seed", default=0, help="seed for the synthetic notebooks")
+@click.option(
+    "--fixtures/--no-fixtures",
+    default=True,
+    help="also benchmark notebooks rebuilt from the site's Constellations",
+)
+@click.option(
+    "--fixture-code/--no-fixture-code",
+    default=False,
+    help="time rendering the fixtures too, which needs the packages their code imports",
+)
+@click.option(
+    "--save-all/--no-save-all",
+    default=True,
+    help="time rendering the synthetic notebooks",
+)
+@click.option("-r", "--repeat", default=3, type=click.IntRange(min=1), help="runs of each stage")
+@click.option(
+    "-j", "--jobs", default=1, type=click.IntRange(min=1), help="processes to render with"
+)
+@click.option("--isolation", default="copy", type=click.Choice(ISOLATION_MODES))
+@click.option("--formatter", default="yapf", type=click.Choice(FORMATTERS))
+@click.option("--json-backend", default="auto", type=click.Choice(JSON_BACKENDS))
+@click.option(
+    "--compact/--indent", default=False, help="write Constellations as compact JSON when timed"
+)
+@click.option(
+    "-o",
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    help="write the results here as JSON",
+)
+@click.option(
+    "--compare",
+    "baseline_path",
+    default=None,
+    type=click.Path(dir_okay=False, exists=True, path_type=Path),
+    help="compare the results with earlier ones written with --output",
+)
+def main(
+    stars: Sequence[int],
+    mix: Sequence[str],
+    points: int,
+    rows: int,
+    seed: int,
+    fixtures: bool,
+    fixture_code: bool,
+    save_all: bool,
+    repeat: int,
+    jobs: int,
+    isolation: str,
+    formatter: str,
+    json_backend: str,
+    compact: bool,
+    output: Optional[Path],
+    baseline_path: Optional[Path],
+):
+    """Benchmarks building Constellations and prints the best time of each stage."""
+    parsed_mix = _parse_mix(mix)
+    results = {
+        "version": RESULTS_VERSION,
+        "environment": _environment(),
+        "settings": {
+            "mix": parsed_mix if parsed_mix is not None else DEFAULT_MIX,
+            "points": points,
+            "rows": rows,
+            "seed": seed,
+            "repeat": repeat,
+            "jobs": jobs,
+            "isolation": isolation,
+            "formatter": formatter,
+            "json_backend": json_backend,
+            "compact": compact,
+        },
+        "results": [],
+    }
+
+    for n_stars in stars or (10, 100):
+        nb = synthetic_notebook(n_stars, parsed_mix, points=points, rows=rows, seed=seed)
+        results["results"].append(
+            bench_notebook(
+                f"synthetic:{n_stars}",
+                nb,
+                repeat,
+                save_all,
+                jobs,
+                isolation,
+                formatter,
+                json_backend,
+                compact,
+            )
+        )
+
+    if fixtures:
+        for path in sorted(FIXTURES_DIR.glob("*.constellate")):
+            results["results"].append(
+                bench_fixture(
+                    path, repeat, fixture_code, jobs, isolation, formatter, json_backend, compact
+                )
+            )
+
+    click.echo("\n".join(_summary(results)))
+    if baseline_path is not None:
+        with open(baseline_path, "r") as infile:
+            baseline = json.load(infile)
+        click.echo(f"\nBest times compared with {click.format_filename(str(baseline_path))}:")
+        click.echo("\n".join(compare(baseline, results)))
+    if output is not None:
+        with open(output, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+
+
+if __name__ == "__main__":
+    main()
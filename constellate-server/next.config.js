@@ -46,6 +46,24 @@ const nextConfig = {
     contentSecurityPolicy: "default-src 'self'; script-src 'none'; sandbox;",
   },
 
+  /**
+   * Assets written by `constellate build --external-assets` are named after
+   * a hash of their contents, so they never change and can be cached forever.
+   */
+  async headers() {
+    return [
+      {
+        source: "/constellations/assets/:path*",
+        headers: [
+          {
+            key: "Cache-Control",
+            value: "public, max-age=31536000, immutable",
+          },
+        ],
+      },
+    ];
+  },
+
   /**
    * Set custom `process.env.SOMETHING` values to use in the application.
    * You can do this with Webpack's `DefinePlugin`, but this is more concise.
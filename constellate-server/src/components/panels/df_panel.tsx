@@ -1,13 +1,22 @@
 import {
+  EuiBasicTable,
   EuiFlexGroup,
   EuiFlexItem,
   EuiPanel,
   EuiTabbedContent,
   EuiInMemoryTable,
   EuiTableFieldDataColumnType,
+  EuiText,
 } from "@elastic/eui";
-import { useCallback, useState } from "react";
+import { useEffect, useState } from "react";
 
+import {
+  DataTable,
+  DataTableColumn,
+  DataTablePage,
+  DataTableValue,
+} from "../../lib/constellate";
+import { useAsset } from "../../lib/assets";
 import SrcBlock from "./src_block";
 
 // Data Grid assumes all string values, which is a little weird but whatever
@@ -22,17 +31,45 @@ export function to_strings(data) {
 }
 
 function render(schema, data) {
-  if (schema === "datetime") {
+  if (data === null || data === undefined) {
+    return "";
+  } else if (schema === "datetime") {
     return new Date(data).toLocaleString();
   } else {
-    return data;
+    return String(data);
   }
 }
 
-export default function DFPanel(props) {
-  const { code, data } = props;
-  // const { euiTheme, colorMode } = useEuiTheme();
+type Row = Record<string, DataTableValue>;
+
+// columns are keyed by position, since names can repeat or look like paths
+function tableColumns(
+  columns: Array<DataTableColumn>
+): EuiTableFieldDataColumnType<Row>[] {
+  return columns.map((column, i) => ({
+    field: `c${i}`,
+    name: column.name,
+    dataType:
+      column.type === "integer" || column.type === "number" ? "number" : "string",
+    render: (value: DataTableValue) => render(column.type, value),
+  }));
+}
+
+/** Returns the rows of a page of a table, which stores the values of each column together. */
+export function pageRows(page: DataTablePage): Array<Row> {
+  const numRows = page.length > 0 ? page[0].length : 0;
+  const rows: Array<Row> = [];
+  for (let i = 0; i < numRows; i++) {
+    const row: Row = {};
+    page.forEach((values, j) => {
+      row[`c${j}`] = values[i];
+    });
+    rows.push(row);
+  }
+  return rows;
+}
 
+function RecordsTable({ data }) {
   const colnames = data.length > 0 ? Object.keys(data[0]) : [];
   const cols: EuiTableFieldDataColumnType<string>[] = colnames.map(
     (colname) => {
@@ -44,64 +81,161 @@ export default function DFPanel(props) {
     }
   );
 
-  const [pagination, setPagination] = useState({ pageIndex: 0, pageSize: 20 });
-  const onChangeItemsPerPage = useCallback(
-    (pageSize) =>
-      setPagination((pagination) => ({
-        ...pagination,
-        pageSize,
-        pageIndex: 0,
-      })),
-    [setPagination]
+  return (
+    <EuiInMemoryTable
+      aria-labelledby={"Table"}
+      columns={cols}
+      items={data}
+      tableLayout="auto"
+      sorting={true}
+      pagination={true}
+    />
   );
+}
 
-  const onTableChange = ({ page = {} }) => {
-    const { index: pageIndex, size: pageSize } = page;
+/**
+ * Shows a table a page at a time, loading pages stored as assets when
+ * they're shown. A table with a single page can be sorted.
+ */
+function PagedTable({ table }: { table: DataTable }) {
+  const [pageIndex, setPageIndex] = useState(0);
+  useEffect(() => setPageIndex(0), [table]);
 
-    setPagination({
-      pageIndex,
-      pageSize,
-    });
-  };
+  const page = table.pages[Math.min(pageIndex, table.pages.length - 1)];
+  const loaded = useAsset<DataTablePage>(
+    typeof page === "string" ? undefined : page,
+    typeof page === "string" ? page : undefined
+  );
+  const rows = loaded === undefined ? [] : pageRows(loaded);
+  const cols = tableColumns(table.columns);
 
-  // Sorting
-  const [sortingColumns, setSortingColumns] = useState([]);
-  const onSort = useCallback(
-    (sortingColumns) => {
-      setSortingColumns(sortingColumns);
-    },
-    [setSortingColumns]
+  if (table.pages.length === 1) {
+    return (
+      <EuiInMemoryTable
+        aria-labelledby={"Table"}
+        columns={cols}
+        items={rows}
+        tableLayout="auto"
+        sorting={true}
+        pagination={true}
+      />
+    );
+  }
+  return (
+    <EuiBasicTable
+      aria-labelledby={"Table"}
+      columns={cols}
+      items={rows}
+      tableLayout="auto"
+      loading={loaded === undefined}
+      pagination={{
+        pageIndex: pageIndex,
+        pageSize: table.page_rows,
+        totalItemCount: table.num_rows,
+        showPerPageOptions: false,
+      }}
+      onChange={({ page }) => {
+        if (page !== undefined) {
+          setPageIndex(page.index);
+        }
+      }}
+    />
+  );
+}
+
+const STATS = ["count", "nulls", "min", "max", "mean", "std", "unique", "top", "freq", "true"];
+
+function SummaryTable({ table }: { table: DataTable }) {
+  // only show the stats some column has
+  const shown = STATS.filter((stat) =>
+    table.columns.some((column) => column.stats[stat] !== undefined)
   );
+  const cols: EuiTableFieldDataColumnType<Row>[] = [
+    { field: "name", name: "Column" },
+    { field: "dtype", name: "Type" },
+    ...shown.map((stat) => ({
+      field: stat,
+      name: stat,
+      render: (value: DataTableValue, row: Row) =>
+        render(stat === "min" || stat === "max" ? row.type : undefined, value),
+    })),
+  ];
+  const rows: Array<Row> = table.columns.map((column) => ({
+    name: column.name,
+    dtype: column.dtype,
+    type: column.type,
+    ...column.stats,
+  }));
 
-  const [visibleColumns, setVisibleColumns] = useState(
-    cols.map(({ id }) => id)
+  return (
+    <EuiBasicTable
+      aria-labelledby={"Summary"}
+      columns={cols}
+      items={rows}
+      tableLayout="auto"
+    />
   );
+}
+
+function Truncated({ table }: { table: DataTable }) {
+  return table.num_rows < table.total_rows ? (
+    <EuiText size="s" color="subdued">
+      Showing the first {table.num_rows} of {table.total_rows} rows. The summary
+      is of every row.
+    </EuiText>
+  ) : (
+    <></>
+  );
+}
+
+/**
+ * Shows a DataFrame, as either a table from constellate/tables.py, or the
+ * records older builds wrote.
+ */
+export default function DFPanel(props: {
+  code: string;
+  table?: DataTable;
+  data?: Array<Record<string, string>>;
+}) {
+  const { code, table, data } = props;
+
+  function frame(content) {
+    return (
+      <EuiFlexGroup
+        direction="column"
+        justifyContent="center"
+        className="eui-fullHeight"
+      >
+        <EuiFlexItem grow>
+          <EuiPanel>{content}</EuiPanel>
+        </EuiFlexItem>
+      </EuiFlexGroup>
+    );
+  }
 
   const tabs = [
     {
       id: "df",
       name: "Data",
-      content: (
-        <EuiFlexGroup
-          direction="column"
-          justifyContent="center"
-          className="eui-fullHeight"
-        >
-          <EuiFlexItem grow>
-            <EuiPanel>
-              <EuiInMemoryTable
-                aria-labelledby={"Table"}
-                columns={cols}
-                items={data}
-                tableLayout="auto"
-                sorting={true}
-                pagination={true}
-              />
-            </EuiPanel>
-          </EuiFlexItem>
-        </EuiFlexGroup>
-      ),
+      content:
+        table !== undefined
+          ? frame(
+              <>
+                <Truncated table={table} />
+                <PagedTable table={table} />
+              </>
+            )
+          : frame(<RecordsTable data={data} />),
     },
+    ...(table !== undefined
+      ? [
+          {
+            id: "summary",
+            name: "Summary",
+            content: frame(<SummaryTable table={table} />),
+          },
+        ]
+      : []),
     {
       id: "code",
       name: "Code",
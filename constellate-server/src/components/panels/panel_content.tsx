@@ -1,4 +1,13 @@
-import { Star } from "../../lib/constellate";
+import { EuiLoadingChart } from "@elastic/eui";
+import { useMemo } from "react";
+import {
+  MarkdownDataframe,
+  MarkdownPlotly,
+  MarkdownVega,
+  Star,
+} from "../../lib/constellate";
+import { assetUrl, useAsset } from "../../lib/assets";
+import { decodeTypedArrays } from "../../lib/typed_arrays";
 import CodePanel from "./code_panel";
 import ImagePanel from "./image_panel";
 import LatexPanel from "./latex_panel";
@@ -18,6 +27,37 @@ type PanelContentProps = {
   slug: string;
 };
 
+function Loading() {
+  return <EuiLoadingChart size="xl" />;
+}
+
+function PlotlyStar({ star }: { star: MarkdownPlotly }) {
+  const encoded = useAsset(star.figure, star.figure_url);
+  const fig = useMemo(
+    () => (encoded === undefined ? undefined : decodeTypedArrays(encoded)),
+    [encoded]
+  );
+  return fig === undefined ? <Loading /> : <PlotlyPanel fig={fig} code={star.plotly} />;
+}
+
+function DataframeStar({ star }: { star: MarkdownDataframe }) {
+  const data = useAsset(star.df_json, star.df_json_url);
+  // tables of Constellations built without rendering DataFrames are empty
+  if (star.df_table !== undefined && star.df_table.pages !== undefined) {
+    return <DFPanel table={star.df_table} code={star.code} />;
+  }
+  return data === undefined ? (
+    <Loading />
+  ) : (
+    <DFPanel data={to_strings(data)} code={star.code} />
+  );
+}
+
+function VegaStar({ star }: { star: MarkdownVega }) {
+  const chart = useAsset(star.chart, star.chart_url);
+  return chart === undefined ? <Loading /> : <VegaPanel chart={chart} code={star.vega} />;
+}
+
 export default function PanelContent(props: PanelContentProps) {
   switch (props.star.kind) {
     case "pure_markdown":
@@ -40,20 +80,18 @@ export default function PanelContent(props: PanelContentProps) {
     case "markdown_matplotlib":
       return (
         <ImagePanel
-          url={props.star[props.isDark ? "dark" : "light"]}
+          url={assetUrl(props.star[props.isDark ? "dark" : "light"])}
           code={props.star.matplotlib}
         />
       );
     case "markdown_plotly":
-      return <PlotlyPanel fig={props.star.figure} code={props.star.plotly} />;
+      return <PlotlyStar star={props.star} />;
 
     case "markdown_dataframe":
-      return (
-        <DFPanel data={to_strings(props.star.df_json)} code={props.star.code} />
-      );
+      return <DataframeStar star={props.star} />;
 
     case "markdown_vega":
-      return <VegaPanel chart={props.star.chart} code={props.star.vega} />;
+      return <VegaStar star={props.star} />;
 
     case "markdown_widget":
       return <WidgetPanel html={testHTML} />;
@@ -1,7 +1,7 @@
 import React from "react";
 import { EuiSideNav, htmlIdGenerator } from "@elastic/eui";
 
-import type { Constellation } from "../lib/constellate";
+import type { ConstellationSummary } from "../lib/constellate";
 
 import { appendIconComponentCache } from "@elastic/eui/es/components/icon/icon";
 
@@ -19,7 +19,7 @@ appendIconComponentCache({
 });
 
 class SideBarClass extends React.Component<{
-    constellation: Constellation;
+    constellation: ConstellationSummary;
     currId: number;
 }> {
     constructor(props) {
@@ -27,7 +27,7 @@ class SideBarClass extends React.Component<{
     }
 
     breadCrumbs() {
-        const stars = this.props.constellation.stars;
+        const starIds = this.props.constellation.star_ids;
         const titles = this.props.constellation.star_titles;
         const crumbs = [];
         const ids_to_crumbs = {};
@@ -42,10 +42,10 @@ class SideBarClass extends React.Component<{
                     href: `/${this.props.constellation.slug}/${i}`,
                 };
 
-                ids_to_crumbs[stars[i].star_id] = crumb;
+                ids_to_crumbs[starIds[i]] = crumb;
                 crumbs.push(crumb);
             } else if (bc.length > 1) {
-                const parent_id = stars[bc[bc.length - 1]].star_id;
+                const parent_id = starIds[bc[bc.length - 1]];
                 let crumb;
                 if (titles[i] !== "") {
                     // node page: add into correct area
@@ -60,7 +60,7 @@ class SideBarClass extends React.Component<{
                     crumb = ids_to_crumbs[parent_id];
                 }
 
-                ids_to_crumbs[stars[i].star_id] = crumb;
+                ids_to_crumbs[starIds[i]] = crumb;
             } else {
                 // beginning page, no highlights
             }
@@ -71,7 +71,7 @@ class SideBarClass extends React.Component<{
     render() {
         const [ids_to_crumbs, crumbs] = this.breadCrumbs();
         const currStarId =
-            this.props.constellation.stars[this.props.currId].star_id;
+            this.props.constellation.star_ids[this.props.currId];
         if (ids_to_crumbs[currStarId] != null) {
             ids_to_crumbs[currStarId].isSelected = true;
         }
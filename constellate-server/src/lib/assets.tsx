@@ -0,0 +1,49 @@
+import { useEffect, useState } from "react";
+
+const pathPrefix = process.env.PATH_PREFIX;
+
+/**
+ * Returns the URL to load an image or asset from. `constellate build` stores
+ * asset paths relative to the root of the site, which may be served under a
+ * path prefix, like on GitHub Pages. Data URIs are returned as is.
+ */
+export function assetUrl(url: string | undefined): string | undefined {
+  if (url === undefined || /^[a-z][a-z0-9+.-]*:/i.test(url)) {
+    return url;
+  }
+  // older builds wrote paths starting with a slash
+  return `${pathPrefix}/${url.replace(/^\//, "")}`;
+}
+
+/**
+ * Returns an artifact that is either inline or stored as a separate asset
+ * file. Assets are fetched when the component using them is first shown,
+ * and this returns undefined until they've loaded.
+ */
+export function useAsset<T>(value: T | undefined, url: string | undefined): T | undefined {
+  const [fetched, setFetched] = useState<{ url: string; value: T } | undefined>(undefined);
+
+  useEffect(() => {
+    if (url === undefined) {
+      return;
+    }
+    let cancelled = false;
+    fetch(assetUrl(url))
+      .then((res) => res.json())
+      .then((data: T) => {
+        if (!cancelled) {
+          setFetched({ url: url, value: data });
+        }
+      })
+      .catch((err) => console.error(`Could not load ${url}`, err));
+    return () => {
+      cancelled = true;
+    };
+  }, [url]);
+
+  if (url === undefined) {
+    return value;
+  }
+  // don't show a previous Star's artifact while the next one loads
+  return fetched !== undefined && fetched.url === url ? fetched.value : undefined;
+}
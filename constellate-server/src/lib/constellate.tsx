@@ -3,6 +3,7 @@ export type MarkdownMatplotlib = {
   star_id: string;
   markdown: string;
   matplotlib: string;
+  // data URIs, or asset URLs
   light?: string;
   dark?: string;
 };
@@ -26,10 +27,12 @@ export type MarkdownPlotly = {
   star_id: string;
   markdown: string;
   plotly: string;
-  figure: {
+  // large figures are stored as assets, at figure_url, instead of inline
+  figure?: {
     data: Array<Record<string, unknown>>;
     layout: Record<string, unknown>;
   };
+  figure_url?: string;
 };
 
 export type PureMarkdown = {
@@ -47,12 +50,39 @@ export type MarkdownCode = {
   lang: string;
 };
 
+export type DataTableValue = string | number | boolean | null;
+
+// the values of each column, in the order of the table's columns
+export type DataTablePage = Array<Array<DataTableValue>>;
+
+export type DataTableColumn = {
+  name: string;
+  dtype: string;
+  type: "integer" | "number" | "boolean" | "datetime" | "string" | "mixed";
+  // summary stats of every row, including those that weren't exported
+  stats: Record<string, DataTableValue>;
+};
+
+/** A DataFrame, as written by constellate/tables.py. */
+export type DataTable = {
+  version: number;
+  columns: Array<DataTableColumn>;
+  total_rows: number;
+  num_rows: number;
+  page_rows: number;
+  // pages after the first may be stored as assets, at these URLs, instead of inline
+  pages: Array<DataTablePage | string>;
+};
+
 export type MarkdownDataframe = {
   kind: "markdown_dataframe";
   star_id: string;
   markdown: string;
   code: string;
-  df_json: Array<Record<string, unknown>>;
+  df_table?: DataTable;
+  // records, as written by older builds
+  df_json?: Array<Record<string, unknown>>;
+  df_json_url?: string;
 };
 
 export type MarkdownVega = {
@@ -60,7 +90,8 @@ export type MarkdownVega = {
   star_id: string;
   markdown: string;
   vega: string;
-  chart: Record<string, unknown>;
+  chart?: Record<string, unknown>;
+  chart_url?: string;
 };
 
 export type MarkdownWidget = {
@@ -94,6 +125,19 @@ export type Constellation = {
   star_titles: Array<string>;
 };
 
+/** What the site manifest has about each Constellation: everything but the Stars. */
+export type ConstellationSummary = {
+  slug: string;
+  title: string;
+  star_titles: Array<string>;
+  star_ids: Array<string>;
+  breadcrumbs: Array<Array<number>>;
+  num_stars: number;
+};
+
+// the images of the first Matplotlib Star of a Constellation, if there is one
+export type Cover = { light?: string; dark?: string } | null;
+
 export function hasImgPanel(star: Star) {
   return star.kind != "pure_markdown";
 }
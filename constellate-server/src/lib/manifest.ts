@@ -0,0 +1,51 @@
+/**
+ * Reads the site manifest and Star shards written by `constellate build`.
+ * These use the file system, so they can only be called at build time, from
+ * getStaticPaths and getStaticProps.
+ */
+import { readFileSync } from "fs";
+import path from "path";
+import { ConstellationSummary, Cover, Star } from "./constellate";
+
+const constellationDir = () => path.join(process.cwd(), "public/constellations");
+
+type Manifest = {
+  version: number;
+  constellations: Array<ConstellationSummary & { source?: Array<number> }>;
+};
+
+type Covers = {
+  version: number;
+  covers: Record<string, Cover>;
+};
+
+// every page reads the manifest, so it's only parsed once per build worker
+let manifest: Array<ConstellationSummary> | undefined;
+
+export function readManifest(): Array<ConstellationSummary> {
+  if (manifest === undefined) {
+    const parsed: Manifest = JSON.parse(
+      readFileSync(path.join(constellationDir(), "manifest.json"), "utf8")
+    );
+    // the source file information is only for the build, so leave it out of page props
+    manifest = parsed.constellations.map(({ source, ...summary }) => summary);
+  }
+  return manifest;
+}
+
+/** Returns the cover images of each Constellation, by slug, for the index page. */
+export function readCovers(): Record<string, Cover> {
+  const parsed: Covers = JSON.parse(
+    readFileSync(path.join(constellationDir(), "covers.json"), "utf8")
+  );
+  return parsed.covers;
+}
+
+export function readShard(slug: string, id: number): Star {
+  return JSON.parse(
+    readFileSync(
+      path.join(constellationDir(), "shards", slug, `${id}.json`),
+      "utf8"
+    )
+  );
+}
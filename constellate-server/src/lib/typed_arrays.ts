@@ -0,0 +1,60 @@
+/**
+ * Decodes the base64 typed arrays `constellate build` writes Plotly figures
+ * with: see constellate/plotly_figures.py. plotly.js only reads these itself
+ * from version 2.28 on.
+ */
+
+type EncodedArray = { dtype: string; bdata: string; shape?: string };
+
+const ARRAY_TYPES = {
+  f8: Float64Array,
+  f4: Float32Array,
+  i4: Int32Array,
+  u4: Uint32Array,
+  i2: Int16Array,
+  u2: Uint16Array,
+  i1: Int8Array,
+  u1: Uint8Array,
+  u1c: Uint8ClampedArray,
+};
+
+function isEncodedArray(value: object): value is EncodedArray {
+  const { dtype, bdata } = value as Record<string, unknown>;
+  return (
+    typeof bdata === "string" && typeof dtype === "string" && dtype in ARRAY_TYPES
+  );
+}
+
+function decodeArray(value: EncodedArray) {
+  const binary = atob(value.bdata);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  // arrays are written little-endian, which is the byte order of every browser
+  const array = new ARRAY_TYPES[value.dtype](bytes.buffer);
+  if (value.shape === undefined || !value.shape.includes(",")) {
+    return array;
+  }
+  // 2D arrays, like the z of a heatmap, as a list of rows
+  const [rows, cols] = value.shape.split(",").map(Number);
+  return Array.from({ length: rows }, (_, i) =>
+    Array.from(array.subarray(i * cols, (i + 1) * cols))
+  );
+}
+
+/** Returns a value with every encoded typed array in it decoded. */
+export function decodeTypedArrays<T>(value: T): T {
+  if (Array.isArray(value)) {
+    return value.map(decodeTypedArrays) as unknown as T;
+  } else if (value !== null && typeof value === "object") {
+    if (isEncodedArray(value)) {
+      return decodeArray(value) as unknown as T;
+    }
+    return Object.fromEntries(
+      Object.entries(value).map(([k, v]) => [k, decodeTypedArrays(v)])
+    ) as T;
+  } else {
+    return value;
+  }
+}
@@ -1,10 +1,10 @@
 import Head from "next/head";
 import Link from "next/link";
 import TextPanel from "../../components/markdown/text_panel";
-import { Constellation, hasImgPanel } from "../../lib/constellate";
+import { ConstellationSummary, Star, hasImgPanel } from "../../lib/constellate";
+import { readManifest, readShard } from "../../lib/manifest";
 import PanelContent from "../../components/panels/panel_content";
 import Shortcuts from "../../components/hotkeys";
-import glob from "glob";
 import {
     EuiButton,
     EuiButtonEmpty,
@@ -35,8 +35,6 @@ import { useEffect, useState } from "react";
 import renderFootnoteBlock from "../../components/markdown/footnotes_collapse";
 
 import themes from "../../../public/constellate_themes/themes";
-import { readFileSync } from "fs";
-import path from "path";
 import Image from "next/image";
 import React from "react";
 import {
@@ -46,7 +44,12 @@ import {
 
 const theme = themes[process.env.CONSTELLATE_THEME];
 
-function StarPage({ constellations }) {
+type StarPageProps = {
+    constellation: ConstellationSummary;
+    star: Star;
+};
+
+function StarPage({ constellation, star }: StarPageProps) {
     const router = useRouter();
     const { colorMode } = useEuiTheme();
     const [isNavOpen, setIsNavOpen] = useState(false);
@@ -56,11 +59,10 @@ function StarPage({ constellations }) {
     }
 
     const { id } = router.query;
-    const constellation = constellations[router.query.constellation as string];
     const starId = Array.isArray(id) ? parseInt(id[0]) : parseInt(id);
     const uuid = "asdf";
-    const shouldRenderImg = hasImgPanel(constellation.stars[starId]);
-    const numIds = constellation.stars.length;
+    const shouldRenderImg = hasImgPanel(star);
+    const numIds = constellation.num_stars;
 
     const prevId = starId - 1 >= 0 ? starId - 1 : null;
     const nextId = starId + 1 < numIds ? starId + 1 : null;
@@ -147,7 +149,7 @@ function StarPage({ constellations }) {
                     minSize="50px"
                 >
                     <PanelContent
-                        star={constellation.stars[starId]}
+                        star={star}
                         uuid={uuid}
                         slug={constellation.slug}
                         panelUrl={process.env.PANEL_URL}
@@ -267,7 +269,7 @@ function StarPage({ constellations }) {
                                             hasBorder
                                         >
                                             <TextPanel
-                                                content={constellation.stars[starId].markdown}
+                                                content={star.markdown}
                                             />
                                         </EuiResizablePanel>
                                         {/* for some reason this doesn't work */}
@@ -294,7 +296,7 @@ function StarPage({ constellations }) {
                                             hasBorder
                                         >
                                             <TextPanel
-                                                content={constellation.stars[starId].markdown}
+                                                content={star.markdown}
                                             />
                                         </EuiResizablePanel>
                                         <EuiResizableButton
@@ -317,22 +319,16 @@ export default StarPage;
 
 export async function getStaticPaths() {
     const paths = [];
-    glob
-        .sync(path.join(process.cwd(), "public/constellations/*.constellate"))
-        .forEach((fn: string) => {
-            const data = JSON.parse(readFileSync(fn, "utf8"));
-            // @ts-ignore
-            const constellation: Constellation = data;
-            const slug = fn.split("/").reverse()[0].split(".")[0];
-            constellation.stars.forEach((s, i) => {
-                paths.push({
-                    params: {
-                        constellation: slug,
-                        id: i.toString(),
-                    },
-                });
+    readManifest().forEach((constellation) => {
+        for (let i = 0; i < constellation.num_stars; i++) {
+            paths.push({
+                params: {
+                    constellation: constellation.slug,
+                    id: i.toString(),
+                },
             });
-        });
+        }
+    });
 
     // we need to return 404s for bad paths, because otherwise RequireJS will think our fallback page is a JS file and try to load it instead of using the CDN
     return {
@@ -341,26 +337,17 @@ export async function getStaticPaths() {
     };
 }
 
-export async function getStaticProps() {
-    /* const res = await fetch(
-     *   'file:///home/nicholas/programs/constellations/metropolis-hastings/mcmc.constellate.json'
-     * );
-     * const constellation: Constellation = await res.json();  */
-
-    const constellations = {};
-    glob
-        .sync(path.join(process.cwd(), "public/constellations/*.constellate"))
-        .forEach((fn: string) => {
-            const data = JSON.parse(readFileSync(fn, "utf8"));
-            // @ts-ignore
-            const constellation: Constellation = data;
-            const slug = fn.split("/").reverse()[0].split(".")[0];
-            constellations[slug] = constellation;
-        });
+export async function getStaticProps({ params }) {
+    // each page only needs the outline of its Constellation and its own Star
+    const constellation = readManifest().find(
+        (c) => c.slug === params.constellation
+    );
+    const star = readShard(params.constellation, parseInt(params.id));
 
     return {
         props: {
-            constellations: constellations,
+            constellation: constellation,
+            star: star,
         },
     };
 }
@@ -15,10 +15,9 @@ import {
 } from "@elastic/eui";
 import Image from "next/image";
 import themes from "../../public/constellate_themes/themes";
-import { Constellation } from "../lib/constellate";
-import glob from "glob";
-import path from "path";
-import { readFileSync } from "fs";
+import { ConstellationSummary, Cover } from "../lib/constellate";
+import { readCovers, readManifest } from "../lib/manifest";
+import { assetUrl } from "../lib/assets";
 import { useRouter } from "next/router";
 import Head from "next/head";
 import ThemeSwitcher from "../components/rho/theme_switcher";
@@ -27,24 +26,20 @@ import indexStyles from "../styles/index.styles";
 import { css } from "@emotion/css";
 const theme = themes[process.env.CONSTELLATE_THEME];
 
-function findImage(constellation: Constellation, colorMode: string, styles) {
-  let url = "";
-  const hasNoImg = constellation.stars.every((star) => {
-    switch (star.kind) {
-      case "markdown_matplotlib": {
-        if (colorMode.toLocaleLowerCase() === "light") {
-          url = star.light;
-        } else {
-          url = star.dark;
-        }
-        return false; // break out of the loop
-      }
-      default: {
-        // no other panels have static images for now
-        return true;
-      }
-    }
-  });
+function findImage(
+  constellation: ConstellationSummary & { cover: Cover },
+  colorMode: string,
+  styles
+) {
+  // no other panels have static images for now, so this is the first Matplotlib Star's
+  const cover = constellation.cover;
+  const url =
+    cover === null
+      ? undefined
+      : colorMode.toLocaleLowerCase() === "light"
+      ? cover.light
+      : cover.dark;
+  const hasNoImg = url === undefined;
 
   if (hasNoImg) {
     // default: return gradient
@@ -57,7 +52,9 @@ function findImage(constellation: Constellation, colorMode: string, styles) {
       />
     );
   } else {
-    return <EuiImage size="fullWidth" url={url} alt={constellation.title} />;
+    return (
+      <EuiImage size="fullWidth" url={assetUrl(url)} alt={constellation.title} />
+    );
   }
 }
 
@@ -127,21 +124,15 @@ function IndexPage({ constellations }) {
 }
 
 export async function getStaticProps() {
-  /* const res = await fetch(
-   *   'file:///home/nicholas/programs/constellations/metropolis-hastings/mcmc.constellate.json'
-   * );
-   * const constellation: Constellation = await res.json();  */
-
+  // the index only needs the summaries in the manifest and the covers, not the Stars
+  const covers = readCovers();
   const constellations = {};
-  glob
-    .sync(path.join(process.cwd(), "public/constellations/*.constellate"))
-    .forEach((fn: string) => {
-      const data = JSON.parse(readFileSync(fn, "utf8"));
-      // @ts-ignore
-      const constellation: Constellation = data;
-      const slug = fn.split("/").reverse()[0].split(".")[0];
-      constellations[slug] = constellation;
-    });
+  readManifest().forEach((constellation) => {
+    constellations[constellation.slug] = {
+      ...constellation,
+      cover: covers[constellation.slug] ?? null,
+    };
+  });
 
   return {
     props: {
@@ -1,19 +1,50 @@
 #!/usr/bin/env python3
 """CLI interface."""
 
+import json
 import subprocess
-from typing import Sequence, Optional
+import sys
+from typing import Callable, List, MutableMapping, Sequence, Optional
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+import queue
+from contextlib import nullcontext
+from functools import partial
 import click
 from click.exceptions import MissingParameter
-from constellate.constellate.constellation import Constellation
+from constellate.constellate.constellation import Constellation, ISOLATION_MODES
 from constellate.constellate.config import ConstellateConfig
+from constellate.constellate.assets import AssetStore
+from constellate.constellate.cache import RenderCache
+from constellate.constellate.compress import (
+    COMPRESSION_FORMATS,
+    check_formats,
+    compress_outputs,
+)
+from constellate.constellate.formatting import CodeFormatter
+from constellate.constellate.images import ImageOptions
+from constellate.constellate.plotly_figures import PlotlyOptions
+from constellate.constellate.tables import TableOptions
+from constellate.constellate.manifest import update_manifest
+from constellate.constellate.namespace import SetupNamespaces
+from constellate.constellate.profile import (
+    Profiler,
+    call_profiled,
+    is_profiling,
+    merge_records,
+    phase,
+    profiling,
+)
+from constellate.constellate.snapshot import SnapshotCache
+from constellate.cli.progress import BuildProgress
+from constellate.cli.supervisor import ManagedProcess, Supervisor
+from constellate.cli.watch import RebuildWatcher
+from constellate.cli.worker import DevWorker
 from pathlib import Path
 from glob import glob
 import logging
 import click_log
 import os
-from watchdog.observers import Observer
-from watchdog.events import PatternMatchingEventHandler
 from git import Repo, GitCommandError
 import shutil
 
@@ -35,11 +66,9 @@ def format_files(filenames):
     return "\n".join([click.format_filename(fn) for fn in filenames])
 
 
-def _build(inputs: Sequence[str], confirm: bool, no_input: bool, out_dir: Path):
-    """Build command wrapper. See build() for documentation."""
-    if not inputs:
-        raise MissingParameter("No input files found, exiting")
-
+def _select_inputs(inputs: Sequence[str], confirm: bool, no_input: bool) -> Sequence[str]:
+    """Returns the inputs to build, prompting for any that don't look like notebooks and to confirm
+    running them unless no_input is set."""
     paths = []
 
     # prompt for files that don't look like notebooks
@@ -74,6 +103,49 @@ def _build(inputs: Sequence[str], confirm: bool, no_input: bool, out_dir: Path):
         # just add all paths
         paths = inputs
 
+    return paths
+
+
+def _build(
+    inputs: Sequence[str],
+    confirm: bool,
+    no_input: bool,
+    out_dir: Path,
+    use_cache: bool = True,
+    jobs: int = 1,
+    parallel: int = 1,
+    isolation: str = "copy",
+    external_assets: bool = False,
+    compress: Sequence[str] = (),
+    compact: bool = False,
+    incremental: bool = False,
+    warm_namespaces: Optional[MutableMapping[str, SetupNamespaces]] = None,
+    use_stored_outputs: bool = False,
+    profile: Optional[Path] = None,
+):
+    """Build command wrapper. See build() for documentation.
+
+    With incremental, artifacts of Stars whose inputs haven't changed since the Constellation
+    already in out_dir was built are reused instead of rendered again: see
+    Constellation.reuse_previous().
+
+    warm_namespaces holds the setup state of each notebook across calls, for long-lived processes
+    like the dev worker: see _build_notebook(). It's only used when notebooks are built in this
+    process.
+
+    With profile, the time spent in each phase of the build is written there as JSON, and a summary
+    of the slowest Stars is printed: see profile.py.
+    """
+    if not inputs:
+        raise MissingParameter("No input files found, exiting")
+
+    try:
+        check_formats(compress)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--compress")
+
+    paths = _select_inputs(inputs, confirm, no_input)
+
     out_dir.mkdir(parents=True, exist_ok=True)
 
     # now incorporate configuration
@@ -94,30 +166,336 @@ def _build(inputs: Sequence[str], confirm: bool, no_input: bool, out_dir: Path):
     for py_file in py_files:
         os.remove(py_file)
 
-    def process(fn):
-        con: Constellation = Constellation.from_ipynb_file(fn)
-        con.save_all()
+    if use_cache and conf.cache_enabled:
+        cache = RenderCache(conf.cache_dir, int(conf.cache_max_size_mb * 1024 ** 2))
+    else:
+        cache = None
+
+    if cache is not None and conf.cache_snapshots:
+        snapshots = SnapshotCache(
+            conf.cache_dir / "snapshots", int(conf.cache_snapshot_max_size_mb * 1024 ** 2)
+        )
+    else:
+        snapshots = None
 
-        con.to_file(out_dir / f"{con.slug}.constellate")
-        con._save_all_panel(panel_path)
+    if cache is not None:
+        format_cache = RenderCache(
+            conf.cache_dir / "formatted", int(conf.cache_format_max_size_mb * 1024 ** 2)
+        )
+    else:
+        format_cache = None
+    try:
+        formatter = CodeFormatter(conf.code_formatter, format_cache)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    assets = AssetStore(out_dir / "assets") if external_assets else None
+
+    progress = BuildProgress(paths, enabled=not no_input)
+    profiler = Profiler() if profile is not None else None
+    with profiling(profiler) if profiler is not None else nullcontext():
+        failures = _build_notebooks(
+            paths,
+            out_dir,
+            panel_path,
+            cache,
+            snapshots,
+            conf.image_options,
+            assets,
+            compact,
+            jobs,
+            parallel,
+            isolation,
+            progress,
+            incremental,
+            warm_namespaces,
+            use_stored_outputs,
+            formatter,
+            conf.table_options,
+            conf.plotly_options,
+        )
 
-    if no_input:
-        for fn in paths:
-            process(fn)
+        if assets is not None:
+            # other notebooks' Constellations share the assets, so only remove what none of them use
+            with phase("prune_assets"):
+                assets.prune(out_dir.glob("*.constellate"))
+
+        # the site reads the manifest and shards, not the .constellate files
+        with phase("manifest"):
+            update_manifest(out_dir)
+        # even without compression, stale compressed copies from earlier builds have to go
+        with phase("compress"):
+            compress_outputs(out_dir, compress)
+
+    if profiler is not None:
+        profiler.to_file(profile)
+        click.echo(profiler.summary())
+
+    num_built = len(paths) - len(failures)
+    if failures:
+        for fn, e in failures.items():
+            logger.error(f"Failed to build {click.format_filename(fn)}: {e!r}", exc_info=e)
+        raise click.ClickException(
+            f"{len(failures)} of {len(paths)} notebooks failed to build: "
+            + ", ".join([click.format_filename(fn) for fn in failures])
+        )
+    elif no_input:
         logger.debug(f"Built successfully to {out_dir}")
     else:
-        with click.progressbar(
-            paths, label=click.style("Building Constellations", fg="blue")
-        ) as bar:
-            for fn in bar:
-                process(fn)
-
         click.echo(
-            click.style(f"{len(paths)}", fg="blue", bold=True)
+            click.style(f"{num_built}", fg="blue", bold=True)
             + " notebooks built successfully\n"
         )
 
 
+def _build_notebooks(
+    paths: Sequence[str],
+    out_dir: Path,
+    panel_path: Path,
+    cache: Optional[RenderCache],
+    snapshots: Optional[SnapshotCache],
+    image_options: ImageOptions,
+    assets: Optional[AssetStore],
+    compact: bool,
+    jobs: int,
+    parallel: int,
+    isolation: str,
+    progress: BuildProgress,
+    incremental: bool = False,
+    warm_namespaces: Optional[MutableMapping[str, SetupNamespaces]] = None,
+    use_stored_outputs: bool = False,
+    formatter: Optional[CodeFormatter] = None,
+    table_options: Optional[TableOptions] = None,
+    plotly_options: Optional[PlotlyOptions] = None,
+) -> MutableMapping[str, Exception]:
+    """Builds each notebook with _build_notebook(), parallel at a time, and returns the error each
+    one that failed raised."""
+    failures = {}
+    if parallel > 1 and len(paths) > 1:
+        status_queue = multiprocessing.Queue()
+
+        def drain_statuses():
+            while True:
+                try:
+                    fn, status = status_queue.get_nowait()
+                except queue.Empty:
+                    return
+                progress.update(fn, status)
+
+        with ProcessPoolExecutor(
+            max_workers=parallel,
+            initializer=_set_status_queue,
+            initargs=(status_queue,),
+        ) as pool:
+            progress.draw()
+            # notebooks built in other processes are profiled there
+            profile = is_profiling()
+            build_notebook = partial(call_profiled, _build_notebook) if profile else _build_notebook
+            futures = {
+                pool.submit(
+                    build_notebook,
+                    fn,
+                    out_dir,
+                    panel_path,
+                    cache,
+                    snapshots,
+                    image_options,
+                    assets,
+                    compact,
+                    jobs,
+                    isolation,
+                    _report_to_status_queue,
+                    incremental,
+                    use_stored_outputs=use_stored_outputs,
+                    formatter=formatter,
+                    table_options=table_options,
+                    plotly_options=plotly_options,
+                ): fn
+                for fn in paths
+            }
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                # statuses sent before a notebook finished need to be shown before it's done
+                drain_statuses()
+                for future in done:
+                    fn = futures[future]
+                    if future.exception() is not None:
+                        failures[fn] = future.exception()
+                        progress.update(fn, "failed")
+                    else:
+                        if profile:
+                            merge_records(future.result()[1])
+                        progress.update(fn, "done")
+    else:
+        progress.draw()
+        for fn in paths:
+            try:
+                _build_notebook(
+                    fn,
+                    out_dir,
+                    panel_path,
+                    cache,
+                    snapshots,
+                    image_options,
+                    assets,
+                    compact,
+                    jobs,
+                    isolation,
+                    progress.update,
+                    incremental,
+                    warm_namespaces,
+                    use_stored_outputs,
+                    formatter,
+                    table_options,
+                    plotly_options,
+                )
+            except Exception as e:
+                failures[fn] = e
+                progress.update(fn, "failed")
+            else:
+                progress.update(fn, "done")
+
+    return failures
+
+
+# Queue a notebook build worker process reports its status on. See _set_status_queue().
+_STATUS_QUEUE = None
+
+
+def _set_status_queue(status_queue):
+    """Initializes a notebook build worker process with the queue to report statuses on."""
+    global _STATUS_QUEUE
+    _STATUS_QUEUE = status_queue
+
+
+def _report_to_status_queue(fn: str, status: str):
+    """Sends a notebook's status from a build worker process to the main process."""
+    if _STATUS_QUEUE is not None:
+        _STATUS_QUEUE.put((fn, status))
+
+
+def _build_notebook(
+    fn: str,
+    out_dir: Path,
+    panel_path: Path,
+    cache: Optional[RenderCache],
+    snapshots: Optional[SnapshotCache],
+    image_options: ImageOptions,
+    assets: Optional[AssetStore],
+    compact: bool,
+    jobs: int,
+    isolation: str,
+    report: Callable[[str, str], None],
+    incremental: bool = False,
+    warm_namespaces: Optional[MutableMapping[str, SetupNamespaces]] = None,
+    use_stored_outputs: bool = False,
+    formatter: Optional[CodeFormatter] = None,
+    table_options: Optional[TableOptions] = None,
+    plotly_options: Optional[PlotlyOptions] = None,
+):
+    """Builds a single notebook into a Constellation in out_dir.
+
+    Parameters
+    ----------
+    fn : str
+        The notebook to build.
+    out_dir : Path
+        The directory to write the Constellation to.
+    panel_path : Path
+        The directory to write Panel server code to.
+    cache : Optional[RenderCache]
+        The render cache to use, if any.
+    snapshots : Optional[SnapshotCache]
+        The setup state snapshot cache to use, if any.
+    image_options : ImageOptions
+        How to encode Matplotlib figures.
+    assets : Optional[AssetStore]
+        If given, large artifacts are written here instead of inline.
+    compact : bool
+        Whether to write the Constellation without indentation.
+    jobs : int
+        The number of processes to render Stars with.
+    isolation : str
+        How Stars are isolated from each other: see Constellation.save_all().
+    report : Callable[[str, str], None]
+        Called with the notebook and its new status as the build progresses.
+    incremental : bool
+        Whether to reuse the artifacts of the Constellation already in out_dir, if any.
+    warm_namespaces : Optional[MutableMapping[str, SetupNamespaces]]
+        If given, the setup state of each notebook, by path, from earlier builds in this process.
+        The notebook is rendered in its state from last time if its setup cells haven't changed,
+        so they aren't run again, and its state is stored here for next time.
+    use_stored_outputs : bool
+        Whether to use the outputs the notebook was saved with instead of running Stars.
+    formatter : Optional[CodeFormatter]
+        What to format the code of Stars with: see Constellation.from_ipynb_model().
+    table_options : Optional[TableOptions]
+        How to export DataFrames.
+    plotly_options : Optional[PlotlyOptions]
+        How to compact Plotly figures.
+    """
+    with phase("notebook", notebook=fn):
+        report(fn, "parsing")
+        con: Constellation = Constellation.from_ipynb_file(fn, formatter, use_stored_outputs)
+        savefile = out_dir / f"{con.slug}.constellate"
+        if incremental and savefile.exists():
+            try:
+                with open(savefile, "r", encoding="utf-8") as infile:
+                    previous = json.load(infile)
+            except (OSError, ValueError) as e:
+                logger.debug(f"Not reusing {savefile}: {e!r}")
+            else:
+                with phase("reuse_previous"):
+                    num_reused = con.reuse_previous(previous, assets)
+                logger.debug(f"Reusing up to {num_reused} artifacts from {savefile}")
+        namespaces = con.setup_namespaces(snapshots)
+        if warm_namespaces is not None:
+            warm_key = str(Path(fn).resolve())
+            warm = warm_namespaces.get(warm_key)
+            if warm is not None and warm.key == namespaces.key:
+                logger.debug(f"Reusing setup state of {fn}")
+                namespaces = warm
+            else:
+                warm_namespaces[warm_key] = namespaces
+
+        report(fn, "rendering")
+        con.save_all(
+            cache=cache,
+            workers=jobs,
+            isolation=isolation,
+            snapshots=snapshots,
+            image_options=image_options,
+            namespaces=namespaces,
+            use_stored_outputs=use_stored_outputs,
+            table_options=table_options,
+            plotly_options=plotly_options,
+        )
+
+        report(fn, "writing")
+        con.to_file(savefile, assets, compact=compact)
+        with phase("panel"):
+            con._save_all_panel(panel_path)
+
+
+def panel_serve_args(constellations_dir: Path) -> List[str]:
+    """Returns the command that serves the Python backend files in constellations_dir."""
+    return [
+        sys.executable,
+        "-m",
+        "panel",
+        "serve",
+        *sorted([str(fn) for fn in (constellations_dir / ".panel_servers").glob("*.py")]),
+        "--address",
+        "0.0.0.0",
+        "--port",
+        "5006",
+        "--allow-websocket-origin=*",
+        "--session-token-expiration=900000",
+        "--use-xheaders",
+    ]
+
+
 def install_if_missing():
     """Builds node_modules if not already present."""
     if (SERVER_DIR / "node_modules") not in list(SERVER_DIR.rglob("**/")):
@@ -139,9 +517,98 @@ def install_if_missing():
     help="output directory",
     type=click.Path(file_okay=False, writable=True, path_type=Path),
 )
-def build(inputs: Sequence[str], confirm: bool, no_input: bool, out_dir: Path):
-    """Builds INPUTS (Jupyter notebooks) into Constellations."""
-    _build(inputs, confirm, no_input, out_dir)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="reuse plots, tables and setup state from previous builds",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=1,
+    type=click.IntRange(min=1),
+    help="number of processes to render each notebook's plots with",
+)
+@click.option(
+    "-p",
+    "--parallel",
+    default=1,
+    type=click.IntRange(min=1),
+    help="number of notebooks to build at once",
+)
+@click.option(
+    "--isolation",
+    default="copy",
+    type=click.Choice(ISOLATION_MODES),
+    help="how plots are kept from changing each other's setup state: 'fork' shares it copy-on-write (Linux and macOS only)",
+)
+@click.option(
+    "--external-assets/--inline-assets",
+    default=False,
+    help="write large plots and tables to content-hashed files in OUT_DIR/assets instead of inline",
+)
+@click.option(
+    "--compress",
+    multiple=True,
+    type=click.Choice(list(COMPRESSION_FORMATS)),
+    help="also write pre-compressed copies of the outputs in this format (can be repeated): 'br' needs brotli and 'zstd' needs zstandard",
+)
+@click.option(
+    "--compact/--indent",
+    default=False,
+    help="write Constellations as compact JSON, without indentation",
+)
+@click.option(
+    "--use-stored-outputs",
+    is_flag=True,
+    help="use the plots and tables notebooks were saved with, where they're up to date, instead of running those cells",
+)
+@click.option(
+    "--profile",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    help="write how long each phase, plot and notebook took to build to this JSON file, and print the slowest plots",
+)
+def build(
+    inputs: Sequence[str],
+    confirm: bool,
+    no_input: bool,
+    out_dir: Path,
+    cache: bool,
+    jobs: int,
+    parallel: int,
+    isolation: str,
+    external_assets: bool,
+    compress: Sequence[str],
+    compact: bool,
+    use_stored_outputs: bool,
+    profile: Optional[Path],
+):
+    """Builds INPUTS (Jupyter notebooks) into Constellations.
+
+    Notebooks that fail to build are reported once the others are done.
+
+    With --use-stored-outputs, outputs are trusted as long as the notebook's code cells ran in
+    order, top to bottom. Plots whose images don't match a Constellate theme, and themes that
+    can't be derived from a stored image, are still rendered.
+
+    With --profile, times are recorded in every process the build uses. A phase's time includes
+    that of the phases inside it, and profiling adds a little overhead of its own."""
+    _build(
+        inputs,
+        confirm,
+        no_input,
+        out_dir,
+        use_cache=cache,
+        jobs=jobs,
+        parallel=parallel,
+        isolation=isolation,
+        external_assets=external_assets,
+        compress=compress,
+        compact=compact,
+        use_stored_outputs=use_stored_outputs,
+        profile=profile,
+    )
 
 
 @cli.command()
@@ -156,10 +623,7 @@ def python_serve(constellations_dir: Path):
         click.secho("No Python backend files, exiting", fg="blue")
         return
 
-    subprocess.run(
-        f'python -m panel serve {constellations_dir / ".panel_servers" / "*.py"} --address "0.0.0.0" --port 5006 --allow-websocket-origin="*"  --session-token-expiration=900000 --use-xheaders',
-        shell=True,
-    )
+    subprocess.run(panel_serve_args(constellations_dir))
 
 
 @cli.command()
@@ -177,54 +641,66 @@ def python_serve(constellations_dir: Path):
     help="output directory",
     type=click.Path(file_okay=False, writable=True, path_type=Path),
 )
+@click.option(
+    "--debounce",
+    default=0.3,
+    show_default=True,
+    help="how long a notebook has to go without changing before it's rebuilt, in seconds",
+    type=click.FloatRange(min=0),
+)
+@click.option(
+    "--panel/--no-panel",
+    default=True,
+    help="also serve the Python backend files, if there are any",
+)
 def dev(
-    inputs: Sequence[str], confirm: bool, no_input: bool, out_dir: Path,
+    inputs: Sequence[str],
+    confirm: bool,
+    no_input: bool,
+    out_dir: Path,
+    debounce: float,
+    panel: bool,
 ):
     """Serves the given notebooks on a development server, automatically watching the files and reloading changes."""
 
+    # setup state is kept in the worker between rebuilds, so builds have to happen there
+    worker = DevWorker()
     if click.confirm("Build from scratch? ", default=True) and not no_input:
-        _build(inputs, confirm, no_input, out_dir)
+        # the worker can't prompt, so that happens here
+        paths = _select_inputs(inputs, confirm, no_input)
+        worker.build(paths, confirm=False, no_input=True, out_dir=out_dir)
 
     if not list(out_dir.glob("*.constellate")):
         click.secho("No Constellations, exiting", fg="blue")
+        worker.stop()
         return
 
-    yarn_dev = subprocess.Popen(["yarn", "--cwd", str(SERVER_DIR.resolve()), "dev"])
+    update_manifest(out_dir)
 
-    class RebuildEventHandler(PatternMatchingEventHandler):
-        def on_modified(self, event):
-            logger.info(f"Rebuilding {event.src_path}")
-            # rebuild the modified notebook
-            _build(
-                [event.src_path], confirm=False, no_input=True, out_dir=out_dir,
-            )
-            logger.info("Completed rebuild")
+    def rebuild(path: str) -> bool:
+        # only Stars whose code or setup changed are rendered again
+        return worker.build(
+            [path], confirm=False, no_input=True, out_dir=out_dir, incremental=True
+        )
 
-    observers = []
-    for infile in inputs:
-        obs = Observer()
-        obs.schedule(RebuildEventHandler([infile], ignore_directories=True), infile)
-        observers.append(obs)
+    watcher = RebuildWatcher(inputs, rebuild, worker.cancel, debounce=debounce)
+
+    processes = [
+        ManagedProcess(
+            "Next.js dev server",
+            ["yarn", "--cwd", str(SERVER_DIR.resolve()), "dev"],
+            before_restart=install_if_missing,
+        )
+    ]
+    if panel and list((out_dir / ".panel_servers").glob("*.py")):
+        processes.append(ManagedProcess("Panel server", panel_serve_args(out_dir)))
 
     try:
-        for obs in observers:
-            obs.start()
-        while True:
-            retval = yarn_dev.poll()
-            if retval is not None and retval != 0:
-                # exited with error, restart
-                yarn_dev.terminate()
-                print(SERVER_DIR.resolve())
-                install_if_missing()
-                yarn_dev = subprocess.Popen(
-                    ["yarn", "--cwd", str(SERVER_DIR.resolve()), "dev"]
-                )
+        Supervisor(processes, services=[watcher]).run()
     except Exception as e:
         logger.error(f"Error: {e}", exc_info=True)
     finally:
-        for obs in observers:
-            obs.stop()
-        yarn_dev.terminate()
+        worker.stop()
         click.echo("Terminated")
 
 
@@ -240,6 +716,8 @@ def build_site(constellations_dir: Path):
         click.secho("No Constellations, exiting", fg="blue")
         return
 
+    # Constellations can be copied in without being built here
+    update_manifest(constellations_dir)
     install_if_missing()
     subprocess.run(["yarn", "--cwd", str(SERVER_DIR.resolve()), "build"])
 
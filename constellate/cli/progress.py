@@ -0,0 +1,89 @@
+"""Live status display for builds of several notebooks."""
+
+import sys
+from typing import Sequence
+
+import click
+
+# Styles for each notebook status. Notebooks move from queued to done or failed, through any of the
+# intermediate statuses in between.
+STATUS_STYLES = {
+    "queued": dict(fg="white", dim=True),
+    "parsing": dict(fg="blue"),
+    "rendering": dict(fg="blue", bold=True),
+    "writing": dict(fg="blue"),
+    "done": dict(fg="green"),
+    "failed": dict(fg="red", bold=True),
+}
+
+FINISHED = ("done", "failed")
+
+
+class BuildProgress:
+    """Shows the status of every notebook in a build.
+
+    On a terminal, the display is a table redrawn in place as statuses change. Otherwise, such as
+    when the output is piped to a log, each status change is printed as its own line.
+    """
+
+    def __init__(self, paths: Sequence[str], enabled: bool = True):
+        """Creates a display with every notebook queued.
+
+        Parameters
+        ----------
+        paths : Sequence[str]
+            The notebooks in the build.
+        enabled : bool
+            Whether to print anything.
+        """
+        self.statuses = {fn: "queued" for fn in paths}
+        self.enabled = enabled
+        self.interactive = enabled and sys.stdout.isatty()
+        self._lines_drawn = 0
+        self._width = max([len(click.format_filename(fn)) for fn in paths], default=0)
+
+    @property
+    def num_finished(self) -> int:
+        return sum(status in FINISHED for status in self.statuses.values())
+
+    def update(self, fn: str, status: str):
+        """Sets the status of a notebook. Updates after a notebook is finished are ignored, because
+        they can arrive out of order from worker processes."""
+        if self.statuses[fn] in FINISHED or self.statuses[fn] == status:
+            return
+
+        self.statuses[fn] = status
+        if not self.enabled:
+            return
+        elif self.interactive:
+            self.draw()
+        else:
+            click.echo(self._format_line(fn))
+
+    def _format_line(self, fn: str) -> str:
+        status = self.statuses[fn]
+        return "{}  {}".format(
+            click.format_filename(fn).ljust(self._width),
+            click.style(status, **STATUS_STYLES[status]),
+        )
+
+    def draw(self):
+        """Redraws the whole table over the previous one."""
+        if not self.interactive:
+            return
+
+        lines = [
+            click.style(
+                f"Building Constellations ({self.num_finished}/{len(self.statuses)})",
+                fg="blue",
+            )
+        ]
+        lines.extend([self._format_line(fn) for fn in self.statuses])
+
+        if self._lines_drawn:
+            # move back to the start of the table
+            click.echo(f"\x1b[{self._lines_drawn}F", nl=False)
+        for line in lines:
+            # clear each line before writing, in case the new one is shorter
+            click.echo("\x1b[2K" + line)
+        self._lines_drawn = len(lines)
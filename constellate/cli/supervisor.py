@@ -0,0 +1,175 @@
+"""Runs the servers behind `constellate dev` together, restarting any that crash."""
+
+import asyncio
+import os
+import signal
+import time
+from typing import Callable, Optional, Sequence
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+
+class ManagedProcess:
+    """A child process that's restarted with exponential backoff whenever it fails."""
+
+    def __init__(
+        self,
+        name: str,
+        args: Sequence[str],
+        before_restart: Optional[Callable[[], None]] = None,
+        min_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        healthy_after: float = 30.0,
+    ):
+        """Creates the process. Doesn't start it.
+
+        Parameters
+        ----------
+        name : str
+            What to call the process in logs.
+        args : Sequence[str]
+            The command to run.
+        before_restart : Optional[Callable[[], None]]
+            If given, called before each restart, such as to reinstall missing dependencies.
+        min_backoff : float
+            How long to wait before the first restart, in seconds. Each restart in a row waits
+            twice as long as the last, up to max_backoff.
+        max_backoff : float
+            The longest to wait before a restart, in seconds.
+        healthy_after : float
+            A process that runs at least this long, in seconds, before failing is restarted after
+            min_backoff again.
+        """
+        self.name = name
+        self.args = list(args)
+        self.before_restart = before_restart
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.healthy_after = healthy_after
+
+    async def _start(self) -> asyncio.subprocess.Process:
+        if os.name == "posix":
+            # in its own process group, so Ctrl+C reaches the supervisor instead, and stopping
+            # reaches children of the process, like the Node server yarn starts
+            return await asyncio.create_subprocess_exec(*self.args, start_new_session=True)
+        else:
+            return await asyncio.create_subprocess_exec(*self.args)
+
+    async def _stop(self, process: asyncio.subprocess.Process):
+        """Terminates the process and its children, killing them if they don't exit in time."""
+        for sig in (signal.SIGTERM, getattr(signal, "SIGKILL", signal.SIGTERM)):
+            if process.returncode is not None:
+                return
+            try:
+                if os.name == "posix":
+                    os.killpg(process.pid, sig)
+                else:
+                    process.terminate()
+            except ProcessLookupError:
+                return
+            try:
+                await asyncio.wait_for(process.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, stopping: asyncio.Event):
+        """Runs the process until stopping is set, restarting it each time it fails. A process
+        that exits successfully isn't restarted."""
+        backoff = self.min_backoff
+        while not stopping.is_set():
+            started = time.monotonic()
+            try:
+                process = await self._start()
+            except OSError as e:
+                # like a missing executable, which restarting won't fix
+                logger.error(f"Couldn't start {self.name}: {e}")
+                return
+            logger.debug(f"Started {self.name} (pid {process.pid})")
+            try:
+                exited = asyncio.ensure_future(process.wait())
+                stop = asyncio.ensure_future(stopping.wait())
+                await asyncio.wait([exited, stop], return_when=asyncio.FIRST_COMPLETED)
+                stop.cancel()
+            finally:
+                # also when the supervisor is cancelled, so no process outlives it
+                await self._stop(process)
+
+            if stopping.is_set():
+                return
+            elif process.returncode == 0:
+                logger.info(f"{self.name} exited")
+                return
+
+            if time.monotonic() - started >= self.healthy_after:
+                backoff = self.min_backoff
+            logger.warning(
+                f"{self.name} exited with code {process.returncode}, restarting in {backoff:g}s"
+            )
+            try:
+                # a stop during the wait means the process was just stopped along with everything
+                await asyncio.wait_for(stopping.wait(), timeout=backoff)
+                return
+            except asyncio.TimeoutError:
+                pass
+            backoff = min(backoff * 2, self.max_backoff)
+
+            if self.before_restart is not None:
+                await asyncio.get_event_loop().run_in_executor(None, self.before_restart)
+
+
+class Supervisor:
+    """Runs child processes and background services together until interrupted.
+
+    Everything waits on events, so an idle development session uses no CPU.
+    """
+
+    def __init__(self, processes: Sequence[ManagedProcess], services: Sequence = ()):
+        """Creates the supervisor. Doesn't start anything.
+
+        Parameters
+        ----------
+        processes : Sequence[ManagedProcess]
+            The child processes to run.
+        services : Sequence
+            Objects with start() and stop() methods that run in the background on their own, like
+            a RebuildWatcher. They're started before the processes and stopped after them.
+        """
+        self.processes = processes
+        self.services = services
+
+    def run(self):
+        """Runs everything until Ctrl+C or SIGTERM, then stops it all."""
+        try:
+            asyncio.run(self._main())
+        except KeyboardInterrupt:
+            # where signal handlers aren't supported, like on Windows, Ctrl+C lands here instead,
+            # after every process has been stopped
+            pass
+
+    async def _main(self):
+        stopping = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        started = []
+        try:
+            for service in self.services:
+                service.start()
+                started.append(service)
+            tasks = [asyncio.ensure_future(process.run(stopping)) for process in self.processes]
+            try:
+                await stopping.wait()
+            finally:
+                stopping.set()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            for service in reversed(started):
+                service.stop()
@@ -0,0 +1,137 @@
+"""Watches notebooks for `constellate dev` and rebuilds them when they're saved."""
+
+import threading
+import time
+from pathlib import Path
+from typing import Callable, MutableMapping, Optional, Sequence
+
+import logging
+import click_log
+
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+
+class _NotebookEventHandler(FileSystemEventHandler):
+    """Passes on events for the watched notebooks, ignoring the rest of their directories."""
+
+    def __init__(self, watcher: "RebuildWatcher"):
+        self.watcher = watcher
+
+    def on_any_event(self, event: FileSystemEvent):
+        # building opens and reads the notebook, which mustn't count as a change
+        if event.is_directory or event.event_type not in ("created", "modified", "moved"):
+            return
+        # editors that save by writing a temporary file and renaming it produce a move
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if path:
+                self.watcher.notify(path)
+
+
+class RebuildWatcher:
+    """Rebuilds notebooks after they're saved, one at a time.
+
+    A single observer watches the directories of every notebook. Editors often save a file in
+    several steps, so a notebook is only rebuilt once it's gone debounce seconds without changing,
+    and however many events it gets in that time, it's rebuilt once. A save during a rebuild of the
+    same notebook cancels that rebuild, which would be out of date, and the notebook is rebuilt
+    again once things settle down.
+    """
+
+    def __init__(
+        self,
+        paths: Sequence[str],
+        rebuild: Callable[[str], bool],
+        cancel: Callable[[], bool],
+        debounce: float = 0.3,
+    ):
+        """Creates the watcher. Doesn't start watching.
+
+        Parameters
+        ----------
+        paths : Sequence[str]
+            The notebooks to watch.
+        rebuild : Callable[[str], bool]
+            Rebuilds a notebook, given its path as it was passed in, returning whether the rebuild
+            finished. It runs in the watcher's own thread.
+        cancel : Callable[[], bool]
+            Cancels the rebuild in progress, from another thread.
+        debounce : float
+            How long, in seconds, a notebook has to go without changing before it's rebuilt.
+        """
+        self.paths = {str(Path(path).resolve()): path for path in paths}
+        self.rebuild = rebuild
+        self.cancel = cancel
+        self.debounce = debounce
+        # when each notebook waiting to be rebuilt last changed, by resolved path
+        self._pending: MutableMapping[str, float] = {}
+        self._building: Optional[str] = None
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._observer = Observer()
+        self._thread = threading.Thread(target=self._run, name="rebuild", daemon=True)
+
+    def start(self):
+        """Starts watching the notebooks."""
+        handler = _NotebookEventHandler(self)
+        for directory in sorted(set([str(Path(path).parent) for path in self.paths])):
+            self._observer.schedule(handler, directory, recursive=False)
+        self._observer.start()
+        self._thread.start()
+
+    def stop(self):
+        """Stops watching, cancelling any rebuild in progress."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self.cancel()
+        self._observer.stop()
+        self._observer.join()
+        self._thread.join()
+
+    def notify(self, path: str):
+        """Records that a file changed, which is ignored unless it's one of the notebooks."""
+        path = str(Path(path).resolve())
+        if path not in self.paths:
+            return
+        with self._cond:
+            self._pending[path] = time.monotonic()
+            if self._building == path and self.cancel():
+                logger.info(f"Cancelling rebuild of {self.paths[path]}: it changed again")
+            self._cond.notify_all()
+
+    def _next_ready(self) -> Optional[str]:
+        """Waits until a notebook has gone the debounce time without changing and returns it, or
+        returns None once stopped. Has to be called holding the lock."""
+        while not self._stopped:
+            if not self._pending:
+                self._cond.wait()
+                continue
+            path, changed = min(self._pending.items(), key=lambda item: item[1])
+            remaining = changed + self.debounce - time.monotonic()
+            if remaining <= 0:
+                del self._pending[path]
+                return path
+            self._cond.wait(remaining)
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                path = self._next_ready()
+                if path is None:
+                    return
+                self._building = path
+
+            try:
+                logger.info(f"Rebuilding {self.paths[path]}")
+                if self.rebuild(self.paths[path]):
+                    logger.info("Completed rebuild")
+            except Exception as e:
+                logger.error(f"Rebuild of {self.paths[path]} failed: {e}")
+            finally:
+                with self._cond:
+                    self._building = None
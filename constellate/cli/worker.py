@@ -0,0 +1,166 @@
+"""A long-lived process that rebuilds notebooks for `constellate dev`, keeping their setup state
+between rebuilds like a Jupyter kernel does."""
+
+import atexit
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from multiprocessing.connection import Connection
+
+import click
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+# the logger whose level the verbosity option sets
+APP_LOGGER = "constellate.cli.app"
+
+
+# The message the worker sends once it's ready for builds.
+READY = "ready"
+# The reply to a build that was interrupted by DevWorker.cancel().
+CANCELLED = "cancelled"
+
+
+def _serve(conn: Connection, log_level: int):
+    """Runs builds sent over conn until it's closed, replying with None, CANCELLED or the error
+    raised.
+
+    SIGINT interrupts the build in progress, like interrupting a Jupyter kernel, and is ignored
+    between builds. Each Star runs in its own copy of the setup state, so the state kept for the
+    next build isn't affected.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # imported here, because the app imports this module
+    from constellate.cli.app import _build
+
+    logging.getLogger(APP_LOGGER).setLevel(log_level)
+    # the setup state of each notebook, kept across builds
+    warm_namespaces = {}
+    conn.send(READY)
+    while True:
+        try:
+            args, kwargs = conn.recv()
+        except (EOFError, OSError):
+            # closed by stop(), or the dev server exited
+            return
+
+        try:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            _build(*args, warm_namespaces=warm_namespaces, **kwargs)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+        except KeyboardInterrupt:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            conn.send(CANCELLED)
+        except (Exception, SystemExit) as e:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            if not isinstance(e, click.ClickException):
+                # the error may not survive being sent to the other process
+                e = click.ClickException(f"{e!r}")
+            conn.send(e)
+        else:
+            conn.send(None)
+
+
+class DevWorker:
+    """Builds notebooks in a separate process that stays alive between builds.
+
+    Setup cells only run again when they change, so a rebuild after editing a Star costs about as
+    much as running that Star. The process is started on the first build and restarted if it dies,
+    such as when a notebook crashes the interpreter, in which case the setup state is lost.
+
+    A build in progress can be cancelled from another thread, which is how the dev server drops
+    rebuilds that a newer save makes obsolete.
+    """
+
+    def __init__(self):
+        """Creates the worker. Doesn't start a process."""
+        self._process = None
+        self._conn = None
+        # builds come from the file watcher's threads, but only one can run at a time
+        self._lock = threading.Lock()
+        self._building = False
+        self._cancelled = False
+
+    def _start(self):
+        # a fresh interpreter, instead of a fork of this one and its file watcher threads
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_serve,
+            args=(child_conn, logging.getLogger(APP_LOGGER).getEffectiveLevel()),
+        )
+        self._process.start()
+        child_conn.close()
+        # otherwise exiting would wait forever for the process, which waits for the next build
+        atexit.register(self.stop)
+        # until then, cancelling would interrupt the process starting up instead of a build
+        self._conn.recv()
+
+    def build(self, *args, **kwargs) -> bool:
+        """Builds notebooks in the worker process, taking the same arguments as _build() in
+        constellate.cli.app.
+
+        Returns
+        -------
+        bool
+            Whether the build finished, which it doesn't if it's cancelled.
+
+        Raises
+        ------
+        click.ClickException
+            If the build fails, or the worker process dies during the build.
+        """
+        with self._lock:
+            try:
+                if self._process is None or not self._process.is_alive():
+                    self._start()
+                self._cancelled = False
+                self._building = True
+                self._conn.send((args, kwargs))
+                reply = self._conn.recv()
+            except (EOFError, OSError):
+                self.stop()
+                raise click.ClickException(
+                    "The build process exited unexpectedly, so it will be restarted"
+                )
+            finally:
+                self._building = False
+
+        if reply == CANCELLED:
+            return False
+        elif reply is not None:
+            raise reply
+        return True
+
+    def cancel(self) -> bool:
+        """Interrupts the build in progress, if any and if it isn't already interrupted, and returns
+        whether it did. Does nothing on platforms without signals, like Windows, where builds always
+        finish."""
+        process = self._process
+        if not self._building or process is None or os.name != "posix":
+            return False
+        elif self._cancelled:
+            # a second interrupt could land outside the build
+            return False
+        self._cancelled = True
+        try:
+            os.kill(process.pid, signal.SIGINT)
+        except OSError:
+            return False
+        return True
+
+    def stop(self):
+        """Stops the worker process, if it's running."""
+        atexit.unregister(self.stop)
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._process is not None:
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
@@ -0,0 +1,173 @@
+"""Stores large rendered artifacts as separate, content-addressed files next to the Constellations.
+
+Each asset is named after the hash of its contents, so identical artifacts, like the same figure in
+two notebooks, are stored once, and an asset's URL only changes when its contents do. That means
+assets can be cached forever by browsers and CDNs, and the `.constellate` files, which only hold
+references to them, stay small.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+import re
+import tempfile
+from os import PathLike
+from pathlib import Path
+from typing import Any, Iterable, Optional, Tuple
+from urllib.parse import unquote
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+from .cache import new_file_mode
+from .compress import COMPRESSION_FORMATS
+
+# The path the site serves the asset directory at, relative to the root of the site, which may be
+# served under a path prefix: the site adds it. Constellations are in public/constellations.
+ASSET_URL_PREFIX = "constellations/assets/"
+
+# The file extension of each image type in a data URI.
+_IMAGE_EXTENSIONS = {
+    "image/svg+xml": "svg",
+    "image/png": "png",
+    "image/webp": "webp",
+}
+
+_ASSET_NAME_RE = re.compile(re.escape(ASSET_URL_PREFIX) + r"([0-9a-f]+\.[a-z]+)")
+
+
+def decode_data_uri(uri: str) -> Tuple[bytes, str]:
+    """Returns the contents of an image data URI and the file extension for its type.
+
+    Raises
+    ------
+    ValueError
+        If uri isn't a data URI for a supported image type.
+    """
+    if not uri.startswith("data:") or "," not in uri:
+        raise ValueError("Not a data URI")
+    header, payload = uri[len("data:") :].split(",", 1)
+    mime_type, *params = header.split(";")
+    if mime_type not in _IMAGE_EXTENSIONS:
+        raise ValueError(f"Unsupported data URI type {mime_type}")
+
+    if "base64" in params:
+        data = base64.b64decode(payload)
+    else:
+        data = unquote(payload).encode("utf-8")
+    return (data, _IMAGE_EXTENSIONS[mime_type])
+
+
+class AssetStore:
+    """A directory of content-addressed asset files."""
+
+    def __init__(
+        self, asset_dir: PathLike, url_prefix: str = ASSET_URL_PREFIX, min_size: int = 1024
+    ):
+        """Creates a store.
+
+        Parameters
+        ----------
+        asset_dir : PathLike
+            The directory to write assets to. Created if it doesn't exist.
+        url_prefix : str
+            The path the site serves asset_dir at, relative to the root of the site.
+        min_size : int
+            Artifacts smaller than this, in bytes, are left inline: fetching them separately
+            would cost more than it saves.
+        """
+        self.asset_dir = Path(asset_dir)
+        self.url_prefix = url_prefix
+        self.min_size = min_size
+        self.asset_dir.mkdir(parents=True, exist_ok=True)
+
+    def add(self, data: bytes, ext: str) -> str:
+        """Stores data, if it isn't already stored, and returns its URL.
+
+        Parameters
+        ----------
+        data : bytes
+            The file contents.
+        ext : str
+            The file extension, without the dot.
+        """
+        name = f"{hashlib.sha256(data).hexdigest()[:24]}.{ext}"
+        path = self.asset_dir / name
+        if not path.exists():
+            # several builds can write the same asset at once, so write it atomically
+            fd, tmp_name = tempfile.mkstemp(dir=self.asset_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as outfile:
+                    outfile.write(data)
+                os.chmod(tmp_name, new_file_mode())
+                os.replace(tmp_name, path)
+            except BaseException:
+                os.remove(tmp_name)
+                raise
+        return self.url_prefix + name
+
+    def path(self, url: str) -> Optional[Path]:
+        """Returns the file an asset URL of this store refers to, or None if it doesn't refer to
+        a stored asset."""
+        # earlier builds wrote URLs from the root of the site
+        url = url.lstrip("/")
+        if not url.startswith(self.url_prefix):
+            return None
+        path = self.asset_dir / url[len(self.url_prefix) :]
+        return path if path.parent == self.asset_dir and path.is_file() else None
+
+    def contains(self, url: str) -> bool:
+        """Returns whether url refers to a stored asset."""
+        return self.path(url) is not None
+
+    def read_json(self, url: str) -> Optional[Any]:
+        """Returns the value stored by add_json() at url, or None if it isn't stored."""
+        path = self.path(url)
+        if path is None:
+            return None
+        with open(path, "r", encoding="utf-8") as infile:
+            return json.load(infile)
+
+    def add_image(self, uri: str) -> str:
+        """Stores the image in a data URI and returns its URL, or returns the data URI as is if
+        it's small. URLs of assets already in the store are returned as is."""
+        if len(uri) < self.min_size or self.contains(uri):
+            return uri
+        return self.add(*decode_data_uri(uri))
+
+    def add_json(self, value: Any) -> Optional[str]:
+        """Stores a JSON-serializable value and returns its URL, or returns None if it's small
+        enough to leave inline."""
+        data = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        if len(data) < self.min_size:
+            return None
+        return self.add(data, "json")
+
+    def prune(self, constellation_files: Iterable[PathLike]):
+        """Removes the assets none of the given Constellation files refer to.
+
+        Parameters
+        ----------
+        constellation_files : Iterable[PathLike]
+            Every Constellation file that uses this store.
+        """
+        referenced = set()
+        for fn in constellation_files:
+            with open(str(fn), "r", encoding="utf-8") as infile:
+                referenced.update(_ASSET_NAME_RE.findall(infile.read()))
+
+        removed = 0
+        for path in self.asset_dir.iterdir():
+            # compressed copies are kept as long as their source is
+            name = path.stem if path.suffix in COMPRESSION_FORMATS.values() else path.name
+            # .tmp files are assets still being written
+            if path.is_file() and path.suffix != ".tmp" and name not in referenced:
+                path.unlink()
+                removed += 1
+        if removed:
+            logger.debug(f"Removed {removed} unused assets")
@@ -0,0 +1,194 @@
+"""Defines a persistent cache of rendered Star artifacts, so unchanged plots aren't recomputed."""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from functools import lru_cache
+from os import PathLike
+from pathlib import Path
+from typing import Any, Mapping, Optional, Sequence
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+# Bump this whenever the rendering code changes in a way that affects its output, so stale entries
+# from older versions of Constellate are never reused.
+CACHE_VERSION = 3
+
+# Libraries whose versions can change what a rendered artifact looks like.
+RENDER_LIBRARIES = ("matplotlib", "rho-plus", "pandas", "numpy", "seaborn")
+
+
+@lru_cache(maxsize=None)
+def new_file_mode() -> int:
+    """Returns the permissions files created with open() get under the current umask.
+
+    Files written atomically are created with tempfile.mkstemp(), which only lets their owner read
+    them, so they're given these instead before they're moved into place. The umask can only be
+    read by setting it, so it's read once.
+    """
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+@lru_cache(maxsize=None)
+def library_versions() -> Mapping[str, Optional[str]]:
+    """Returns the installed versions of the libraries that affect rendering."""
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:  # pragma: no cover
+        return {}
+
+    versions = {"python": sys.version.split()[0]}
+    for lib in RENDER_LIBRARIES:
+        try:
+            versions[lib] = version(lib)
+        except PackageNotFoundError:
+            versions[lib] = None
+    return versions
+
+
+def render_key(kind: str, setup_cells: Sequence[str], code: str, *extra: Any) -> str:
+    """Returns the cache key for a rendered artifact.
+
+    Only inputs that can change the rendered output go into the key: Markdown and other text is
+    deliberately left out, so editing prose never invalidates a plot.
+
+    Parameters
+    ----------
+    kind : str
+        The kind of artifact, e.g., "matplotlib".
+    setup_cells : Sequence[str]
+        The setup code run before the cell.
+    code : str
+        The cell code.
+    *extra : Any
+        Anything else the output depends on, like the color theme. Must be JSON-serializable.
+
+    Returns
+    -------
+    str
+        A hex digest.
+    """
+    payload = [CACHE_VERSION, kind, list(setup_cells), code, list(extra), library_versions()]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class RenderCache:
+    """An on-disk cache of rendered artifacts, capped in size with least-recently-used eviction.
+
+    Each entry is a JSON file named after its key. Reading an entry updates its modification time,
+    which is what eviction uses to decide what was least recently used. Writes are atomic, so
+    several builds can share one cache directory.
+
+    Subclasses can store entries in another format by overriding suffix, binary, _load() and
+    _dump().
+    """
+
+    # the file extension of entries
+    suffix = ".json"
+    # whether entries are opened in binary mode
+    binary = False
+
+    def __init__(self, cache_dir: PathLike, max_size: int):
+        """Creates a cache.
+
+        Parameters
+        ----------
+        cache_dir : PathLike
+            The directory to store entries in. Created if it doesn't exist.
+        max_size : int
+            The maximum total size of the entries, in bytes.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.suffix}"
+
+    def _load(self, infile) -> Any:
+        return json.load(infile)
+
+    def _dump(self, value: Any, outfile):
+        json.dump(value, outfile)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the entry for key, or None if it isn't cached."""
+        path = self._path(key)
+        try:
+            with open(path, "rb" if self.binary else "r") as infile:
+                value = self._load(infile)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            # evicted by another build in the meantime, which is fine
+            pass
+        return value
+
+    def _write(self, key: str, value: Any):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb" if self.binary else "w") as outfile:
+                self._dump(value, outfile)
+            os.replace(tmp_name, path)
+        except BaseException:
+            os.remove(tmp_name)
+            raise
+
+    def put(self, key: str, value: Any):
+        """Stores value, which must be serializable (as JSON, by default), under key, then evicts old
+        entries if the cache is over its size limit."""
+        self._write(key, value)
+        self.evict()
+
+    def put_many(self, entries: Mapping[str, Any]):
+        """Stores each value under its key, like put(), but only evicts once, after they're all
+        stored. Much faster than put() for many small entries."""
+        for key, value in entries.items():
+            self._write(key, value)
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in its size limit."""
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob(f"*/*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total <= self.max_size:
+            return
+
+        entries.sort()
+        for _mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+
+        logger.debug(f"Evicted render cache entries down to {total} bytes")
+
+    def clear(self):
+        """Removes every entry."""
+        for path in self.cache_dir.glob(f"*/*{self.suffix}"):
+            path.unlink()
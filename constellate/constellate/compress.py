@@ -0,0 +1,170 @@
+"""Writes pre-compressed copies of build outputs, so static file servers can send them as is.
+
+Each output gets a sibling per format, like `intro.constellate.gz` next to `intro.constellate`,
+which servers such as nginx (`gzip_static`, `brotli_static`) or Caddy (`precompressed`) send to
+clients that accept that encoding. gzip is built in. Brotli and Zstandard need the `brotli` and
+`zstandard` packages.
+"""
+from __future__ import annotations
+
+import gzip
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from os import PathLike
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Sequence
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+from .cache import new_file_mode
+
+# Maps each format to the extension of the files it writes.
+COMPRESSION_FORMATS = {"gzip": ".gz", "br": ".br", "zstd": ".zst"}
+
+# Files smaller than this, in bytes, aren't worth compressing.
+MIN_COMPRESS_SIZE = 256
+
+# Formats that are already compressed, which wouldn't get any smaller.
+_INCOMPRESSIBLE = (".png", ".webp")
+
+
+def _compressor(fmt: str) -> Callable[[bytes], bytes]:
+    """Returns a function that compresses bytes in the given format, at its highest level. Output
+    files are written once and served many times, so the extra time is worth it.
+
+    Raises
+    ------
+    ValueError
+        If the format is unknown or the package it needs isn't installed.
+    """
+    if fmt == "gzip":
+        # mtime=0 keeps the output the same across builds
+        return lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    elif fmt == "br":
+        try:
+            import brotli
+        except ImportError:
+            raise ValueError("Brotli compression needs the brotli package: pip install brotli")
+        return lambda data: brotli.compress(data, quality=11)
+    elif fmt == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError(
+                "Zstandard compression needs the zstandard package: pip install zstandard"
+            )
+        return lambda data: zstandard.ZstdCompressor(level=19).compress(data)
+    else:
+        raise ValueError(f"Unknown compression format {fmt}")
+
+
+def check_formats(formats: Iterable[str]):
+    """Raises a ValueError if any format can't be used, so that's known before building."""
+    for fmt in formats:
+        _compressor(fmt)
+
+
+def compressed_path(path: PathLike, fmt: str) -> Path:
+    """Returns the path of the compressed copy of a file."""
+    path = Path(path)
+    return path.with_name(path.name + COMPRESSION_FORMATS[fmt])
+
+
+def _is_fresh(path: Path, compressed: Path) -> bool:
+    try:
+        return compressed.stat().st_mtime_ns >= path.stat().st_mtime_ns
+    except OSError:
+        return False
+
+
+def compress_file(path: PathLike, formats: Sequence[str]) -> List[Path]:
+    """Writes a compressed copy of a file in each format, unless there's an up-to-date one already.
+    Returns the copies that were written."""
+    path = Path(path)
+    data = None
+    written = []
+    for fmt in formats:
+        compressed = compressed_path(path, fmt)
+        if _is_fresh(path, compressed):
+            continue
+        if data is None:
+            data = path.read_bytes()
+
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as outfile:
+                outfile.write(_compressor(fmt)(data))
+            os.chmod(tmp_name, new_file_mode())
+            os.replace(tmp_name, compressed)
+        except BaseException:
+            os.remove(tmp_name)
+            raise
+        written.append(compressed)
+    return written
+
+
+def output_files(out_dir: PathLike) -> List[Path]:
+    """Returns the files a build writes to out_dir that are worth compressing."""
+    out_dir = Path(out_dir)
+    candidates = [
+        *out_dir.glob("*.constellate"),
+        *out_dir.glob("manifest.json"),
+        *out_dir.glob("covers.json"),
+        *out_dir.glob("shards/*/*.json"),
+        *out_dir.glob("assets/*"),
+    ]
+    return [
+        path
+        for path in candidates
+        if path.is_file()
+        and path.suffix not in _INCOMPRESSIBLE
+        and path.suffix not in COMPRESSION_FORMATS.values()
+        and path.suffix != ".tmp"
+        and path.stat().st_size >= MIN_COMPRESS_SIZE
+    ]
+
+
+def remove_stale(out_dir: PathLike, formats: Sequence[str]):
+    """Removes compressed copies in out_dir that are older than their source, whose source no
+    longer exists or that aren't in one of the given formats, so servers never send stale data."""
+    out_dir = Path(out_dir)
+    extension_formats = {ext: fmt for fmt, ext in COMPRESSION_FORMATS.items()}
+    for pattern in ("*", "shards/*/*", "assets/*"):
+        for compressed in out_dir.glob(pattern):
+            fmt = extension_formats.get(compressed.suffix)
+            if fmt is None:
+                continue
+            source = compressed.with_name(compressed.name[: -len(compressed.suffix)])
+            if fmt not in formats or not _is_fresh(source, compressed):
+                compressed.unlink()
+
+
+def compress_outputs(
+    out_dir: PathLike, formats: Sequence[str], workers: Optional[int] = None
+):
+    """Brings the compressed copies of everything in out_dir up to date.
+
+    Parameters
+    ----------
+    out_dir : PathLike
+        The build output directory.
+    formats : Sequence[str]
+        The formats to write, out of COMPRESSION_FORMATS. If empty, only removes copies.
+    workers : Optional[int]
+        The number of processes to compress with. Defaults to the number of CPUs.
+    """
+    remove_stale(out_dir, formats)
+    if not formats:
+        return
+
+    paths = output_files(out_dir)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        written = sum(
+            [len(copies) for copies in pool.map(compress_file, paths, [formats] * len(paths))]
+        )
+    logger.debug(f"Wrote {written} compressed files")
@@ -0,0 +1,225 @@
+"""Defines the site-wide configuration, read from a `constellate.toml` file."""
+from __future__ import annotations
+
+import os
+from os import PathLike
+from pathlib import Path
+from typing import Optional
+
+import toml
+
+from .formatting import FORMATTERS
+from .images import ImageOptions
+from .plotly_figures import PlotlyOptions
+from .tables import TableOptions
+
+
+def default_cache_dir() -> Path:
+    """Returns the default location of the render cache, following the XDG convention."""
+    xdg_cache = os.environ.get("XDG_CACHE_HOME")
+    base = Path(xdg_cache) if xdg_cache else Path.home() / ".cache"
+    return base / "constellate"
+
+
+class ConstellateConfig:
+    """Configuration for a Constellate site.
+
+    Every option has a default, so an empty or missing `constellate.toml` is valid. An example
+    with every option set:
+
+    ```toml
+    theme = "default"
+    panel_url = "https://panel.constellate.dev"
+
+    [cache]
+    enabled = true
+    dir = "~/.cache/constellate"
+    max_size_mb = 512
+    snapshots = true
+    snapshot_max_size_mb = 2048
+    format_max_size_mb = 64
+
+    [format]
+    formatter = "yapf"  # or "black", "none"
+
+    [images]
+    format = "auto"  # or "adaptive", "svg", "png", "webp"
+    raster_format = "png"
+    max_svg_kb = 256
+    max_elements = 5000
+    dpi = 200
+    precision = 2
+    budget_kb = 512
+
+    [dataframes]
+    page_rows = 500
+    max_rows = 100000
+    precision = 4
+
+    [plotly]
+    binary = true
+    precision = 6
+    max_points = 5000  # leave out to keep every point
+    ```
+    """
+
+    def __init__(
+        self,
+        theme: str = "default",
+        panel_url: str = "https://panel.constellate.dev",
+        dev_panel_url: str = "http://localhost:5006",
+        cache_enabled: bool = True,
+        cache_dir: Optional[PathLike] = None,
+        cache_max_size_mb: float = 512,
+        cache_snapshots: bool = True,
+        cache_snapshot_max_size_mb: float = 2048,
+        cache_format_max_size_mb: float = 64,
+        code_formatter: str = "yapf",
+        image_options: Optional[ImageOptions] = None,
+        table_options: Optional[TableOptions] = None,
+        plotly_options: Optional[PlotlyOptions] = None,
+    ):
+        """Creates a configuration.
+
+        Parameters
+        ----------
+        theme : str
+            The name of the site theme, from `constellate_themes`.
+        panel_url : str
+            The URL the Panel servers are deployed at in production.
+        dev_panel_url : str
+            The URL the Panel servers run at during local development.
+        cache_enabled : bool
+            Whether to reuse rendered Star artifacts across builds.
+        cache_dir : Optional[PathLike]
+            Where to store the render cache. Defaults to `~/.cache/constellate`.
+        cache_max_size_mb : float
+            The size, in megabytes, past which the least recently used cache entries are evicted.
+        cache_snapshots : bool
+            Whether to save the state after running each notebook's setup code, so later builds
+            can load it instead of running the setup again. Only used if the cache is enabled.
+        cache_snapshot_max_size_mb : float
+            Like cache_max_size_mb, but for setup state snapshots, which are stored separately.
+        cache_format_max_size_mb : float
+            Like cache_max_size_mb, but for formatted code, which is stored separately.
+        code_formatter : str
+            What to format the code Stars show with: "yapf", "black" (which needs the black
+            package) or "none" to show it as written. Changing it changes the Star IDs.
+        image_options : Optional[ImageOptions]
+            How Matplotlib figures are encoded. Defaults to ImageOptions().
+        table_options : Optional[TableOptions]
+            How DataFrames are exported. Defaults to TableOptions().
+        plotly_options : Optional[PlotlyOptions]
+            How Plotly figures are compacted. Defaults to PlotlyOptions().
+        """
+        self.theme = theme
+        self.panel_url = panel_url
+        self.dev_panel_url = dev_panel_url
+        self.cache_enabled = cache_enabled
+        self.cache_dir = (
+            Path(cache_dir).expanduser() if cache_dir is not None else default_cache_dir()
+        )
+        self.cache_max_size_mb = cache_max_size_mb
+        self.cache_snapshots = cache_snapshots
+        self.cache_snapshot_max_size_mb = cache_snapshot_max_size_mb
+        self.cache_format_max_size_mb = cache_format_max_size_mb
+        if code_formatter not in FORMATTERS:
+            raise ValueError(
+                f"Unknown code formatter {code_formatter}: should be one of {', '.join(FORMATTERS)}"
+            )
+        self.code_formatter = code_formatter
+        self.image_options = image_options if image_options is not None else ImageOptions()
+        self.table_options = table_options if table_options is not None else TableOptions()
+        self.plotly_options = plotly_options if plotly_options is not None else PlotlyOptions()
+
+    @classmethod
+    def from_toml(cls, filename: PathLike) -> ConstellateConfig:
+        """Reads a configuration from a TOML file. Missing keys use the defaults.
+
+        Parameters
+        ----------
+        filename : PathLike
+            The TOML file to read.
+
+        Returns
+        -------
+        ConstellateConfig
+            The parsed configuration.
+
+        Raises
+        ------
+        ValueError
+            If an option has an invalid value.
+        """
+        data = toml.load(str(filename))
+        cache = data.get("cache", {})
+
+        kwargs = {}
+        for key in ("theme", "panel_url", "dev_panel_url"):
+            if key in data:
+                kwargs[key] = data[key]
+        for key in (
+            "enabled",
+            "dir",
+            "max_size_mb",
+            "snapshots",
+            "snapshot_max_size_mb",
+            "format_max_size_mb",
+        ):
+            if key in cache:
+                kwargs["cache_" + key] = cache[key]
+
+        code_format = data.get("format", {})
+        if "formatter" in code_format:
+            kwargs["code_formatter"] = code_format["formatter"]
+
+        images = data.get("images", {})
+        kwargs["image_options"] = ImageOptions(
+            **{
+                key: images[key]
+                for key in (
+                    "format",
+                    "raster_format",
+                    "max_svg_kb",
+                    "max_elements",
+                    "dpi",
+                    "precision",
+                    "budget_kb",
+                )
+                if key in images
+            }
+        )
+
+        dataframes = data.get("dataframes", {})
+        kwargs["table_options"] = TableOptions(
+            **{
+                key: dataframes[key]
+                for key in ("page_rows", "max_rows", "precision")
+                if key in dataframes
+            }
+        )
+
+        plotly = data.get("plotly", {})
+        kwargs["plotly_options"] = PlotlyOptions(
+            **{key: plotly[key] for key in ("binary", "precision", "max_points") if key in plotly}
+        )
+
+        return cls(**kwargs)
+
+    def to_env_files(self, local_file: PathLike, production_file: PathLike):
+        """Writes the options the Next.js site needs as `.env` files.
+
+        Parameters
+        ----------
+        local_file : PathLike
+            The environment file used by the development server.
+        production_file : PathLike
+            The environment file used by production builds.
+        """
+        for filename, panel_url in (
+            (local_file, self.dev_panel_url),
+            (production_file, self.panel_url),
+        ):
+            with open(str(filename), "w") as outfile:
+                outfile.write(f"CONSTELLATE_THEME={self.theme}\n")
+                outfile.write(f"PANEL_URL={panel_url}\n")
@@ -1,6 +1,7 @@
 """Defines a Constellation, the outer-level container of a complete work of content."""
 from __future__ import annotations
 from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
 
 import json
 import hashlib
@@ -8,10 +9,24 @@ import base64
 from copy import deepcopy
 from os import PathLike
 from pathlib import Path
-from typing import Mapping, Sequence, Tuple, MutableMapping
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    MutableMapping,
+)
 from types import FunctionType, ModuleType
 import html
+import io
+import os
 import re
+import tempfile
 from urllib.parse import quote
 import rho_plus
 import pickle
@@ -24,14 +39,153 @@ click_log.basic_config(logger)
 
 from slugify.slugify import slugify
 
-from .star import NB_STARS, MarkdownMatplotlib, Star, PlotType, guess_plot_type
+from .assets import AssetStore
+from .cache import RenderCache, new_file_mode, render_key
+from .fork import can_fork, map_forked
+from .formatting import CodeFormatter, formatting
+from .images import ImageOptions, encode_figure
+from .ipynb import iter_cells
+from .jsonio import write_json
+from .namespace import SetupNamespaces
+from .outputs import mark_fresh, stored_dataframe, stored_images
+from .plotly_figures import PlotlyOptions, compact_figure
+from .profile import call_profiled, is_profiling, merge_records, phase
+from .snapshot import SnapshotCache
+from .theming import COLOR_MODES, THEME_SETUP, is_theme_dependent, restyle_figure, theme_color_map
+from .star import MarkdownMatplotlib, MarkdownPlotly, Star, PlotType, guess_plot_type, iter_stars
+from .tables import (
+    TableOptions,
+    as_dataframe,
+    dataframe_table,
+    page_urls,
+    records_table,
+    store_pages,
+)
+
+# The setup state of each notebook a render worker process has seen, keyed by the setup cells.
+# This lets a worker run the setup once and reuse it for every Star it renders afterwards.
+_WORKER_NAMESPACES: MutableMapping[tuple, SetupNamespaces] = {}
+
+# The ways render code can be kept from affecting the setup state other Stars see.
+ISOLATION_MODES = ("copy", "fork")
+
+# The JSON artifacts in serialized Stars that are stored as assets, if they're large: Plotly figures
+# and Vega charts. DataFrames store their pages as assets instead: see tables.py.
+EXTERNAL_ARTIFACTS = ("figure", "chart")
+
+# The plot type whose setup each kind of rendered artifact uses.
+_RENDER_PLOT_TYPES = {
+    "matplotlib": PlotType.MATPLOTLIB,
+    "dataframe": PlotType.DATAFRAME,
+}
+
+
+def _warm_up_matplotlib():
+    """Does the slow one-time work of the first plot, like importing the theme libraries and
+    loading fonts, so forked children inherit it instead of each redoing it."""
+    import matplotlib
+
+    theme_color_map("light", "dark")
+    with matplotlib.rc_context():
+        exec(THEME_SETUP["light"], {})
+        encode_figure(matplotlib.pyplot.gcf(), ImageOptions(format="svg"))
+
+
+def _render_task(kind: str, args: tuple, new_scope: Callable[[], dict], labels: dict):
+    """Renders a single artifact of the given kind as a "render" phase with the given labels."""
+    with phase("render", **labels):
+        return _RENDERERS[kind](*args, new_scope)
+
+
+def _render_in_worker(
+    kind: str, namespaces: SetupNamespaces, args: tuple, labels: dict, profile: bool
+):
+    """Renders a single artifact of the given kind in a worker process. See _render_all()."""
+
+    def render():
+        namespaces_here = _WORKER_NAMESPACES.setdefault(namespaces.key, namespaces)
+        new_scope = namespaces_here.scopes(_RENDER_PLOT_TYPES[kind])
+        return _render_task(kind, args, new_scope, labels)
+
+    return call_profiled(render) if profile else render()
+
+
+def _render_all(
+    kind: str,
+    namespaces: SetupNamespaces,
+    tasks: Sequence[tuple],
+    pool: Optional[Executor] = None,
+    isolation: str = "copy",
+    workers: int = 1,
+    labels: Optional[Sequence[dict]] = None,
+) -> list:
+    """Renders artifacts of one kind, in the same order as tasks.
+
+    Parameters
+    ----------
+    kind : str
+        The kind of artifact: "matplotlib" or "dataframe".
+    namespaces : SetupNamespaces
+        The setup state to run every task in.
+    tasks : Sequence[tuple]
+        The arguments to the renderer for each artifact, besides the scope. Each task is given a
+        single fresh scope.
+    pool : Optional[Executor]
+        If given, the tasks are spread across this pool of processes. Otherwise, they run here.
+    isolation : str
+        "copy" deep copies the setup state for each task. "fork" runs the setup once and runs each
+        task in a forked child process, which shares that state copy-on-write. Ignored if pool is
+        given.
+    workers : int
+        The number of forked children to run at once, with "fork" isolation.
+    labels : Optional[Sequence[dict]]
+        The profiling labels of each task, like its Star ID: see profile.py.
+    """
+    plot_type = _RENDER_PLOT_TYPES[kind]
+    labels = [{}] * len(tasks) if labels is None else labels
+    profile = is_profiling()
+    if pool is not None:
+        futures = [
+            pool.submit(_render_in_worker, kind, namespaces, args, task_labels, profile)
+            for args, task_labels in zip(tasks, labels)
+        ]
+        results = [future.result() for future in futures]
+    elif isolation == "fork":
+        namespace = namespaces.namespace(plot_type)
+        if kind == "matplotlib":
+            _warm_up_matplotlib()
+
+        # the child process is thrown away afterwards, so it can use the namespace as is
+        def render(task):
+            args, task_labels = task
+            if profile:
+                return call_profiled(_render_task, kind, args, lambda: namespace, task_labels)
+            return _render_task(kind, args, lambda: namespace, task_labels)
+
+        results = map_forked(render, list(zip(tasks, labels)), workers)
+    else:
+        new_scope = namespaces.scopes(plot_type)
+        return [
+            _render_task(kind, args, new_scope, task_labels)
+            for args, task_labels in zip(tasks, labels)
+        ]
+
+    if profile:
+        # profiled in other processes, so the records have to be added to this one's profiler
+        for _result, records in results:
+            merge_records(records)
+        return [result for result, _records in results]
+    return results
 
 
 class Constellation:
     """A collection of Stars that combine to form a complete experience."""
 
     def __init__(
-        self, setup: Mapping[PlotType, Sequence[str]], stars: Sequence[Star],
+        self,
+        setup: Mapping[PlotType, Sequence[str]],
+        stars: Sequence[Star],
+        shared_setup: Sequence[str] = (),
     ):
         """Creates a Constellation.
 
@@ -42,13 +196,22 @@ class Constellation:
             before making plots with the given backend.
         stars : Sequence[Star]
             A list of Stars that comprise the webpage.
+        shared_setup : Sequence[str]
+            The setup code blocks that apply to every plot type. These should also be in the lists
+            in setup: they're listed separately so they only have to be run once.
         """
         self.setup = setup
+        self.shared_setup = shared_setup
         self.stars = stars
         self.title = "Constellation"
         self.slug = "constellation"
         self.ids: Sequence[str] = []
         self.mpl_images: MutableMapping[str, str] = {}
+        # the render key of each artifact, by the field it's serialized in and the Star ID, so a
+        # later build can tell which artifacts it can reuse
+        self.render_keys: MutableMapping[Tuple[str, str], str] = {}
+        # artifacts from a previous build, by render key: see reuse_previous()
+        self.previous: MutableMapping[str, Any] = {}
         # we want things like images, which are difficult to recompute, tied to something besides a
         # UUID. For now, we use a hash that combines the setup code and the cell code. This is the
         # only code that can impact any one Star, so if we change other Stars there's no need to
@@ -120,150 +283,262 @@ class Constellation:
                 # no addition was made, add default
                 self.breadcrumbs.append(())
 
+    @staticmethod
     def _run_matplotlib(
-        self,
-        star: MarkdownMatplotlib,
-        star_id: str,
-        global_state: dict,
-        global_mods: dict,
-    ):
-        """Generates images from a Matplotlib cell and saves those as base64.
+        code: str,
+        color_modes: Sequence[str],
+        image_options: ImageOptions,
+        new_scope: Callable[[], dict],
+    ) -> Mapping[str, str]:
+        """Generates images from a Matplotlib cell and returns those as data URIs.
+
+        It will generally save as an SVG, falling back to a raster format for large figures: the
+        format of the output should not be relied upon.
 
-        It will generally save as a PNG: the names of the output files should not be relied upon.
+        The code is only run once: the figure is drawn in the first theme and re-styled for the
+        others. Code that reads the theme variables directly should be given one theme at a time.
 
         **WARNING**: This runs arbitrary Python code. Do not run Constellations you cannot vouch for.
 
         Parameters
         ----------
-        star : MarkdownMatplotlib
-            The star to generate images for. The cell should modify the current figure in
+        code : str
+            The code to generate images for. The cell should modify the current figure in
         Matplotlib. Saving multiple figures is not supported at this time. The output of the cell
         does not affect what this function outputs, only the current figure.
-        star_id : str
-            The identifier used to generate the file name.
-        global_state: dict
-            The global state that can be re-copied.
-        global_mods: dict
-            The global state (like module definitions) that cannot be copied and is not changed.
-        """
-        # run this twice, for two different themes
-        SET_LIGHT = """
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import rho_plus
-IS_DARK = False
-theme, cs = rho_plus.mpl_setup(IS_DARK)
-(c1, c2, c3, c4, c5, c6, c7, c8, c9, c10, c11, c12) = cs
+        color_modes: Sequence[str]
+            The themes to render, out of "light" and "dark".
+        image_options: ImageOptions
+            How to encode the images.
+        new_scope: Callable[[], dict]
+            Returns the global state to run the code in. Called once.
+
+        Returns
+        -------
+        Mapping[str, str]
+            Maps each color mode to its image.
         """
-        SET_DARK = """
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import rho_plus
-IS_DARK = True
-theme, cs = rho_plus.mpl_setup(IS_DARK)
-(c1, c2, c3, c4, c5, c6, c7, c8, c9, c10, c11, c12) = cs
+        import matplotlib
+        import matplotlib.pyplot as plt
+
+        for color_mode in color_modes[1:]:
+            theme_color_map(color_modes[0], color_mode)
+
+        images = {}
+        # Matplotlib settings are global to the process, so anything a cell changes would
+        # otherwise leak into whichever cell happens to run after it in the same process.
+        with matplotlib.rc_context():
+            scope = new_scope()
+            with phase("exec"):
+                exec(THEME_SETUP[color_modes[0]], scope)
+                exec(code, scope)
+            fig = plt.gcf()
+            # the budget of a Star is shared by its images, one per theme
+            budget_kb = image_options.budget_kb / len(COLOR_MODES)
+            with phase("encode", color_mode=color_modes[0]):
+                images[color_modes[0]] = encode_figure(fig, image_options, budget_kb)
+
+            # the other themes reuse the same figure, just with different colors
+            for color_mode in color_modes[1:]:
+                with matplotlib.rc_context():
+                    exec(THEME_SETUP[color_mode], {})
+                    with phase("restyle", color_mode=color_mode):
+                        restyle_figure(fig, color_modes[0], color_mode)
+                    with phase("encode", color_mode=color_mode):
+                        images[color_mode] = encode_figure(fig, image_options, budget_kb)
+
+            plt.close(fig)
+
+        return images
+
+    @staticmethod
+    def _run_dataframe(
+        star_id: str,
+        code: str,
+        df_expr: str,
+        table_options: TableOptions,
+        new_scope: Callable[[], dict],
+    ) -> dict:
+        """Runs a DataFrame cell and returns the DataFrame as a table: see tables.py.
+
+        **WARNING**: This runs arbitrary Python code. Do not run Constellations you cannot vouch for.
+
+        Parameters
+        ----------
+        star_id : str
+            The ID of the Star, for errors.
+        code : str
+            The cell code.
+        df_expr : str
+            An expression that evaluates to the DataFrame, or a Series, after the code is run.
+        table_options : TableOptions
+            How to export the DataFrame.
+        new_scope: Callable[[], dict]
+            Returns the global state to run the code in.
+
+        Raises
+        ------
+        ValueError
+            If df_expr isn't a DataFrame or Series.
         """
-        for color_mode, setup in zip(("light", "dark"), (SET_LIGHT, SET_DARK)):
-            scope = deepcopy(global_state)
-            scope.update(global_mods)
-            # print(scope.keys())
-            # print(scope["__builtins__"].keys())
-            exec(setup, scope)
-            exec(star.code, scope)
-            exec(
-                """
-import matplotlib.pyplot as plt
-fig = plt.gcf()
-            """,
-                scope,
-            )
+        scope = new_scope()
+        with phase("exec"):
+            exec(code, scope)
+            df = eval(df_expr, scope)
 
-            # get the figure, making sure to import matplotlib
-            # we also need to get rid of the XML tag that matplotlib adds
-            exec(
-                """
-import io
-import base64
-bio = io.BytesIO()
-fig.savefig(bio,  format='svg', bbox_inches='tight')
-bio.seek(0)
-# get rid of xml tag, just include svg
-svg = bio.read().decode()
-svg = svg[svg.find('<svg'):].replace('\\n', '')
-pic_svg = svg
-plt.close(fig)
-            """,
-                scope,
+        if as_dataframe(df) is None:
+            raise ValueError(
+                f"DataFrame Star {star_id} shows {df_expr}, which is a {type(df).__name__}, "
+                "not a DataFrame or Series"
             )
+        with phase("to_table"):
+            return dataframe_table(df, table_options)
 
-            uri = eval("svg", scope)
-            self.mpl_images[
-                f"{star_id}_{color_mode}"
-            ] = "data:image/svg+xml;utf8," + quote(uri)
-
-    def _get_global_state(self, setup_cells: Sequence[str]) -> Tuple[dict, dict]:
-        """Returns the global setup state in a copyable and non-copyable component.
+    def reuse_previous(self, previous: Mapping, assets: Optional[AssetStore] = None) -> int:
+        """Makes the rendered artifacts of a previous build of this notebook available for reuse.
 
-        This state is the state that is recreated before every plot cell. This
-        allows expensive computations to only be done once per notebook, not
-        once per cell that uses them.
+        Artifacts are matched by their render keys, which cover everything that can change them,
+        like the code of the Star and the setup, but not the Markdown. An artifact whose Star
+        changed in any way that matters is rendered again.
 
         Parameters
         ----------
-        setup_cells : Sequence[str]
-          The setup cells to run.
+        previous : Mapping
+            The previous build, as serialized by serialize().
+        assets : Optional[AssetStore]
+            The asset store the previous build used, if any. Artifacts that were stored as assets
+            are only reused if this is given.
 
-        Returns:
+        Returns
+        -------
+        int
+            The number of artifacts available for reuse.
+        """
+        for star in previous.get("stars", []):
+            for field, key in star.get("inputs", {}).items():
+                if field in star:
+                    value = star[field]
+                elif field + "_url" in star and assets is not None:
+                    value = assets.read_json(star[field + "_url"])
+                else:
+                    continue
+
+                if value is None:
+                    continue
+                elif isinstance(value, str) and not value.startswith("data:"):
+                    # an image stored as an asset, which is only valid in the same store
+                    if assets is None or not assets.contains(value):
+                        continue
+                elif field == "df_table" and not all(
+                    [assets is not None and assets.contains(url) for url in page_urls(value)]
+                ):
+                    # likewise for pages of tables
+                    continue
+                self.previous[key] = value
+        return len(self.previous)
+
+    def _reuse(self, key: str, cache: Optional[RenderCache]) -> Optional[Any]:
+        """Returns the artifact for a render key from the previous build or the cache, or None if
+        it has to be rendered."""
+        if key in self.previous:
+            return self.previous[key]
+        elif cache is not None:
+            return cache.get(key)
+        else:
+            return None
+
+    def setup_namespaces(self, snapshots: Optional[SnapshotCache] = None) -> SetupNamespaces:
+        """Returns a builder for the setup state of each plot type. Doesn't run any code.
 
-        (state, mods), where state is the copyable objects from the global state
-        (most variables) and mods is what can't be copied, which is usually
-        things like modules. Any modifications to modules are therefore shared
-        across cells.
+        Parameters
+        ----------
+        snapshots : Optional[SnapshotCache]
+            If given, setup state is loaded from and saved to this cache.
         """
-        # Rerunning all of the setup files every plot is very time-consuming if
-        # you have a setup that runs a big analysis. At the same time, deep
-        # copying doesn't work for modules. The hack I use to get around this
-        # right now is to simply not deep copy modules and deep copy everything
-        # else.
-        global_state = {}
-        for cell in setup_cells:
-            exec(cell, global_state)
-
-        # there's a very subtle nuance of the way Python handles functions that
-        # we need to properly handle. When a function is defined, Python stores
-        # the global variables at the time of that definition in
-        # func.__globals__. This means that if you define a function and then
-        # re-define globals, the function will still work. The problem is that
-        # it's a shallow copy. So, if we remove those keys from the global
-        # namespace so we can deep copy it, it removes those names from the
-        # function itself, and you are left without even built-in names. To get
-        # around this, we make sure that we don't modify global_state or where
-        # it lies in memory.
-
-        global_mods = {}
-        new_global_state = {}
-        for k in list(global_state.keys()):
-            try:
-                deepcopy(global_state[k])
-                new_global_state[k] = global_state[k]
-            except TypeError as e:
-                global_mods[k] = global_state[k]
-
-        return (new_global_state, global_mods)
-
-    def _save_all_matplotlib(self):
+        return SetupNamespaces(self.shared_setup, self.setup, snapshots)
+
+    def _save_all_matplotlib(
+        self,
+        cache: Optional[RenderCache] = None,
+        namespaces: Optional[SetupNamespaces] = None,
+        image_options: Optional[ImageOptions] = None,
+        use_stored_outputs: bool = False,
+        **render_opts,
+    ):
         """Renders the Matplotlib figures.
 
         The names are tied to the UUID of the Star, but this may change in the future.
+
+        Parameters
+        ----------
+        cache : Optional[RenderCache]
+            If given, images are reused from and saved to this cache. The setup code is only run if
+            some image isn't cached.
+        namespaces : Optional[SetupNamespaces]
+            The setup state to render in. Defaults to a new one, built when it's first needed.
+        image_options : Optional[ImageOptions]
+            How to encode the images. Defaults to ImageOptions().
+        use_stored_outputs : bool
+            Whether to use the images the notebook was saved with where there are any: see
+            stored_images(). Only the themes without one are rendered.
+        **render_opts
+            Passed to _render_all(), to control how the figures are run.
         """
-        new_global_state, global_mods = self._get_global_state(
-            self.setup.get(PlotType.MATPLOTLIB, [])
-        )
+        setup_cells = self.setup.get(PlotType.MATPLOTLIB, [])
+        if image_options is None:
+            image_options = ImageOptions()
+        to_render = []
         for star, star_id in zip(self.stars, self.ids):
             if star.star_type == "markdown_matplotlib":
-                self._run_matplotlib(star, star_id, new_global_state, global_mods)
+                stored = {}
+                if use_stored_outputs:
+                    with phase("stored_outputs", star_id=star_id, kind=star.star_type):
+                        stored = stored_images(
+                            star.outputs, star.code, image_options, setup_cells
+                        )
+                missing = []
+                for color_mode in COLOR_MODES:
+                    if color_mode in stored:
+                        # not a render, so it's not cached or reused as one
+                        self.mpl_images[f"{star_id}_{color_mode}"] = stored[color_mode]
+                        continue
+                    key = render_key(
+                        "matplotlib", setup_cells, star.code, color_mode, image_options.key
+                    )
+                    self.render_keys[(color_mode, star_id)] = key
+                    cached = self._reuse(key, cache)
+                    if cached is None:
+                        missing.append(color_mode)
+                    else:
+                        self.mpl_images[f"{star_id}_{color_mode}"] = cached
+
+                if missing and is_theme_dependent(star.code, setup_cells):
+                    # this has to be run once per theme
+                    to_render.extend([(star, star_id, (mode,)) for mode in missing])
+                elif missing:
+                    to_render.append((star, star_id, tuple(missing)))
+
+        if not to_render:
+            return
+
+        results = _render_all(
+            "matplotlib",
+            namespaces if namespaces is not None else self.setup_namespaces(),
+            [
+                (star.code, color_modes, image_options)
+                for star, _star_id, color_modes in to_render
+            ],
+            labels=[
+                {"star_id": star_id, "kind": star.star_type, "color_modes": list(color_modes)}
+                for star, star_id, color_modes in to_render
+            ],
+            **render_opts,
+        )
+        for (star, star_id, color_modes), images in zip(to_render, results):
+            for color_mode in color_modes:
+                self.mpl_images[f"{star_id}_{color_mode}"] = images[color_mode]
+                if cache is not None:
+                    cache.put(self.render_keys[(color_mode, star_id)], images[color_mode])
 
     def _save_vega(self):
         """Saves the appropriate Vega themes to a public directory to use as URLs."""
@@ -316,39 +591,198 @@ plt.close(fig)
                 panel_objs[star_id] = code
         return panel_objs
 
-    def _save_all_dataframe(self):
-        """Saves all DataFrame data to the Constellation."""
-        new_global_state, global_mods = self._get_global_state(
-            self.setup.get(PlotType.DATAFRAME, [])
-        )
+    def _save_all_dataframe(
+        self,
+        cache: Optional[RenderCache] = None,
+        namespaces: Optional[SetupNamespaces] = None,
+        use_stored_outputs: bool = False,
+        table_options: Optional[TableOptions] = None,
+        **render_opts,
+    ):
+        """Saves all DataFrame data to the Constellation, as tables: see tables.py.
 
-        for star in self.stars:
+        Parameters
+        ----------
+        cache : Optional[RenderCache]
+            If given, data is reused from and saved to this cache. The setup code is only run if
+            some DataFrame isn't cached.
+        namespaces : Optional[SetupNamespaces]
+            The setup state to render in. Defaults to a new one, built when it's first needed.
+        use_stored_outputs : bool
+            Whether to use the DataFrames the notebook was saved with where they can be read back:
+            see stored_dataframe().
+        table_options : Optional[TableOptions]
+            How to export the DataFrames. Defaults to TableOptions().
+        **render_opts
+            Passed to _render_all(), to control how the cells are run.
+        """
+        setup_cells = self.setup.get(PlotType.DATAFRAME, [])
+        if table_options is None:
+            table_options = TableOptions()
+        to_render = []
+        for star, star_id in zip(self.stars, self.ids):
             if star.star_type == "markdown_dataframe":
-                scope = deepcopy(new_global_state)
-                scope.update(global_mods)
-                exec(star.code, scope)
-
-                star.df_json = json.loads(
-                    eval(
-                        f"({star.df_expr}).to_json(orient='records', force_ascii=False, double_precision=4, date_format='iso')",
-                        scope,
-                    )
+                stored = None
+                if use_stored_outputs:
+                    with phase("stored_outputs", star_id=star_id, kind=star.star_type):
+                        stored = stored_dataframe(star.outputs, star.code, star.df_expr)
+                if stored is not None:
+                    star.df_table = records_table(stored, table_options)
+                    continue
+                key = render_key(
+                    "dataframe", setup_cells, star.code, star.df_expr, table_options.key
                 )
+                self.render_keys[("df_table", star_id)] = key
+                cached = self._reuse(key, cache)
+                if cached is None:
+                    to_render.append((star, star_id, key))
+                else:
+                    star.df_table = cached
+
+        if not to_render:
+            return
+
+        results = _render_all(
+            "dataframe",
+            namespaces if namespaces is not None else self.setup_namespaces(),
+            [
+                (star_id, star.code, star.df_expr, table_options)
+                for star, star_id, _key in to_render
+            ],
+            labels=[
+                {"star_id": star_id, "kind": star.star_type}
+                for star, star_id, _key in to_render
+            ],
+            **render_opts,
+        )
+        for (star, _star_id, key), table in zip(to_render, results):
+            star.df_table = table
+            if cache is not None:
+                cache.put(key, table)
 
-    def save_all(self):
-        """Runs all of the methods required to prepare a Constellation for export. Does not prepare Panel servers."""
-        self._save_all_matplotlib()
-        # self._save_vega()
-        self._save_all_dataframe()
+    def _save_all_plotly(self, plotly_options: Optional[PlotlyOptions] = None):
+        """Compacts the Plotly figures, which come from the notebook's outputs and aren't rendered:
+        see plotly_figures.py.
+
+        Parameters
+        ----------
+        plotly_options : Optional[PlotlyOptions]
+            How to compact them. Defaults to PlotlyOptions().
+        """
+        for star, star_id in zip(self.stars, self.ids):
+            if isinstance(star, MarkdownPlotly):
+                with phase("compact_figure", star_id=star_id, kind=star.star_type):
+                    star.fig = compact_figure(star.fig, plotly_options)
+
+    def save_all(
+        self,
+        cache: Optional[RenderCache] = None,
+        workers: int = 1,
+        isolation: str = "copy",
+        snapshots: Optional[SnapshotCache] = None,
+        image_options: Optional[ImageOptions] = None,
+        namespaces: Optional[SetupNamespaces] = None,
+        use_stored_outputs: bool = False,
+        table_options: Optional[TableOptions] = None,
+        plotly_options: Optional[PlotlyOptions] = None,
+    ):
+        """Runs all of the methods required to prepare a Constellation for export. Does not prepare Panel servers.
+
+        Parameters
+        ----------
+        cache : Optional[RenderCache]
+            If given, rendered artifacts are reused from and saved to this cache, so Stars whose
+            code and setup haven't changed aren't run again.
+        workers : int
+            The number of processes to render Stars in. With "copy" isolation, each process runs
+            the setup code once, the first time it renders a Star that needs it. With 1, everything
+            runs in this process. The output is the same either way.
+        isolation : str
+            How each Star is kept from seeing changes other Stars make to the setup state. "copy"
+            deep copies the state for every Star, which works everywhere but can be slow and
+            memory-hungry for large state. "fork" runs the setup once in this process and renders
+            each Star in a forked child that shares the state copy-on-write, which requires
+            os.fork() (Linux or macOS). Falls back to "copy" if forking isn't available.
+        snapshots : Optional[SnapshotCache]
+            If given, the state after running the setup code is loaded from this cache instead of
+            running the setup again, and saved to it when the setup does run.
+        image_options : Optional[ImageOptions]
+            How to encode Matplotlib figures. Defaults to ImageOptions().
+        namespaces : Optional[SetupNamespaces]
+            The setup state to render in, which has to be built from this Constellation's setup
+            cells: see setup_namespaces(). Whatever state it has already built is reused, which
+            lets long-lived processes keep the setup state across builds. Defaults to a new one.
+        use_stored_outputs : bool
+            Whether to use the outputs the notebook was saved with instead of running Stars, where
+            they're there and up to date. If every Star has them, no code runs at all.
+        table_options : Optional[TableOptions]
+            How to export DataFrames. Defaults to TableOptions().
+        plotly_options : Optional[PlotlyOptions]
+            How to compact Plotly figures. Defaults to PlotlyOptions().
+        """
+        if isolation not in ISOLATION_MODES:
+            raise ValueError(f"Unknown isolation mode {isolation}")
+        if isolation == "fork" and not can_fork():
+            logger.warning("Forking is unavailable on this platform, copying instead")
+            isolation = "copy"
+
+        # shared by every plot type, so shared setup cells run once
+        if namespaces is None:
+            namespaces = self.setup_namespaces(snapshots)
+        stored = use_stored_outputs
+        if isolation == "fork":
+            render_opts = dict(isolation="fork", workers=workers)
+            self._save_all_matplotlib(cache, namespaces, image_options, stored, **render_opts)
+            self._save_all_dataframe(cache, namespaces, stored, table_options, **render_opts)
+        elif workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                self._save_all_matplotlib(cache, namespaces, image_options, stored, pool=pool)
+                self._save_all_dataframe(cache, namespaces, stored, table_options, pool=pool)
+        else:
+            self._save_all_matplotlib(cache, namespaces, image_options, stored)
+            # self._save_vega()
+            self._save_all_dataframe(cache, namespaces, stored, table_options)
+        self._save_all_plotly(plotly_options)
 
     @classmethod
-    def from_ipynb_model(cls, nb: dict) -> Constellation:
+    def from_ipynb_model(
+        cls, nb: dict, formatter: Optional[CodeFormatter] = None
+    ) -> Constellation:
         """Generates a Constellation from the JSON data comprising a notebook, stored in `.ipynb` files.
 
         Parameters
         ----------
         nb : dict
             The JSON data. Should have a "cells" key.
+        formatter : Optional[CodeFormatter]
+            What to format the code of Stars with. Defaults to YAPF, remembering what it formatted
+            for as long as the process lives.
+
+        Returns
+        -------
+        Constellation
+            The output Constellation.
+
+        Raises
+        ------
+        ValueError
+            If there are problems parsing the notebook.
+        """
+        return cls.from_ipynb_cells(nb["cells"], formatter)
+
+    @classmethod
+    def from_ipynb_cells(
+        cls, cells: Iterable[dict], formatter: Optional[CodeFormatter] = None
+    ) -> Constellation:
+        """Generates a Constellation from the cells of a notebook, which are only iterated over
+        once, in order, so they can be read as they're parsed: see ipynb.iter_cells().
+
+        Parameters
+        ----------
+        cells : Iterable[dict]
+            The cells, as they're stored in `.ipynb` files.
+        formatter : Optional[CodeFormatter]
+            What to format the code of Stars with: see from_ipynb_model().
 
         Returns
         -------
@@ -361,69 +795,71 @@ plt.close(fig)
             If there are problems parsing the notebook.
         """
         setup_cells = defaultdict(list)
-        filtered_cells = []
-        for cell in nb["cells"]:
-            if "source" in cell and not cell["source"]:
-                # ignore blank cells
-                pass
-            elif cell["source"][0].strip().lower() == ("#constellate: ignore"):
-                # print("Ignoring cell")
-                pass
-            else:
-                rows = [x.strip().lower() for x in cell["source"]]
-                if any([row.startswith("#constellate: setup") for row in rows]):
-                    logger.debug("Adding cell to setup")
-                    code = "".join(cell["source"])
-                    # if generic setup, apply to all cells
-                    setup_all = any(
-                        [row.strip().lower() == "#constellate: setup" for row in rows]
-                    )
-                    for type_ in PlotType:
-                        if (
-                            any(
-                                [
-                                    "#constellate: setup_" + type_.value.lower()
-                                    == row.strip().lower()
-                                    for row in rows
-                                ]
-                            )
-                            or setup_all
-                        ):
-                            setup_cells[type_].append(code)
+        shared_setup = []
+        # whether the outputs of each cell Stars are parsed from can be trusted, which they can't
+        # be if it didn't run in order, by position: cells are dropped once they're parsed
+        fresh: List[bool] = []
+
+        def star_cells() -> Iterator[dict]:
+            for cell, is_fresh in mark_fresh(cells):
+                if "source" in cell and not cell["source"]:
+                    # ignore blank cells
+                    pass
+                elif cell["source"][0].strip().lower() == ("#constellate: ignore"):
+                    # print("Ignoring cell")
+                    pass
                 else:
-                    filtered_cells.append(cell)
+                    rows = set([x.strip().lower() for x in cell["source"]])
+                    if any([row.startswith("#constellate: setup") for row in rows]):
+                        logger.debug("Adding cell to setup")
+                        code = "".join(cell["source"])
+                        # if generic setup, apply to all cells
+                        setup_all = "#constellate: setup" in rows
+                        if setup_all:
+                            shared_setup.append(code)
+                        for type_ in PlotType:
+                            if setup_all or "#constellate: setup_" + type_.value.lower() in rows:
+                                setup_cells[type_].append(code)
+                    else:
+                        fresh.append(is_fresh)
+                        yield cell
 
-        star_classes = sorted(NB_STARS, key=lambda c: -c.precedence)
         stars = []
-
-        def parse_next(curr_ind):
-            for cls in star_classes:
-                parse_out = cls.parse(filtered_cells[curr_ind:])
-                if parse_out is not None:
-                    return parse_out
-            return None
-
         curr_ind = 0
-        curr = parse_next(curr_ind)
-        while curr is not None:
-            (i, star) = curr
-            stars.append(star)
-            curr_ind += i
-            curr = parse_next(curr_ind)
-
-        if curr_ind < len(filtered_cells):
-            raise ValueError(
-                "Could not parse cell:\n{}\nPlot type:\n{}\nPrevious cell:\n{}".format(
-                    "".join(filtered_cells[curr_ind]["source"]),
-                    guess_plot_type(filtered_cells[curr_ind]),
-                    "".join(filtered_cells[curr_ind - 1]["source"]),
-                )
-            )
-
-        return cls(setup_cells, stars)
+        previous = None
+        # Stars are parsed as cells are read, so only the cells of the Star being parsed are kept
+        with formatting(formatter):
+            for consumed, star in iter_stars(star_cells()):
+                if star is None:
+                    raise ValueError(
+                        "Could not parse cell:\n{}\nPlot type:\n{}\nPrevious cell:\n{}".format(
+                            "".join(consumed[0]["source"]),
+                            guess_plot_type(consumed[0]),
+                            "".join(previous["source"]) if previous is not None else "",
+                        )
+                    )
+                consumed_fresh = fresh[curr_ind : curr_ind + len(consumed)]
+                if hasattr(star, "outputs") and not all(
+                    [
+                        is_fresh
+                        for cell, is_fresh in zip(consumed, consumed_fresh)
+                        if cell["cell_type"] == "code"
+                    ]
+                ):
+                    star.outputs = []
+                stars.append(star)
+                curr_ind += len(consumed)
+                previous = consumed[-1]
+
+        return cls(setup_cells, stars, shared_setup)
 
     @classmethod
-    def from_ipynb_file(cls, filename: PathLike) -> Constellation:
+    def from_ipynb_file(
+        cls,
+        filename: PathLike,
+        formatter: Optional[CodeFormatter] = None,
+        keep_stored_outputs: bool = False,
+    ) -> Constellation:
         """Generates a Constellation from a .ipynb file.
 
         Does not require a .ipynb ending.
@@ -432,6 +868,11 @@ plt.close(fig)
         ----------
         filename : PathLike
             The file name to read in.
+        formatter : Optional[CodeFormatter]
+            What to format the code of Stars with: see from_ipynb_model().
+        keep_stored_outputs : bool
+            Whether to keep the outputs save_all() needs to use stored outputs. Other outputs the
+            parser doesn't need, like images, are dropped as the file is read.
 
         Returns
         -------
@@ -439,38 +880,128 @@ plt.close(fig)
             The output Constellation.
         """
 
-        with open(str(filename), "r") as infile:
-            nb = json.load(infile)
+        # the file is read as it's parsed, so reading is part of parsing
+        with phase("parse"):
+            with open(str(filename), "r") as infile:
+                return cls.from_ipynb_cells(iter_cells(infile, keep_stored_outputs), formatter)
 
-        return cls.from_ipynb_model(nb)
+    def serialize(self, assets: Optional[AssetStore] = None) -> dict:
+        """Returns the Constellation as JSON data for the site.
 
-    def serialize(self) -> dict:
-        stars = [star.serialize() for star in self.stars]
-        for star, star_obj, star_id in zip(stars, self.stars, self.ids):
-            star["star_id"] = star_id
+        Parameters
+        ----------
+        assets : Optional[AssetStore]
+            If given, large artifacts are stored here and only referred to by URL: images are
+            replaced by their URL, pages of tables after the first by theirs, and other artifacts,
+            like Plotly figures, by a `<name>_url` key. Otherwise, everything is inline.
 
-            if star["kind"] == "markdown_matplotlib":
-                for color_mode in ("light", "dark"):
-                    star[color_mode] = self.mpl_images[f"{star_id}_{color_mode}"]
-            elif star["kind"] == "markdown_dataframe":
-                if not hasattr(star_obj, "df_json"):
-                    logger.warn(
-                        "You're serializing a Constellation without serializing the Pandas DataFrames."
-                    )
-                star["df_json"] = (
-                    star_obj.df_json if hasattr(star_obj, "df_json") else {}
-                )
+        Each Star with rendered artifacts also gets an `inputs` key, with the render key of each
+        artifact, which reuse_previous() uses.
+        """
+        data = self._serialize_lazily(assets)
+        data["stars"] = list(data["stars"])
+        return data
 
+    def _serialize_lazily(self, assets: Optional[AssetStore] = None) -> dict:
+        """Returns what serialize() does, but with an iterator that serializes each Star as it's
+        reached instead of the list of Stars."""
         setup = {"setup_" + name.value: code for name, code in self.setup.items()}
         return {
             **setup,
-            "stars": stars,
+            "stars": map(
+                lambda star_and_id: self._serialize_star(*star_and_id, assets),
+                zip(self.stars, self.ids),
+            ),
             "breadcrumbs": self.breadcrumbs,
             "title": self.title,
             "slug": self.slug,
             "star_titles": [title for level, title in self.outline],
         }
 
-    def to_file(self, savefile: PathLike):
-        with open(str(savefile), "w") as save:
-            json.dump(self.serialize(), save, indent=2)
+    def _serialize_star(
+        self, star_obj: Star, star_id: str, assets: Optional[AssetStore] = None
+    ) -> dict:
+        """Serializes one Star, with its artifacts: see serialize()."""
+        star = star_obj.serialize()
+        star["star_id"] = star_id
+
+        if star["kind"] == "markdown_matplotlib":
+            for color_mode in ("light", "dark"):
+                star[color_mode] = self.mpl_images[f"{star_id}_{color_mode}"]
+                if assets is not None:
+                    star[color_mode] = assets.add_image(star[color_mode])
+        elif star["kind"] == "markdown_dataframe":
+            if not hasattr(star_obj, "df_table"):
+                logger.warn(
+                    "You're serializing a Constellation without serializing the Pandas DataFrames."
+                )
+            star["df_table"] = (
+                star_obj.df_table if hasattr(star_obj, "df_table") else {}
+            )
+            if assets is not None and star["df_table"]:
+                star["df_table"] = store_pages(star["df_table"], assets)
+
+        inputs = {
+            field: self.render_keys[(field, star_id)]
+            for field in ("light", "dark", "df_table")
+            if (field, star_id) in self.render_keys
+        }
+        if inputs:
+            star["inputs"] = inputs
+
+        if assets is not None:
+            for name in EXTERNAL_ARTIFACTS:
+                if name in star:
+                    url = assets.add_json(star[name])
+                    if url is not None:
+                        del star[name]
+                        star[name + "_url"] = url
+        return star
+
+    def to_file(
+        self,
+        savefile: PathLike,
+        assets: Optional[AssetStore] = None,
+        compact: bool = False,
+        json_backend: str = "auto",
+    ):
+        """Writes the Constellation to a file.
+
+        Stars are serialized and written one at a time, so only one is held in memory as JSON.
+
+        Parameters
+        ----------
+        savefile : PathLike
+            The file to write.
+        assets : Optional[AssetStore]
+            Where to store large artifacts, if anywhere: see serialize().
+        compact : bool
+            Whether to leave out the indentation and spaces, which makes the file smaller but
+            harder to read.
+        json_backend : str
+            The library to encode JSON with, out of jsonio.JSON_BACKENDS. By default, orjson if
+            it's installed, which is much faster.
+
+        Raises
+        ------
+        ValueError
+            If the JSON backend is unknown or isn't installed.
+        """
+        savefile = Path(savefile)
+        # written to a temporary file first, so the site never reads a half-written file
+        fd, tmp_name = tempfile.mkstemp(dir=savefile.parent, suffix=".tmp")
+        try:
+            # serializing Stars happens as they're written, so the two are timed together
+            with phase("serialize_write"), os.fdopen(fd, "wb") as save:
+                write_json(save, self._serialize_lazily(assets), json_backend, compact)
+            os.chmod(tmp_name, new_file_mode())
+            os.replace(tmp_name, savefile)
+        except BaseException:
+            os.remove(tmp_name)
+            raise
+
+
+_RENDERERS = {
+    "matplotlib": Constellation._run_matplotlib,
+    "dataframe": Constellation._run_dataframe,
+}
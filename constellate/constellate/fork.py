@@ -0,0 +1,135 @@
+"""Runs code in forked child processes that share the parent's state copy-on-write."""
+
+import os
+import pickle
+import selectors
+import signal
+import sys
+import traceback
+from typing import Any, Callable, Sequence
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+
+def can_fork() -> bool:
+    """Returns whether this platform supports os.fork()."""
+    return hasattr(os, "fork")
+
+
+def _run_child(func: Callable[[Any], Any], args: Any, write_fd: int):
+    """Runs func(args) in a forked child, sends the pickled result to write_fd and exits.
+
+    This never returns: the child must not continue running the parent's code.
+    """
+    try:
+        try:
+            result = (True, func(args))
+        except BaseException:
+            result = (False, traceback.format_exc())
+        try:
+            data = pickle.dumps(result)
+        except Exception:
+            data = pickle.dumps((False, traceback.format_exc()))
+
+        with os.fdopen(write_fd, "wb") as outfile:
+            outfile.write(data)
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(0)
+
+
+def map_forked(
+    func: Callable[[Any], Any], tasks: Sequence[Any], max_children: int = 1
+) -> list:
+    """Returns [func(task) for task in tasks], running each call in its own forked child process.
+
+    Every child starts from a copy-on-write snapshot of this process, so func can freely modify
+    any state it inherits without affecting the other tasks, and nothing has to be copied up front.
+    Only the return value, which must be picklable, is sent back.
+
+    Forking a process with several threads is only safe if the other threads don't hold locks the
+    child needs, so call this from a process that isn't running other threads that do work.
+
+    Parameters
+    ----------
+    func : Callable[[Any], Any]
+        The function to run on each task.
+    tasks : Sequence[Any]
+        The arguments to func.
+    max_children : int
+        The number of children to run at once.
+
+    Returns
+    -------
+    list
+        The results, in the same order as tasks.
+
+    Raises
+    ------
+    RuntimeError
+        If func raised an error or a child exited without a result. The message includes the
+        child's traceback.
+    """
+    results = [None] * len(tasks)
+    # maps pipe read end to (pid, task index, received chunks)
+    running = {}
+    selector = selectors.DefaultSelector()
+    next_task = 0
+
+    # anything left in the buffers would be written once by each child otherwise
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    try:
+        while next_task < len(tasks) or running:
+            while next_task < len(tasks) and len(running) < max(max_children, 1):
+                read_fd, write_fd = os.pipe()
+                pid = os.fork()
+                if pid == 0:
+                    os.close(read_fd)
+                    _run_child(func, tasks[next_task], write_fd)
+
+                os.close(write_fd)
+                running[read_fd] = (pid, next_task, [])
+                selector.register(read_fd, selectors.EVENT_READ)
+                next_task += 1
+
+            for key, _events in selector.select():
+                read_fd = key.fd
+                pid, i, chunks = running[read_fd]
+                chunk = os.read(read_fd, 1 << 16)
+                if chunk:
+                    chunks.append(chunk)
+                    continue
+
+                # the child closed its end of the pipe, so it's done
+                selector.unregister(read_fd)
+                os.close(read_fd)
+                del running[read_fd]
+                _, status = os.waitpid(pid, 0)
+
+                if not chunks:
+                    raise RuntimeError(
+                        f"Forked process for task {i} exited with status {status} without a result"
+                    )
+                succeeded, value = pickle.loads(b"".join(chunks))
+                if not succeeded:
+                    raise RuntimeError(f"Error in forked process for task {i}:\n{value}")
+                results[i] = value
+    finally:
+        for read_fd, (pid, _i, _chunks) in running.items():
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+            selector.unregister(read_fd)
+            os.close(read_fd)
+        selector.close()
+
+    return results
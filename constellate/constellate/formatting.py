@@ -0,0 +1,180 @@
+"""Formats the code Stars show on the site, remembering the results.
+
+Formatting with YAPF is one of the slowest parts of parsing a notebook, and most cells are the same
+from one build to the next. Each CodeFormatter remembers the cells it formatted most recently for
+as long as it lives, and, with a cache, what it formatted across builds.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Iterator, MutableMapping, Optional
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+from .cache import RenderCache
+from .profile import phase
+
+# The formatters code can be formatted with. "none" leaves code as it's written.
+FORMATTERS = ("yapf", "black", "none")
+
+# Bump this whenever formatting changes in a way the formatter's version doesn't capture.
+FORMAT_CACHE_VERSION = 1
+
+# The package each formatter is in, whose version goes into cache keys.
+_PACKAGES = {"yapf": "yapf", "black": "black"}
+
+# How many sources each formatter remembers the formatted code of, the least recently used of which
+# are forgotten first. Long-lived processes like the dev worker see every version of every cell.
+MAX_REMEMBERED = 4096
+
+
+def _format_function(name: str) -> Callable[[str], str]:
+    """Returns the function that formats code with a formatter.
+
+    Raises
+    ------
+    ValueError
+        If the formatter is unknown or the package it needs isn't installed.
+    """
+    if name == "yapf":
+        from yapf.yapflib.yapf_api import FormatCode
+
+        return lambda code: FormatCode(code)[0]
+    elif name == "black":
+        try:
+            import black
+        except ImportError:
+            raise ValueError("Formatting with Black needs the black package: pip install black")
+        mode = black.Mode()
+        return lambda code: black.format_str(code, mode=mode)
+    elif name == "none":
+        return lambda code: code
+    else:
+        raise ValueError(
+            f"Unknown code formatter {name}: should be one of {', '.join(FORMATTERS)}"
+        )
+
+
+@lru_cache(maxsize=None)
+def _package_version(name: str) -> Optional[str]:
+    if name not in _PACKAGES:
+        return None
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:  # pragma: no cover
+        return None
+    try:
+        return version(_PACKAGES[name])
+    except PackageNotFoundError:
+        return None
+
+
+class CodeFormatter:
+    """Formats code with one of FORMATTERS, formatting each distinct source at most once."""
+
+    def __init__(
+        self,
+        name: str = "yapf",
+        cache: Optional[RenderCache] = None,
+        max_remembered: int = MAX_REMEMBERED,
+    ):
+        """Creates a formatter.
+
+        Parameters
+        ----------
+        name : str
+            The formatter to use, out of FORMATTERS.
+        cache : Optional[RenderCache]
+            If given, formatted code is reused from and saved to this cache, keyed by a hash of the
+            source, the formatter and its version. New entries are only saved by flush().
+        max_remembered : int
+            How many sources to remember the formatted code of in memory.
+
+        Raises
+        ------
+        ValueError
+            If the formatter is unknown or the package it needs isn't installed.
+        """
+        self.name = name
+        self.cache = cache
+        self._format = _format_function(name)
+        self._version = _package_version(name)
+        self.max_remembered = max_remembered
+        # formatted code by source, least recently used first
+        self._formatted: OrderedDict[str, str] = OrderedDict()
+        # formatted code by cache key, not yet saved to the cache
+        self._unsaved: MutableMapping[str, str] = {}
+
+    def __getstate__(self):
+        # the format function can't be pickled, and the sources are only useful to this process
+        return {"name": self.name, "cache": self.cache, "max_remembered": self.max_remembered}
+
+    def __setstate__(self, state):
+        self.__init__(state["name"], state["cache"], state["max_remembered"])
+
+    def key(self, code: str) -> str:
+        """Returns the cache key of the formatted code."""
+        payload = [FORMAT_CACHE_VERSION, self.name, self._version, code]
+        return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+
+    def format(self, code: str) -> str:
+        """Returns the formatted code."""
+        formatted = self._formatted.get(code)
+        if formatted is not None:
+            self._formatted.move_to_end(code)
+            return formatted
+
+        with phase("fix_code"):
+            if self.cache is not None:
+                key = self.key(code)
+                formatted = self.cache.get(key)
+            if not isinstance(formatted, str):
+                formatted = self._format(code)
+                if self.cache is not None:
+                    self._unsaved[key] = formatted
+
+        self._formatted[code] = formatted
+        if len(self._formatted) > self.max_remembered:
+            self._formatted.popitem(last=False)
+        return formatted
+
+    def flush(self):
+        """Saves the code formatted since the last flush to the cache, if there is one."""
+        if self.cache is not None and self._unsaved:
+            self.cache.put_many(self._unsaved)
+            logger.debug(f"Saved {len(self._unsaved)} formatted cells")
+        self._unsaved = {}
+
+
+# The formatters in use, innermost last. The first is used when none has been given, and lasts as
+# long as the process, so long-lived processes like the dev worker only format changed cells.
+_CURRENT = [CodeFormatter()]
+
+
+def current_formatter() -> CodeFormatter:
+    """Returns the formatter Stars format their code with: see formatting()."""
+    return _CURRENT[-1]
+
+
+@contextmanager
+def formatting(formatter: Optional[CodeFormatter] = None) -> Iterator[CodeFormatter]:
+    """Makes Stars created in the block format their code with formatter, if given, and saves what
+    it formatted to its cache afterwards."""
+    if formatter is None:
+        yield current_formatter()
+        return
+
+    _CURRENT.append(formatter)
+    try:
+        yield formatter
+    finally:
+        _CURRENT.remove(formatter)
+        formatter.flush()
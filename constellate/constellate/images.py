@@ -0,0 +1,393 @@
+"""Encodes Matplotlib figures as compact data URIs.
+
+Figures are saved as SVG when that's small enough and as a raster image when it isn't, like for a
+scatter plot of a hundred thousand points. SVGs are minified before they're encoded: coordinates
+are rounded, IDs are shortened or dropped and the metadata Matplotlib writes is removed. The data
+URI only escapes the characters that have to be escaped, instead of percent-encoding the whole
+SVG, which roughly doubles its size.
+
+The "adaptive" format goes further for figures that would be too big as SVG, like a trace plot of
+a long MCMC chain: it estimates how much each artist adds to the SVG before saving it, and
+rasterizes only the heaviest ones, so the data is an embedded image but the axes and text stay
+sharp. Figures that are still too big are saved as a raster image.
+"""
+from __future__ import annotations
+
+import base64
+import io
+import re
+from typing import Any, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+# The image formats Matplotlib figures can be saved as. "auto" picks between SVG and the raster
+# format for each figure, and "adaptive" can also rasterize heavy artists within an SVG.
+IMAGE_FORMATS = ("auto", "adaptive", "svg", "png", "webp")
+RASTER_FORMATS = ("png", "webp")
+
+# SVG attributes that only hold coordinates and lengths, which are safe to round. Transforms are
+# left alone, because glyphs are scaled by small factors like 0.015625.
+_GEOMETRY_ATTRS = (
+    "d", "x", "y", "x1", "y1", "x2", "y2", "cx", "cy", "r", "width", "height", "points"
+)
+_GEOMETRY_RE = re.compile(r'(\s(?:{})=")([^"]*)"'.format("|".join(_GEOMETRY_ATTRS)))
+_DECIMAL_RE = re.compile(r"-?\d+\.\d+")
+_PATH_COMMAND_RE = re.compile(r" ?([MLQCZzHVASTmlqchvast]) ?")
+_STYLE_RE = re.compile(r'(\sstyle=")([^"]*)"')
+_ID_RE = re.compile(r'\sid="([^"]*)"')
+_REF_RE = re.compile(r'(href="#|url\(#)([^")]+)')
+_ESCAPE_RE = re.compile(r"[%#]|[^ -~]")
+
+# The first character of an XML ID can't be a digit.
+_ID_START_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_ID_CHARS = _ID_START_CHARS + "0123456789"
+
+# Rough sizes, in bytes, of the parts of a minified SVG, for estimating how much each artist adds
+# to it: a marker, a vertex of a path, and anything else, like a tick or a piece of text.
+_MARKER_BYTES = 100
+_VERTEX_BYTES = 12
+_ARTIST_BYTES = 150
+
+# Estimates are rough, so "adaptive" saves figures estimated to be up to this many times their
+# budget as SVG, to see if they fit, before rasterizing anything.
+_ESTIMATE_SLACK = 2
+
+# Artists estimated to add less than this are never rasterized on their own: each one becomes a
+# separate image, which costs more than drawing a few small shapes.
+_MIN_RASTERIZED_BYTES = 8192
+
+
+class ImageOptions:
+    """How Matplotlib figures are encoded.
+
+    Set in the `[images]` table of `constellate.toml`: see ConstellateConfig.
+    """
+
+    def __init__(
+        self,
+        format: str = "auto",
+        raster_format: str = "png",
+        max_svg_kb: float = 256,
+        max_elements: int = 5000,
+        dpi: int = 200,
+        precision: int = 2,
+        budget_kb: float = 512,
+    ):
+        """Creates the options.
+
+        Parameters
+        ----------
+        format : str
+            One of IMAGE_FORMATS.
+        raster_format : str
+            The format used when "auto" decides against SVG: "png" or "webp".
+        max_svg_kb : float
+            With "auto", figures whose SVG data URI would be larger than this, in kilobytes, are
+            saved in raster_format instead.
+        max_elements : int
+            With "auto", figures with more elements than this are saved in raster_format without
+            trying SVG first. Each point in a scatter plot or marker on a line is one element.
+        dpi : int
+            The resolution of raster images.
+        precision : int
+            The number of decimal places SVG coordinates are rounded to. Coordinates are in points,
+            so 2 is far below what can be seen.
+        budget_kb : float
+            With "adaptive", the size in kilobytes that the images of a Star, one per theme, should
+            fit in together. Heavy artists are rasterized to fit a figure in its share, and figures
+            that still don't fit are saved in raster_format.
+
+        Raises
+        ------
+        ValueError
+            If format or raster_format isn't supported.
+        """
+        if format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown image format {format}, should be one of {IMAGE_FORMATS}")
+        if raster_format not in RASTER_FORMATS:
+            raise ValueError(
+                f"Unknown raster format {raster_format}, should be one of {RASTER_FORMATS}"
+            )
+        self.format = format
+        self.raster_format = raster_format
+        self.max_svg_kb = max_svg_kb
+        self.max_elements = max_elements
+        self.dpi = dpi
+        self.precision = precision
+        self.budget_kb = budget_kb
+
+    @property
+    def key(self) -> list:
+        """The options, as a JSON-serializable value for cache keys."""
+        return [
+            self.format,
+            self.raster_format,
+            self.max_svg_kb,
+            self.max_elements,
+            self.dpi,
+            self.precision,
+            self.budget_kb,
+        ]
+
+
+def count_elements(fig) -> int:
+    """Returns roughly how many elements a figure draws, which is what the size of its SVG grows
+    with: one per point of each collection or marker of each line, and one per other artist."""
+    from matplotlib.collections import Collection
+    from matplotlib.lines import Line2D
+
+    total = 0
+    for artist in fig.findobj():
+        if isinstance(artist, Collection):
+            total += max(len(artist.get_offsets()), len(artist.get_paths()), 1)
+        elif isinstance(artist, Line2D) and artist.get_marker() not in (None, "None", "", " "):
+            total += max(len(artist.get_xydata()), 1)
+        else:
+            total += 1
+    return total
+
+
+def _artist_bytes(artist) -> int:
+    """Returns roughly how many bytes an artist adds to a minified SVG: see count_elements()."""
+    from matplotlib.collections import Collection
+    from matplotlib.lines import Line2D
+    from matplotlib.patches import Patch
+
+    if isinstance(artist, Collection):
+        # markers of a scatter plot are drawn once and placed at each offset
+        vertices = sum([len(path.vertices) for path in artist.get_paths()])
+        return len(artist.get_offsets()) * _MARKER_BYTES + vertices * _VERTEX_BYTES
+    elif isinstance(artist, Line2D):
+        size = len(artist.get_xydata()) * _VERTEX_BYTES if artist.get_linestyle() != "None" else 0
+        if artist.get_marker() not in (None, "None", "", " "):
+            size += len(artist.get_xydata()) * _MARKER_BYTES
+        return max(size, _ARTIST_BYTES)
+    elif isinstance(artist, Patch):
+        return len(artist.get_path().vertices) * _VERTEX_BYTES + _ARTIST_BYTES
+    else:
+        return _ARTIST_BYTES
+
+
+def heavy_artists(fig, budget: float) -> Tuple[int, List[Any]]:
+    """Returns the estimated size of a figure as a minified SVG, in bytes, and the artists to
+    rasterize, heaviest first, to bring the rest of it down to half of budget. The other half is
+    left for the images the rasterized artists become.
+
+    Only artists drawn by Axes can be rasterized on their own, and those estimated to add less
+    than _MIN_RASTERIZED_BYTES never are, so the rest may not come down far enough.
+    """
+    from matplotlib.axes import Axes
+    from matplotlib.collections import Collection
+    from matplotlib.lines import Line2D
+    from matplotlib.patches import Patch
+
+    total = 0
+    candidates = []
+    for artist in fig.findobj():
+        size = _artist_bytes(artist)
+        total += size
+        if (
+            isinstance(artist, (Collection, Line2D, Patch))
+            and isinstance(artist.axes, Axes)
+            and not artist.get_rasterized()
+            and size >= _MIN_RASTERIZED_BYTES
+        ):
+            candidates.append((size, artist))
+
+    heavy = []
+    remaining = total
+    for size, artist in sorted(candidates, key=lambda candidate: -candidate[0]):
+        if remaining <= budget / 2:
+            break
+        heavy.append(artist)
+        remaining -= size
+    return (total, heavy)
+
+
+def _format_decimal(value: float, precision: int) -> str:
+    text = f"{value:.{precision}f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def _short_ids() -> Iterator[str]:
+    """Yields a, b, ..., Z, a0, a1, ...: the shortest valid XML IDs, in order."""
+    n = 0
+    while True:
+        i = n
+        chars = [_ID_START_CHARS[i % len(_ID_START_CHARS)]]
+        i //= len(_ID_START_CHARS)
+        while i:
+            i -= 1
+            chars.append(_ID_CHARS[i % len(_ID_CHARS)])
+            i //= len(_ID_CHARS)
+        yield "".join(chars)
+        n += 1
+
+
+def minify_svg(svg: str, precision: int = 2) -> str:
+    """Returns a smaller SVG that looks the same.
+
+    Written for the SVGs Matplotlib makes, not arbitrary ones.
+
+    Parameters
+    ----------
+    svg : str
+        The SVG, starting with the <svg> tag.
+    precision : int
+        The number of decimal places coordinates are rounded to.
+    """
+    svg = re.sub(r"<metadata>.*?</metadata>", "", svg, flags=re.DOTALL)
+    svg = re.sub(r"<!--.*?-->", "", svg, flags=re.DOTALL)
+    svg = re.sub(r">\s+<", "><", svg)
+    # empty groups, like those for axes without ticks
+    svg = svg.replace("<g/>", "")
+
+    # IDs that are referred to get the shortest ones available, and the rest are removed
+    referenced = set([ref for _prefix, ref in _REF_RE.findall(svg)])
+    short_ids = {}
+    new_ids = _short_ids()
+    for old_id in _ID_RE.findall(svg):
+        if old_id in referenced and old_id not in short_ids:
+            short_ids[old_id] = next(new_ids)
+
+    def replace_id(match: re.Match) -> str:
+        new_id = short_ids.get(match.group(1))
+        return "" if new_id is None else f' id="{new_id}"'
+
+    svg = _ID_RE.sub(replace_id, svg)
+    svg = _REF_RE.sub(
+        lambda m: m.group(1) + short_ids.get(m.group(2), m.group(2)), svg
+    )
+
+    def round_geometry(match: re.Match) -> str:
+        value = _DECIMAL_RE.sub(
+            lambda m: _format_decimal(float(m.group(0)), precision), match.group(2)
+        )
+        if match.group(1).strip() == 'd="':
+            value = _PATH_COMMAND_RE.sub(r"\1", value).strip()
+        return f'{match.group(1)}{value}"'
+
+    svg = _GEOMETRY_RE.sub(round_geometry, svg)
+    svg = _STYLE_RE.sub(
+        lambda m: m.group(1) + re.sub(r"([:;])\s+", r"\1", m.group(2)) + '"', svg
+    )
+    return svg
+
+
+def svg_data_uri(svg: str) -> str:
+    """Returns a data URI for an SVG.
+
+    Data URIs don't need most characters escaped: only "%" and "#", which would otherwise be
+    read as an escape or the start of a fragment, and characters outside printable ASCII.
+    """
+    return "data:image/svg+xml;utf8," + _ESCAPE_RE.sub(
+        lambda m: quote(m.group(0), safe=""), svg
+    )
+
+
+def _save_svg(fig, dpi: Optional[int] = None) -> str:
+    bio = io.BytesIO()
+    # the dpi is only used for rasterized artists
+    kwargs = {} if dpi is None else {"dpi": dpi}
+    fig.savefig(bio, format="svg", bbox_inches="tight", metadata={"Date": None}, **kwargs)
+    # get rid of xml tag, just include svg
+    svg = bio.getvalue().decode()
+    return svg[svg.find("<svg") :].replace("\n", "")
+
+
+def _save_raster(fig, image_format: str, dpi: int) -> str:
+    bio = io.BytesIO()
+    if image_format == "png":
+        # leaving out the version keeps the output the same across Matplotlib versions
+        fig.savefig(bio, format="png", dpi=dpi, bbox_inches="tight", metadata={"Software": None})
+    else:
+        fig.savefig(
+            bio, format=image_format, dpi=dpi, bbox_inches="tight", pil_kwargs={"lossless": True}
+        )
+    encoded = base64.b64encode(bio.getvalue()).decode("ascii")
+    return f"data:image/{image_format};base64,{encoded}"
+
+
+def _encode_adaptive(fig, options: ImageOptions, budget: float) -> Tuple[str, str]:
+    """Saves a figure as an SVG if it fits in budget bytes, then as one with its heaviest artists
+    rasterized if that fits, and as a raster image otherwise, or whichever of those is smallest if
+    none of them fit. Returns the data URI and the format it ended up in."""
+    total, heavy = heavy_artists(fig, budget)
+    encoded = []
+    if total <= budget * _ESTIMATE_SLACK:
+        uri = svg_data_uri(minify_svg(_save_svg(fig), options.precision))
+        if len(uri) <= budget:
+            return (uri, "svg")
+        encoded.append((uri, "svg"))
+
+    if heavy:
+        try:
+            for artist in heavy:
+                artist.set_rasterized(True)
+            svg = _save_svg(fig, options.dpi)
+        finally:
+            # the figure is restyled and encoded again for the other themes
+            for artist in heavy:
+                artist.set_rasterized(False)
+        uri = svg_data_uri(minify_svg(svg, options.precision))
+        if len(uri) <= budget:
+            return (uri, f"svg with {len(heavy)} rasterized artists")
+        encoded.append((uri, f"svg with {len(heavy)} rasterized artists"))
+
+    encoded.append((_save_raster(fig, options.raster_format, options.dpi), options.raster_format))
+    return min(encoded, key=lambda uri_format: len(uri_format[0]))
+
+
+def encode_figure(fig, options: ImageOptions, budget_kb: Optional[float] = None) -> str:
+    """Saves a figure as a data URI, logging its size before and after encoding it compactly.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        The figure.
+    options : ImageOptions
+        How to encode it.
+    budget_kb : Optional[float]
+        With "adaptive", the size in kilobytes the image should fit in. Defaults to the whole of
+        options.budget_kb.
+
+    Returns
+    -------
+    str
+        The data URI.
+    """
+    if options.format == "adaptive":
+        budget = (budget_kb if budget_kb is not None else options.budget_kb) * 1024
+        uri, image_format = _encode_adaptive(fig, options, budget)
+        logger.debug(f"Encoded {image_format} image: {len(uri):,} bytes encoded")
+        return uri
+
+    image_format = options.format
+    if image_format == "auto" and count_elements(fig) > options.max_elements:
+        image_format = options.raster_format
+
+    # the size of the plain, percent-encoded SVG older versions wrote, if it was made
+    before = None
+    if image_format in ("auto", "svg"):
+        svg = _save_svg(fig)
+        before = len("data:image/svg+xml;utf8," + quote(svg))
+        uri = svg_data_uri(minify_svg(svg, options.precision))
+        if image_format == "auto" and len(uri) > options.max_svg_kb * 1024:
+            image_format = options.raster_format
+        else:
+            image_format = "svg"
+
+    if image_format != "svg":
+        uri = _save_raster(fig, image_format, options.dpi)
+
+    logger.debug(
+        f"Encoded {image_format.upper()} image: "
+        + (f"{before:,} bytes as plain SVG, " if before is not None else "")
+        + f"{len(uri):,} bytes encoded"
+    )
+    return uri
@@ -0,0 +1,185 @@
+"""Reads notebooks a cell at a time, keeping only the outputs Constellate uses.
+
+Saved notebooks can be hundreds of megabytes, almost all of it images and HTML in the outputs of
+cells, most of which Constellate never reads: Matplotlib figures are rendered again, and Markdown
+cells have no outputs. Reading the whole file with `json.load` keeps all of it in memory at once.
+iter_cells() instead decodes one cell at a time and drops what the parser doesn't need before
+reading the next, so memory holds the cells kept so far, pruned, and at most one whole cell.
+"""
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, Iterator, TextIO
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+# The output MIME types Stars are parsed from. The others are replaced by None: guess_plot_type()
+# only checks whether they're there.
+PARSED_MIME_TYPES = frozenset(
+    [
+        "text/plain",
+        "text/html",
+        "application/vnd.plotly.v1+json",
+        "application/vnd.vegalite.v4+json",
+    ]
+)
+
+# The output MIME types stored outputs are read from: see outputs.py.
+STORED_MIME_TYPES = frozenset(
+    ["image/png", "image/svg+xml", "application/vnd.dataresource+json"]
+)
+
+# How many characters are read at first. Reads grow with what's left undecoded, so a cell too big
+# for one read takes a number of reads logarithmic in its size.
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+
+# Characters that can go on a number, such as the ".5" of "-0.5" after "-0".
+_NUMBER_TAIL_RE = re.compile(r"[0-9.eE+-]*\Z")
+
+
+def prune_cell(cell: dict, keep_stored: bool = False) -> dict:
+    """Drops what parsing a cell doesn't use, in place, and returns it.
+
+    Output data of MIME types outside PARSED_MIME_TYPES is replaced by None, and attachments of
+    Markdown cells, which aren't shown, are dropped.
+
+    Parameters
+    ----------
+    cell : dict
+        The cell.
+    keep_stored : bool
+        Whether to also keep STORED_MIME_TYPES, for building from stored outputs.
+    """
+    cell.pop("attachments", None)
+    for output in cell.get("outputs", []):
+        data = output.get("data")
+        if not data:
+            continue
+        for mime_type in data:
+            if mime_type in PARSED_MIME_TYPES or (keep_stored and mime_type in STORED_MIME_TYPES):
+                continue
+            data[mime_type] = None
+    return cell
+
+
+class _Stream:
+    """The JSON text of a file, decoded a value at a time."""
+
+    def __init__(self, infile: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.infile = infile
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read(self) -> bool:
+        """Reads more of the file into the buffer, dropping what's been decoded. Returns False if
+        the file has ended."""
+        if self.eof:
+            return False
+        pending = self.buffer[self.pos :]
+        chunk = self.infile.read(max(self.chunk_size, len(pending)))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = pending + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Returns the next character that isn't whitespace, without consuming it, or "" at the end
+        of the file."""
+        while True:
+            self.pos = _WHITESPACE_RE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        """Consumes the next character that isn't whitespace, which has to be one of chars, and
+        returns it."""
+        char = self.peek()
+        if not char or char not in chars:
+            found = repr(char) if char else "the end of the file"
+            raise ValueError(f"Expected one of {chars!r} in notebook, found {found}")
+        self.pos += 1
+        return char
+
+    def value(self) -> Any:
+        """Decodes the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # the value may go on past the buffer
+                if not self._read():
+                    raise
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                # so may a number that decoded without an error, if nothing after it ends it
+                if _NUMBER_TAIL_RE.match(self.buffer, end) and self._read():
+                    continue
+            self.pos = end
+            return value
+
+
+def iter_cells(
+    infile: TextIO, keep_stored: bool = False, chunk_size: int = CHUNK_SIZE
+) -> Iterator[dict]:
+    """Yields the cells of a notebook file one at a time, pruned by prune_cell(), as they're read.
+
+    Parameters
+    ----------
+    infile : TextIO
+        The notebook file.
+    keep_stored : bool
+        Whether to keep the outputs needed to build from stored outputs.
+    chunk_size : int
+        How many characters to read at first.
+
+    Raises
+    ------
+    ValueError
+        If the file isn't a notebook, or isn't valid JSON.
+    """
+    stream = _Stream(infile, chunk_size)
+    stream.expect("{")
+    if stream.peek() == "}":
+        raise ValueError("Notebook has no cells")
+
+    found_cells = False
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if key == "cells":
+            found_cells = True
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.expect("]")
+            else:
+                while True:
+                    cell = stream.value()
+                    if not isinstance(cell, dict):
+                        raise ValueError(f"Notebook cell isn't an object: {cell!r}")
+                    yield prune_cell(cell, keep_stored)
+                    if stream.expect(",]") == "]":
+                        break
+        else:
+            # metadata and the format version, which parsing doesn't use
+            stream.value()
+
+        if stream.expect(",}") == "}":
+            break
+
+    if not found_cells:
+        raise ValueError("Notebook has no cells")
@@ -0,0 +1,150 @@
+"""Writes large JSON documents piece by piece, with orjson if it's installed.
+
+Constellations are mostly images and tables, and can be many megabytes. Serializing one into a
+single dict and writing it with `json.dump` keeps all of it in memory twice, as the dict and as the
+encoder's output, and indenting it uses the standard library's pure-Python encoder. write_json()
+instead encodes one item of a top-level list at a time, as it's produced.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, Mapping
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+# The libraries JSON can be encoded with. "auto" uses orjson if it's installed, and json otherwise.
+JSON_BACKENDS = ("auto", "orjson", "json")
+
+
+def _json_encoder(compact: bool) -> Callable[[Any], bytes]:
+    if compact:
+        return lambda value: json.dumps(value, separators=(",", ":")).encode("utf-8")
+    else:
+        return lambda value: json.dumps(value, indent=2).encode("utf-8")
+
+
+def _orjson_encoder(compact: bool) -> Callable[[Any], bytes]:
+    import orjson
+
+    option = 0 if compact else orjson.OPT_INDENT_2
+    fallback = _json_encoder(compact)
+
+    def encode(value):
+        try:
+            return orjson.dumps(value, option=option)
+        except TypeError:
+            # values orjson doesn't support, like integers over 64 bits
+            return fallback(value)
+
+    return encode
+
+
+def json_encoder(backend: str = "auto", compact: bool = False) -> Callable[[Any], bytes]:
+    """Returns a function that encodes a value as UTF-8 JSON.
+
+    The json backend escapes non-ASCII text and writes NaN as is, like `json.dump`. orjson writes
+    the text as UTF-8 and NaN as null, and is much faster, especially when indenting.
+
+    Parameters
+    ----------
+    backend : str
+        The library to use, out of JSON_BACKENDS.
+    compact : bool
+        Whether to leave out the indentation and spaces. Otherwise, values are indented by two
+        spaces.
+
+    Raises
+    ------
+    ValueError
+        If the backend is unknown, or is orjson and it isn't installed.
+    """
+    if backend == "json":
+        return _json_encoder(compact)
+    elif backend in ("auto", "orjson"):
+        try:
+            return _orjson_encoder(compact)
+        except ImportError:
+            if backend == "orjson":
+                raise ValueError("The orjson backend needs the orjson package: pip install orjson")
+            return _json_encoder(compact)
+    else:
+        raise ValueError(
+            f"Unknown JSON backend {backend}: should be one of {', '.join(JSON_BACKENDS)}"
+        )
+
+
+def _indented(encoded: bytes, depth: int) -> bytes:
+    # newlines in strings are escaped, so every newline is between tokens
+    return encoded.replace(b"\n", b"\n" + b"  " * depth)
+
+
+def iter_json(
+    obj: Mapping[str, Any], backend: str = "auto", compact: bool = False
+) -> Iterator[bytes]:
+    """Yields an object as UTF-8 JSON, a piece at a time. Values that are iterators, rather than
+    lists, are written as lists, encoding each item as it's produced.
+
+    With the json backend, the pieces join to exactly what `json.dump` writes with `indent=2`, or
+    with `separators=(",", ":")` if compact.
+
+    Parameters
+    ----------
+    obj : Mapping[str, Any]
+        The object.
+    backend, compact
+        How to encode it: see json_encoder().
+    """
+    encode = json_encoder(backend, compact)
+    if not obj:
+        yield b"{}"
+        return
+
+    if compact:
+        open_obj, item_sep, key_sep, close_obj = b"{", b",", b":", b"}"
+    else:
+        open_obj, item_sep, key_sep, close_obj = b"{\n  ", b",\n  ", b": ", b"\n}"
+
+    yield open_obj
+    for i, (key, value) in enumerate(obj.items()):
+        if i > 0:
+            yield item_sep
+        yield encode(key) + key_sep
+        if isinstance(value, Iterator):
+            yield from _iter_list(value, encode, compact)
+        elif compact:
+            yield encode(value)
+        else:
+            yield _indented(encode(value), 1)
+    yield close_obj
+
+
+def _iter_list(
+    items: Iterable[Any], encode: Callable[[Any], bytes], compact: bool
+) -> Iterator[bytes]:
+    """Yields a list that's the value of a key of a top-level object, encoding each item in turn."""
+    if compact:
+        open_list, item_sep, close_list = b"[", b",", b"]"
+    else:
+        open_list, item_sep, close_list = b"[\n    ", b",\n    ", b"\n  ]"
+
+    empty = True
+    for item in items:
+        if empty:
+            yield open_list
+            empty = False
+        else:
+            yield item_sep
+        yield encode(item) if compact else _indented(encode(item), 2)
+    yield b"[]" if empty else close_list
+
+
+def write_json(
+    outfile: BinaryIO, obj: Mapping[str, Any], backend: str = "auto", compact: bool = False
+):
+    """Writes an object as UTF-8 JSON to a binary file, a piece at a time: see iter_json()."""
+    for piece in iter_json(obj, backend, compact):
+        outfile.write(piece)
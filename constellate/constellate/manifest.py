@@ -0,0 +1,166 @@
+"""Writes the site manifest and per-Star shards the Next.js site builds its pages from.
+
+Every page of the site needs the outline of its Constellation, but only its own Star. So instead of
+every page reading every `.constellate` file in full, the site reads:
+
+- `manifest.json`, with a short summary of each Constellation: its title, outline and number of
+  Stars,
+- `covers.json`, with the cover images of each Constellation, which only the index page needs, and
+- `shards/<slug>/<index>.json`, with a single serialized Star.
+
+Both are derived from the `.constellate` files in the same directory, which stay the canonical
+output of a build. Shards are only rewritten for Constellations whose files changed.
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tempfile
+from os import PathLike
+from pathlib import Path
+from typing import Optional, Tuple
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+from .cache import new_file_mode
+
+MANIFEST_NAME = "manifest.json"
+COVERS_NAME = "covers.json"
+SHARD_DIR_NAME = "shards"
+MANIFEST_VERSION = 2
+
+
+def _write_atomic(path: Path, data: str):
+    """Writes data to path, unless path already has exactly that content."""
+    try:
+        if path.read_text(encoding="utf-8") == data:
+            return
+    except OSError:
+        pass
+
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as outfile:
+            outfile.write(data)
+        os.chmod(tmp_name, new_file_mode())
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _cover(data: dict) -> Optional[dict]:
+    """Returns the light and dark images of the first Matplotlib Star, for the index page."""
+    for star in data["stars"]:
+        if star["kind"] == "markdown_matplotlib":
+            return {"light": star.get("light"), "dark": star.get("dark")}
+    return None
+
+
+def shard_constellation(
+    data: dict, slug: str, shard_dir: PathLike
+) -> Tuple[dict, Optional[dict]]:
+    """Writes one shard per Star of a serialized Constellation and returns its manifest entry and
+    cover.
+
+    Parameters
+    ----------
+    data : dict
+        The serialized Constellation, as in a `.constellate` file.
+    slug : str
+        The Constellation's slug, which is its URL.
+    shard_dir : PathLike
+        The directory to write the shards to. Shards from previous builds with more Stars are
+        removed.
+    """
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    for i, star in enumerate(data["stars"]):
+        _write_atomic(shard_dir / f"{i}.json", _dumps(star))
+
+    num_stars = len(data["stars"])
+    for path in shard_dir.glob("*.json"):
+        if not path.stem.isdigit() or int(path.stem) >= num_stars:
+            path.unlink()
+
+    entry = {
+        "slug": slug,
+        "title": data["title"],
+        "star_titles": data["star_titles"],
+        "star_ids": [star["star_id"] for star in data["stars"]],
+        "breadcrumbs": data["breadcrumbs"],
+        "num_stars": num_stars,
+    }
+    return (entry, _cover(data))
+
+
+def update_manifest(constellation_dir: PathLike):
+    """Brings the manifest, covers and shards in a directory up to date with its `.constellate`
+    files.
+
+    Constellations whose files haven't changed since the manifest was last written keep their
+    entries, covers and shards as is. Those of files that were removed are removed too.
+
+    Parameters
+    ----------
+    constellation_dir : PathLike
+        The directory with the `.constellate` files.
+    """
+    constellation_dir = Path(constellation_dir)
+    manifest_path = constellation_dir / MANIFEST_NAME
+    covers_path = constellation_dir / COVERS_NAME
+    shard_root = constellation_dir / SHARD_DIR_NAME
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as infile:
+            old = json.load(infile)
+        if old.get("version") != MANIFEST_VERSION:
+            raise ValueError("Old manifest version")
+        old_entries = {entry["slug"]: entry for entry in old["constellations"]}
+        with open(covers_path, "r", encoding="utf-8") as infile:
+            old_covers = json.load(infile)
+        if old_covers.get("version") != MANIFEST_VERSION:
+            raise ValueError("Old covers version")
+        old_covers = old_covers["covers"]
+    except (OSError, ValueError, KeyError):
+        old_entries = {}
+        old_covers = {}
+
+    entries = []
+    covers = {}
+    for fn in sorted(constellation_dir.glob("*.constellate")):
+        slug = fn.name.split(".")[0]
+        stat = fn.stat()
+        source = [stat.st_mtime_ns, stat.st_size]
+        entry = old_entries.get(slug)
+        if entry is None or entry.get("source") != source or slug not in old_covers:
+            logger.debug(f"Sharding {fn.name}")
+            with open(fn, "r", encoding="utf-8") as infile:
+                data = json.load(infile)
+            entry, cover = shard_constellation(data, slug, shard_root / slug)
+            entry["source"] = source
+        else:
+            cover = old_covers[slug]
+        entries.append(entry)
+        covers[slug] = cover
+
+    slugs = set([entry["slug"] for entry in entries])
+    if shard_root.exists():
+        for path in shard_root.iterdir():
+            if path.is_dir() and path.name not in slugs:
+                shutil.rmtree(path)
+
+    # covers are written first, so a manifest is never newer than the covers it was written with
+    _write_atomic(covers_path, _dumps({"version": MANIFEST_VERSION, "covers": covers}))
+    _write_atomic(
+        manifest_path, _dumps({"version": MANIFEST_VERSION, "constellations": entries})
+    )
@@ -0,0 +1,267 @@
+"""Builds the global state that setup cells create, which Stars are then run in."""
+from __future__ import annotations
+
+from copy import deepcopy
+from types import FunctionType
+from typing import Callable, Mapping, MutableMapping, Optional, Sequence, Tuple
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+from .profile import phase
+from .snapshot import SnapshotCache, dump_namespace, load_namespace, snapshot_key
+from .star import PlotType
+
+
+def run_setup(setup_cells: Sequence[str], namespace: Optional[dict] = None) -> dict:
+    """Runs the setup cells and returns the resulting global namespace.
+
+    Parameters
+    ----------
+    setup_cells : Sequence[str]
+        The setup cells to run.
+    namespace : Optional[dict]
+        The namespace to run the cells in, which is modified. Defaults to a new, empty one.
+    """
+    global_state = {} if namespace is None else namespace
+    for cell in setup_cells:
+        exec(cell, global_state)
+    return global_state
+
+
+def split_state(global_state: dict) -> Tuple[dict, dict]:
+    """Splits a global namespace into a copyable and non-copyable component.
+
+    Returns:
+
+    (state, mods), where state is the copyable objects from the global state
+    (most variables) and mods is what can't be copied, which is usually
+    things like modules. Any modifications to modules are therefore shared
+    across cells.
+    """
+    # Rerunning all of the setup files every plot is very time-consuming if
+    # you have a setup that runs a big analysis. At the same time, deep
+    # copying doesn't work for modules. The hack I use to get around this
+    # right now is to simply not deep copy modules and deep copy everything
+    # else. Forking (see fork.py) avoids this entirely where it's available.
+
+    # there's a very subtle nuance of the way Python handles functions that
+    # we need to properly handle. When a function is defined, Python stores
+    # the global variables at the time of that definition in
+    # func.__globals__. This means that if you define a function and then
+    # re-define globals, the function will still work. The problem is that
+    # it's a shallow copy. So, if we remove those keys from the global
+    # namespace so we can deep copy it, it removes those names from the
+    # function itself, and you are left without even built-in names. To get
+    # around this, we make sure that we don't modify global_state or where
+    # it lies in memory.
+
+    global_mods = {}
+    new_global_state = {}
+    for k in list(global_state.keys()):
+        try:
+            deepcopy(global_state[k])
+            new_global_state[k] = global_state[k]
+        except TypeError as e:
+            global_mods[k] = global_state[k]
+
+    return (new_global_state, global_mods)
+
+
+def copying_scopes(global_state: dict, global_mods: dict) -> Callable[[], dict]:
+    """Returns a function that makes a fresh scope from the copyable and non-copyable global state
+    returned by split_state()."""
+
+    def new_scope():
+        with phase("copy_state"):
+            scope = deepcopy(global_state)
+        scope.update(global_mods)
+        return scope
+
+    return new_scope
+
+
+def _rebind(func: FunctionType, globals_: dict) -> FunctionType:
+    """Returns a copy of a function that uses globals_ as its global namespace."""
+    copy = FunctionType(func.__code__, globals_, func.__name__, func.__defaults__, func.__closure__)
+    copy.__kwdefaults__ = func.__kwdefaults__
+    copy.__dict__.update(func.__dict__)
+    copy.__qualname__ = func.__qualname__
+    copy.__module__ = func.__module__
+    copy.__doc__ = func.__doc__
+    copy.__annotations__ = func.__annotations__
+    return copy
+
+
+def layer_namespace(base: dict, global_state: dict, global_mods: dict) -> dict:
+    """Returns a copy of a namespace that cells can be run on top of without changing it.
+
+    Functions defined in base are copied with the new namespace as their globals, wherever they
+    are in it, so they see the names later cells rebind, as they would if every cell ran in one
+    namespace. Classes defined in base still refer to base.
+
+    Parameters
+    ----------
+    base : dict
+        The namespace.
+    global_state, global_mods : dict
+        split_state(base).
+    """
+    layer: dict = {}
+    # deepcopy() uses the rebound function wherever it comes across the original
+    memo = {
+        id(value): _rebind(value, layer)
+        for value in base.values()
+        if isinstance(value, FunctionType) and value.__globals__ is base
+    }
+    layer.update(deepcopy(global_state, memo))
+    layer.update(global_mods)
+    return layer
+
+
+def _own_cells(shared: Sequence[str], cells: Sequence[str]) -> Sequence[str]:
+    """Returns the cells of a plot type from its first cell that isn't a shared one on."""
+    i = 0
+    for j, cell in enumerate(cells):
+        if i < len(shared) and cell == shared[i]:
+            i += 1
+        else:
+            return cells[j:]
+    return ()
+
+
+class SetupNamespaces:
+    """The global state for each plot type, built in layers.
+
+    Generic setup cells (`#constellate: setup`) are shared by every plot type, so they're run
+    exactly once, into a base namespace. Plot types without setup cells of their own (e.g.,
+    `#constellate: setup_matplotlib`) use that base. The others run their own cells on top of a
+    copy of it, made by layer_namespace(), so functions defined in shared cells see the names the
+    plot type's cells rebind, as they would in the notebook. Shared cells that come after a plot
+    type's first cell of its own are run again in its layer, so they also see what it did.
+
+    Nothing runs until a namespace is needed, so a build where every Star is cached never runs
+    any setup at all. With a snapshot cache, each namespace is also saved to disk after it's run,
+    and loaded from there by later builds with the same setup cells instead of running them, or
+    the base, again.
+    """
+
+    def __init__(
+        self,
+        shared: Sequence[str],
+        setups: Mapping[PlotType, Sequence[str]],
+        snapshots: Optional[SnapshotCache] = None,
+    ):
+        """Creates the namespaces. Doesn't run any code.
+
+        Parameters
+        ----------
+        shared : Sequence[str]
+            The setup cells shared by every plot type.
+        setups : Mapping[PlotType, Sequence[str]]
+            The setup cells for each plot type, including the shared cells, in notebook order.
+        snapshots : Optional[SnapshotCache]
+            If given, namespaces are loaded from and saved to this cache.
+        """
+        self.shared = tuple(shared)
+        # only the plot types with setup cells of their own
+        self.setups = {
+            plot_type: tuple(cells)
+            for plot_type, cells in setups.items()
+            if tuple(cells) != self.shared
+        }
+        self.snapshots = snapshots
+        self._base: Optional[dict] = None
+        self._namespaces: MutableMapping[PlotType, dict] = {}
+        # split states, keyed by the id of the namespace they come from
+        self._states: MutableMapping[int, Tuple[dict, dict]] = {}
+
+    @property
+    def key(self) -> tuple:
+        """A hashable value that is the same for namespaces built from the same cells."""
+        return (
+            self.shared,
+            tuple(sorted([(t.value, cells) for t, cells in self.setups.items()])),
+        )
+
+    def __getstate__(self):
+        # only the code is sent to other processes: they build the state themselves
+        return {
+            "shared": self.shared,
+            "setups": self.setups,
+            "snapshots": self.snapshots,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["shared"], state["setups"], state["snapshots"])
+
+    def base(self) -> dict:
+        """Returns the namespace after running the shared setup cells, running them if needed."""
+        if self._base is None:
+            self._base = self._build("shared", self.shared, lambda: run_setup(self.shared))
+        return self._base
+
+    def namespace(self, plot_type: PlotType) -> dict:
+        """Returns the namespace for a plot type, running its setup cells if needed.
+
+        Plot types without their own setup cells share the base namespace, so the result must not
+        be modified: use scopes() for a namespace that can be.
+        """
+        if plot_type not in self._namespaces:
+            if plot_type in self.setups:
+                cells = self.setups[plot_type]
+                self._namespaces[plot_type] = self._build(
+                    plot_type.value, cells, lambda: self._run_layer(cells)
+                )
+            else:
+                self._namespaces[plot_type] = self.base()
+        return self._namespaces[plot_type]
+
+    def scopes(self, plot_type: PlotType) -> Callable[[], dict]:
+        """Returns a function that makes a fresh copy of a plot type's namespace each call."""
+        return copying_scopes(*self._split(self.namespace(plot_type)))
+
+    def _run_layer(self, cells: Sequence[str]) -> dict:
+        """Runs a plot type's own setup cells on a copy of the base namespace and returns it."""
+        base = self.base()
+        with phase("copy_state"):
+            layer = layer_namespace(base, *self._split(base))
+        own = _own_cells(self.shared, cells)
+        logger.debug(f"Running {len(own)} of {len(cells)} setup cells on the shared setup")
+        return run_setup(own, layer)
+
+    def _build(self, name: str, cells: Sequence[str], run: Callable[[], dict]) -> dict:
+        """Returns the namespace after running cells, loading it from a snapshot if there is one
+        and otherwise running it with run() and saving a snapshot of it."""
+        if self.snapshots is not None and cells:
+            key = snapshot_key(cells)
+            data = self.snapshots.get(key)
+            if data is not None:
+                with phase("snapshot_load", layer=name):
+                    namespace = load_namespace(data)
+                if namespace is not None:
+                    logger.debug(f"Loaded {name} setup state from snapshot")
+                    return namespace
+        else:
+            key = None
+
+        logger.debug(f"Running {name} setup cells")
+        with phase("setup", layer=name):
+            namespace = run()
+
+        if key is not None:
+            with phase("snapshot_dump", layer=name):
+                data = dump_namespace(namespace)
+            if data is not None:
+                self.snapshots.put(key, data)
+        return namespace
+
+    def _split(self, namespace: dict) -> Tuple[dict, dict]:
+        """Returns split_state(namespace), reusing the result for namespaces shared by several
+        plot types."""
+        if id(namespace) not in self._states:
+            self._states[id(namespace)] = split_state(namespace)
+        return self._states[id(namespace)]
@@ -0,0 +1,216 @@
+"""Reads the outputs a notebook was saved with, so Stars can use them instead of running again.
+
+A notebook that was run top to bottom before it was saved already has the images and tables its
+Stars show. Using those means building doesn't need the data the setup cells load, and is much
+faster. Outputs are only trusted when the code cells ran in order: see fresh_code_cells().
+"""
+from __future__ import annotations
+
+import ast
+import base64
+import io
+import json
+import re
+from typing import Any, Iterable, Iterator, Mapping, Optional, Sequence, Set, Tuple
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+from .images import ImageOptions, minify_svg, svg_data_uri
+from .theming import COLOR_MODES, _hex, _theme_settings, is_theme_dependent, theme_color_map
+
+# The fill of the rectangle behind a Matplotlib figure, which is its first patch.
+_SVG_BACKGROUND_RE = re.compile(
+    r'<g id="patch_1">\s*<path [^>]*?style="fill:\s*(#[0-9a-fA-F]{6})'
+)
+_SVG_COLOR_RE = re.compile(r"#[0-9a-fA-F]{6}\b")
+
+# The number of rows Pandas shows under a DataFrame or Series it truncated.
+_SHAPE_FOOTER_RE = re.compile(r"(\d+) rows (?:x|×) \d+ columns|Length: (\d+)")
+
+# Pandas' default display.max_rows, the most rows its table schema output has.
+_DEFAULT_MAX_ROWS = 60
+
+
+def fresh_code_cells(cells: Sequence[dict]) -> Set[int]:
+    """Returns the indices of the code cells whose outputs are up to date.
+
+    A cell's outputs are trusted if it and every code cell before it ran, in notebook order. Once a
+    cell ran out of order or didn't run, its outputs, and those of every later cell, could have come
+    from different code or state than the notebook has now. A cell edited without running it again
+    can't be detected from the notebook alone.
+
+    Parameters
+    ----------
+    cells : Sequence[dict]
+        The cells of the notebook, in order.
+    """
+    return set([i for i, (cell, fresh) in enumerate(mark_fresh(cells)) if fresh])
+
+
+def mark_fresh(cells: Iterable[dict]) -> Iterator[Tuple[dict, bool]]:
+    """Yields each cell with whether it's a code cell whose outputs are up to date, as it goes, so
+    cells can be checked as they're read: see fresh_code_cells()."""
+    last_count = 0
+    stale = False
+    for cell in cells:
+        if cell["cell_type"] != "code":
+            yield (cell, False)
+            continue
+        count = cell.get("execution_count")
+        if stale or count is None or count <= last_count:
+            stale = True
+        else:
+            last_count = count
+        yield (cell, not stale)
+
+
+def _output_data(outputs: Sequence[dict], mime_type: str) -> Optional[Any]:
+    """Returns the first output of a MIME type, with text joined back together."""
+    for output in outputs:
+        data = output.get("data", {})
+        if mime_type in data:
+            value = data[mime_type]
+            return "".join(value) if isinstance(value, list) else value
+    return None
+
+
+def _color_mode_of(background: Optional[str]) -> Optional[str]:
+    """Returns the theme whose background a color is, if it's exactly one of them."""
+    if background is None:
+        return None
+    for color_mode in COLOR_MODES:
+        if _hex(_theme_settings()[color_mode][0]["figure.facecolor"]) == background.lower():
+            return color_mode
+    return None
+
+
+def _png_background(data: bytes) -> Optional[str]:
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        r, g, b, a = image.convert("RGBA").getpixel((0, 0))
+    return None if a == 0 else f"#{r:02x}{g:02x}{b:02x}"
+
+
+def stored_images(
+    outputs: Sequence[dict],
+    code: str,
+    image_options: ImageOptions,
+    setup_cells: Sequence[str] = (),
+) -> Mapping[str, str]:
+    """Returns the images of a Matplotlib Star a notebook was saved with, by theme.
+
+    An image is only used if its background is that of one of the themes, because otherwise it
+    would look out of place. SVGs are also re-styled for the other theme, like rendered figures,
+    unless the code depends on the theme in other ways. Other themes have to be rendered.
+
+    Parameters
+    ----------
+    outputs : Sequence[dict]
+        The outputs of the Star's code cell.
+    code : str
+        The Star's code.
+    image_options : ImageOptions
+        How to encode SVGs. Stored PNGs are used as they are.
+    setup_cells : Sequence[str]
+        The setup cells the code is run after, whose helpers may depend on the theme.
+    """
+    svg = _output_data(outputs, "image/svg+xml")
+    png = _output_data(outputs, "image/png")
+    images = {}
+    if svg is not None:
+        svg = svg[svg.find("<svg") :].replace("\n", "")
+        match = _SVG_BACKGROUND_RE.search(svg)
+        color_mode = _color_mode_of(match.group(1) if match else None)
+        if color_mode is None:
+            return {}
+
+        images[color_mode] = svg_data_uri(minify_svg(svg, image_options.precision))
+        if not is_theme_dependent(code, setup_cells):
+            for other in COLOR_MODES:
+                if other != color_mode:
+                    color_map = theme_color_map(color_mode, other)
+                    restyled = _SVG_COLOR_RE.sub(
+                        lambda m: color_map.get(m.group(0).lower(), m.group(0)), svg
+                    )
+                    images[other] = svg_data_uri(minify_svg(restyled, image_options.precision))
+    elif png is not None:
+        png = png.replace("\n", "")
+        color_mode = _color_mode_of(_png_background(base64.b64decode(png)))
+        if color_mode is not None:
+            images[color_mode] = f"data:image/png;base64,{png}"
+    return images
+
+
+def _is_last_expression(code: str, expr: str) -> bool:
+    """Returns whether the last statement of code is the expression expr, whose value is the
+    output of its cell."""
+    try:
+        body = ast.parse(code).body
+        value = ast.parse(expr, mode="eval").body
+    except SyntaxError:
+        return False
+    if not body or not isinstance(body[-1], ast.Expr):
+        return False
+    return ast.dump(body[-1].value) == ast.dump(value)
+
+
+def _shown_rows(outputs: Sequence[dict]) -> Optional[int]:
+    """Returns the number of rows of a DataFrame in the shape footer of its text or HTML output,
+    which Pandas adds when it leaves out rows, or None if there isn't one."""
+    for mime_type in ("text/plain", "text/html"):
+        text = _output_data(outputs, mime_type)
+        match = _SHAPE_FOOTER_RE.search(text) if isinstance(text, str) else None
+        if match is not None:
+            return int(match.group(1) or match.group(2))
+    return None
+
+
+def stored_dataframe(outputs: Sequence[dict], code: str, df_expr: str) -> Optional[list]:
+    """Returns the records of the DataFrame a notebook was saved with, as `to_json` would for
+    `orient="records"`, or None if there isn't one that can be read back exactly.
+
+    Only Pandas' table schema output is used. Its HTML rendering is rounded to Pandas' display
+    precision and doesn't tell numbers apart from text, so it isn't. The table schema output only
+    has the first `display.max_rows` rows, though, so it isn't used either if the DataFrame has more
+    rows than it does, going by the shape Pandas shows under the text and HTML outputs of large
+    DataFrames, or could have, if it has exactly as many rows as the default limit. The output is
+    also only used if it's that of df_expr, because it's the last expression of the code: otherwise
+    it's of something else, like `df.head()`.
+
+    Parameters
+    ----------
+    outputs : Sequence[dict]
+        The outputs of the Star's code cell.
+    code : str
+        The Star's code.
+    df_expr : str
+        The expression whose value the Star shows.
+    """
+    if not _is_last_expression(code, df_expr):
+        return None
+    results = [output for output in outputs if output.get("output_type") == "execute_result"]
+    resource = _output_data(results, "application/vnd.dataresource+json")
+    if resource is None:
+        return None
+    if isinstance(resource, str):
+        resource = json.loads(resource)
+    rows = resource.get("data", [])
+
+    shown = _shown_rows(results)
+    if shown is not None and shown != len(rows):
+        logger.debug(f"Stored DataFrame has {len(rows)} of {shown} rows")
+        return None
+    elif shown is None and len(rows) == _DEFAULT_MAX_ROWS:
+        logger.debug("Stored DataFrame may have been cut to display.max_rows")
+        return None
+
+    # like tables.as_dataframe(), only leave out the index if it's the default one
+    index = resource.get("schema", {}).get("primaryKey", [])
+    if index == ["index"] and [row.get("index") for row in rows] == list(range(len(rows))):
+        return [{key: value for key, value in row.items() if key != "index"} for row in rows]
+    return rows
@@ -0,0 +1,295 @@
+"""Makes Plotly figures smaller before they're written to Constellations.
+
+Plotly figures are stored as the JSON the notebook output has, where every point is a decimal
+number written out in full: a line of ten thousand points is a few hundred kilobytes.
+compact_figure() instead writes numeric arrays in traces as base64-encoded typed arrays, the
+`{"dtype", "bdata"}` objects plotly.js (and Plotly 6's own output) uses, with floats as 32-bit
+floats when the precision allows it. Long line traces can also be downsampled with
+Largest-Triangle-Three-Buckets, which keeps the points that shape the line, like peaks, rather than
+every n-th one.
+
+The site decodes typed arrays itself, so it works with plotly.js versions that can't.
+"""
+from __future__ import annotations
+
+import base64
+import math
+from typing import Any, List, Optional
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+# Arrays shorter than this are left as they are: encoding them saves little, and short arrays are
+# more often settings, like domains, than data.
+MIN_ARRAY_LENGTH = 16
+
+# The significant digits a 32-bit float always keeps.
+FLOAT32_DIGITS = 6
+
+# The integer types typed arrays can have, from smallest to largest.
+_INT_DTYPES = ("u1", "i1", "u2", "i2", "u4", "i4")
+
+# The largest integer a 64-bit float holds exactly.
+_MAX_EXACT_FLOAT = 2**53
+
+_LINE_TRACE_TYPES = ("scatter", "scattergl")
+
+
+class PlotlyOptions:
+    """How Plotly figures are compacted.
+
+    Set in the `[plotly]` table of `constellate.toml`: see ConstellateConfig.
+    """
+
+    def __init__(self, binary: bool = True, precision: int = 6, max_points: Optional[int] = None):
+        """Creates the options.
+
+        Parameters
+        ----------
+        binary : bool
+            Whether to write numeric arrays as base64-encoded typed arrays. Otherwise, they're
+            written as JSON lists, with floats rounded.
+        precision : int
+            The number of significant digits floats keep. With binary, floats are written as 32-bit
+            floats if this is at most FLOAT32_DIGITS, and as 64-bit floats otherwise.
+        max_points : Optional[int]
+            If given, line traces with more points than this are downsampled to this many points.
+
+        Raises
+        ------
+        ValueError
+            If precision isn't positive, or max_points is less than 3.
+        """
+        if precision < 1:
+            raise ValueError(f"Invalid Plotly precision {precision}")
+        if max_points is not None and max_points < 3:
+            raise ValueError("Plotly traces can't be downsampled to fewer than 3 points")
+        self.binary = binary
+        self.precision = precision
+        self.max_points = max_points
+
+
+def _is_number(value: Any) -> bool:
+    return type(value) in (int, float)
+
+
+def _numeric_array(value: Any):
+    """Returns a JSON list or typed array as a NumPy array if it's numeric, or None."""
+    import numpy as np
+
+    if isinstance(value, np.ndarray):
+        return value if value.dtype.kind in "iuf" else None
+    elif isinstance(value, dict):
+        if not (isinstance(value.get("bdata"), str) and isinstance(value.get("dtype"), str)):
+            return None
+        dtype = np.dtype(value["dtype"]).newbyteorder("<")
+        array = np.frombuffer(base64.b64decode(value["bdata"]), dtype=dtype)
+        if isinstance(value.get("shape"), str):
+            array = array.reshape([int(n) for n in value["shape"].split(",")])
+        return array
+    elif not isinstance(value, list) or not value:
+        return None
+
+    if all(_is_number(item) for item in value):
+        if len(value) < MIN_ARRAY_LENGTH:
+            return None
+    elif all(isinstance(row, list) for row in value):
+        # 2D arrays, like the z of a heatmap
+        if len(set(len(row) for row in value)) != 1:
+            return None
+        if len(value) * len(value[0]) < MIN_ARRAY_LENGTH:
+            return None
+        if not all(_is_number(item) for row in value for item in row):
+            return None
+    else:
+        return None
+
+    try:
+        array = np.array(value)
+    except OverflowError:
+        return None
+    return array if array.dtype.kind in "iuf" else None
+
+
+def _array_length(value: Any) -> Optional[int]:
+    """Returns the number of items in a list or typed array, or None if it's neither."""
+    if isinstance(value, list):
+        return len(value)
+    array = _numeric_array(value) if isinstance(value, dict) else None
+    return len(array) if array is not None else None
+
+
+def _round(value: float, precision: int) -> Optional[float]:
+    return float(f"{value:.{precision}g}") if math.isfinite(value) else None
+
+
+def _rounded_list(array, precision: int) -> list:
+    if array.ndim > 1:
+        return [_rounded_list(row, precision) for row in array]
+    elif array.dtype.kind == "f":
+        return [_round(value, precision) for value in array.tolist()]
+    else:
+        return array.tolist()
+
+
+def _encode(array, options: PlotlyOptions) -> Any:
+    """Returns a numeric NumPy array as a typed array, or as a list if options aren't binary or it
+    doesn't fit in a type typed arrays can have."""
+    import numpy as np
+
+    if not options.binary:
+        return _rounded_list(array, options.precision)
+
+    if array.dtype.kind in "iu":
+        low, high = (int(array.min()), int(array.max())) if array.size else (0, 0)
+        dtype = next(
+            (t for t in _INT_DTYPES if np.iinfo(t).min <= low and high <= np.iinfo(t).max), None
+        )
+        if dtype is None:
+            if max(-low, high) > _MAX_EXACT_FLOAT:
+                return array.tolist()
+            dtype = "f8"
+    else:
+        finite = array[np.isfinite(array)]
+        fits_float32 = finite.size == 0 or np.abs(finite).max() <= np.finfo("f4").max
+        dtype = "f4" if options.precision <= FLOAT32_DIGITS and fits_float32 else "f8"
+
+    data = array.astype(np.dtype(dtype).newbyteorder("<")).tobytes()
+    encoded = {"dtype": dtype, "bdata": base64.b64encode(data).decode("ascii")}
+    if array.ndim > 1:
+        encoded["shape"] = ",".join([str(n) for n in array.shape])
+    return encoded
+
+
+def _compact_value(value: Any, options: PlotlyOptions) -> Any:
+    """Returns a value in a trace with its numeric arrays encoded."""
+    array = _numeric_array(value)
+    if array is not None:
+        if isinstance(value, dict) and not options.binary:
+            # already a typed array, which the site can read
+            return value
+        return _encode(array, options)
+    elif isinstance(value, dict):
+        return {key: _compact_value(item, options) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [
+            _compact_value(item, options) if isinstance(item, (dict, list)) else item
+            for item in value
+        ]
+    else:
+        return value
+
+
+def lttb(x, y, num_points: int):
+    """Returns the indices of the points of a line Largest-Triangle-Three-Buckets keeps.
+
+    The first and last points are always kept. The others are split into num_points - 2 buckets,
+    and from each bucket the point kept is the one that makes the largest triangle with the point
+    kept from the bucket before and the average of the bucket after.
+
+    Parameters
+    ----------
+    x, y : np.ndarray
+        The coordinates of the points, which have to be finite.
+    num_points : int
+        How many points to keep, at least 3.
+    """
+    import numpy as np
+
+    n = len(x)
+    if num_points >= n:
+        return np.arange(n)
+
+    # bucket i has the points in [edges[i], edges[i + 1])
+    edges = np.linspace(1, n - 1, num_points - 1).astype(int)
+    indices = np.empty(num_points, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    prev = 0
+    for i in range(num_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # twice the area of each triangle, which has the same maximum
+        areas = np.abs(
+            (x[prev] - avg_x) * (y[start:end] - y[prev])
+            - (x[prev] - x[start:end]) * (avg_y - y[prev])
+        )
+        prev = start + int(areas.argmax())
+        indices[i + 1] = prev
+    return indices
+
+
+def _take(value: Any, indices: List[int], length: int) -> Any:
+    """Returns a value in a trace with only the given points, if it has one item per point."""
+    if _array_length(value) == length:
+        if isinstance(value, list):
+            return [value[i] for i in indices]
+        else:
+            return _numeric_array(value)[indices]
+    elif isinstance(value, dict):
+        return {key: _take(item, indices, length) for key, item in value.items()}
+    else:
+        return value
+
+
+def _downsample(trace: dict, max_points: int) -> dict:
+    """Returns a line trace downsampled to max_points with lttb(), or the trace as it is if it isn't
+    a line or is short enough."""
+    import numpy as np
+
+    if trace.get("type", "scatter") not in _LINE_TRACE_TYPES:
+        return trace
+    # traces without a mode are drawn as lines if they have 20 points or more
+    if "lines" not in trace.get("mode", "lines"):
+        return trace
+    y = _numeric_array(trace.get("y"))
+    if y is None or y.ndim != 1 or len(y) <= max_points:
+        return trace
+
+    n = len(y)
+    x = _numeric_array(trace.get("x"))
+    if x is None or x.shape != y.shape:
+        # no x, or one like dates that isn't numeric, and which is usually evenly spaced
+        if "x" in trace and _array_length(trace["x"]) != n:
+            return trace
+        x = np.arange(n)
+    x = x.astype(float)
+    y = y.astype(float)
+    if not (np.isfinite(x).all() and np.isfinite(y).all()):
+        # gaps in the line, which buckets would paper over
+        return trace
+
+    indices = lttb(x, y, max_points)
+    logger.debug(f"Downsampled a Plotly trace from {n} to {max_points} points")
+    return {key: _take(value, indices, n) for key, value in trace.items()}
+
+
+def compact_figure(fig: dict, options: Optional[PlotlyOptions] = None) -> dict:
+    """Returns a Plotly figure with long line traces downsampled and numeric arrays in its traces
+    encoded, as options say. The figure isn't modified.
+
+    Parameters
+    ----------
+    fig : dict
+        The figure, as in the `application/vnd.plotly.v1+json` output of a notebook.
+    options : Optional[PlotlyOptions]
+        How to compact it. Defaults to PlotlyOptions().
+    """
+    if options is None:
+        options = PlotlyOptions()
+    if not isinstance(fig.get("data"), list):
+        return fig
+
+    traces = []
+    for trace in fig["data"]:
+        if isinstance(trace, dict):
+            if options.max_points is not None:
+                trace = _downsample(trace, options.max_points)
+            trace = _compact_value(trace, options)
+        traces.append(trace)
+    return {**fig, "data": traces}
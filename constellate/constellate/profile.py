@@ -0,0 +1,191 @@
+"""Measures where the time in a build goes, phase by phase.
+
+Code marks its phases with `with phase("exec"):`. That does nothing unless a Profiler is active,
+which `constellate build --profile` makes it. Each phase is recorded with its wall and CPU time and
+the labels of the phases it's in, like the notebook and Star, so time can be added up per phase,
+per Star and per notebook. Phases nest, so a phase's time includes that of the phases inside it.
+
+Work done in other processes is profiled there and its records sent back: see call_profiled().
+"""
+from __future__ import annotations
+
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from os import PathLike
+from typing import Any, Callable, Iterator, List, Mapping, MutableMapping, Optional, Sequence, Tuple
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+PROFILE_VERSION = 1
+
+# The active profilers in this process, innermost last.
+_ACTIVE: List["Profiler"] = []
+
+
+class Profiler:
+    """Records the time spent in each phase."""
+
+    def __init__(self):
+        """Creates a profiler with no records. Doesn't make it active: see profiling()."""
+        self.records: List[dict] = []
+        # the labels of the phases currently open, innermost last
+        self._labels: List[dict] = [{}]
+
+    @contextmanager
+    def phase(self, name: str, **labels) -> Iterator[None]:
+        """Records the time spent in the block, with the labels of the phases around it."""
+        merged = {**self._labels[-1], **labels}
+        self._labels.append(merged)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.records.append(
+                {
+                    "phase": name,
+                    "wall": time.perf_counter() - wall,
+                    "cpu": time.process_time() - cpu,
+                    **merged,
+                }
+            )
+            self._labels.pop()
+
+    def merge(self, records: Sequence[dict]):
+        """Adds records made elsewhere, like in another process, as if they were made in the
+        current phase: they get its labels, unless they have their own."""
+        for record in records:
+            self.records.append({**self._labels[-1], **record})
+
+    def report(self) -> dict:
+        """Returns the totals per phase, per notebook and per Star, along with every record."""
+        phases: MutableMapping[str, dict] = defaultdict(_total)
+        notebooks: MutableMapping[str, dict] = {}
+        stars: MutableMapping[Tuple[str, str, str], dict] = {}
+        for record in self.records:
+            _add(phases[record["phase"]], record)
+
+            notebook = record.get("notebook")
+            if notebook is not None:
+                entry = notebooks.setdefault(notebook, {"notebook": notebook, "phases": {}})
+                if record["phase"] == "notebook":
+                    _add(entry, record)
+                else:
+                    _add(entry["phases"].setdefault(record["phase"], _total()), record)
+
+            star_id = record.get("star_id")
+            if star_id is not None:
+                key = (notebook, star_id, record.get("kind"))
+                entry = stars.setdefault(
+                    key,
+                    {
+                        "notebook": notebook,
+                        "star_id": star_id,
+                        "kind": record.get("kind"),
+                        "phases": {},
+                    },
+                )
+                if record["phase"] == "render":
+                    _add(entry, record)
+                else:
+                    _add(entry["phases"].setdefault(record["phase"], _total()), record)
+
+        return {
+            "version": PROFILE_VERSION,
+            "phases": dict(phases),
+            "notebooks": sorted(notebooks.values(), key=lambda e: -e.get("wall", 0)),
+            "stars": sorted(stars.values(), key=lambda e: -e.get("wall", 0)),
+            "records": self.records,
+        }
+
+    def to_file(self, savefile: PathLike):
+        """Writes report() as JSON."""
+        with open(str(savefile), "w") as outfile:
+            json.dump(self.report(), outfile, indent=2)
+
+    def summary(self, top: int = 10) -> str:
+        """Returns a table of the slowest Stars and the total time in each phase."""
+        report = self.report()
+        # Stars that weren't rendered, like Plotly Stars, only have phases like compact_figure
+        rendered = [entry for entry in report["stars"] if "wall" in entry]
+        lines = [f"Slowest {min(top, len(rendered))} Stars (wall / CPU seconds):"]
+        for entry in rendered[:top]:
+            lines.append(
+                f"  {entry.get('wall', 0):8.3f} {entry.get('cpu', 0):8.3f}  "
+                f"{entry['star_id']}  {entry['kind']}  {entry['notebook']}"
+            )
+        lines.append("Time per phase (wall / CPU seconds, nested phases included):")
+        for name, total in sorted(report["phases"].items(), key=lambda item: -item[1]["wall"]):
+            lines.append(
+                f"  {total['wall']:8.3f} {total['cpu']:8.3f}  {name} ({total['count']}x)"
+            )
+        return "\n".join(lines)
+
+
+def _total() -> dict:
+    return {"wall": 0.0, "cpu": 0.0, "count": 0}
+
+
+def _add(total: dict, record: Mapping[str, Any]):
+    total["wall"] = total.get("wall", 0.0) + record["wall"]
+    total["cpu"] = total.get("cpu", 0.0) + record["cpu"]
+    total["count"] = total.get("count", 0) + 1
+
+
+class _NoPhase:
+    """What phase() returns when nothing is being profiled, which costs next to nothing."""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name: str, **labels):
+    """Returns a context manager that records the time spent in it as a phase with the given name
+    and labels, if a profiler is active."""
+    if not _ACTIVE:
+        return _NO_PHASE
+    return _ACTIVE[-1].phase(name, **labels)
+
+
+def merge_records(records: Sequence[dict]):
+    """Adds records from call_profiled() to the active profiler, if there is one. See
+    Profiler.merge()."""
+    if _ACTIVE:
+        _ACTIVE[-1].merge(records)
+
+
+def is_profiling() -> bool:
+    """Returns whether a profiler is active in this process."""
+    return bool(_ACTIVE)
+
+
+@contextmanager
+def profiling(profiler: Optional[Profiler] = None) -> Iterator[Profiler]:
+    """Makes a profiler, or a new one, active in the block, and returns it."""
+    profiler = Profiler() if profiler is None else profiler
+    _ACTIVE.append(profiler)
+    try:
+        yield profiler
+    finally:
+        _ACTIVE.remove(profiler)
+
+
+def call_profiled(func: Callable, *args, **kwargs) -> Tuple[Any, List[dict]]:
+    """Returns func(*args, **kwargs) and the records of a profiler active during the call. Used to
+    profile work in other processes, which can't add to this process's profiler directly: the
+    records are sent back with the result and merged with Profiler.merge()."""
+    with profiling() as profiler:
+        result = func(*args, **kwargs)
+    return (result, profiler.records)
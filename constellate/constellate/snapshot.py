@@ -0,0 +1,145 @@
+"""Saves the global state setup cells create to disk, so later builds can load it instead of running
+the setup again.
+
+A snapshot is a pickle of the namespace, with a few additions so the usual contents of a setup
+cell survive:
+
+- Modules are saved by name and imported again when the snapshot is loaded.
+- Functions defined in the setup cells are saved as their compiled code, and re-created with the
+  restored namespace as their globals.
+- Matplotlib's settings, which setup cells commonly change (e.g., `sns.set_theme()`), are saved
+  alongside the namespace and restored with it.
+
+Anything else that can't be pickled, like classes defined in a setup cell, open files or closures,
+means that namespace isn't snapshotted at all, and the setup is run every build as before. Other
+changes setup cells make outside their namespace, like writing files, aren't captured either.
+"""
+from __future__ import annotations
+
+import builtins
+import importlib
+import io
+import marshal
+import pickle
+import sys
+from types import FunctionType, ModuleType
+from typing import Any, Mapping, Optional, Sequence
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+from .cache import RenderCache, render_key
+
+
+def snapshot_key(setup_cells: Sequence[str]) -> str:
+    """Returns the key of the snapshot of the namespace after running setup_cells. The key includes
+    the Python and library versions, because neither pickles nor compiled code are portable
+    across them."""
+    return render_key("setup", setup_cells, "")
+
+
+def _make_function(code: bytes, globals_: dict, name: str, defaults, kwdefaults, attrs):
+    func = FunctionType(marshal.loads(code), globals_, name, defaults)
+    func.__kwdefaults__ = kwdefaults
+    func.__dict__.update(attrs)
+    return func
+
+
+class _NamespacePickler(pickle.Pickler):
+    def __init__(self, file, namespaces: Mapping[str, dict]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.names = {id(namespace): name for name, namespace in namespaces.items()}
+
+    def persistent_id(self, obj: Any) -> Optional[str]:
+        # these are recreated on load rather than copied
+        if obj is builtins.__dict__ or obj is builtins:
+            return "builtins"
+        return self.names.get(id(obj))
+
+    def reducer_override(self, obj: Any):
+        if isinstance(obj, ModuleType):
+            return (importlib.import_module, (obj.__name__,))
+        elif (
+            isinstance(obj, FunctionType)
+            and id(obj.__globals__) in self.names
+            and obj.__closure__ is None
+        ):
+            return (
+                _make_function,
+                (
+                    marshal.dumps(obj.__code__),
+                    obj.__globals__,
+                    obj.__name__,
+                    obj.__defaults__,
+                    obj.__kwdefaults__,
+                    obj.__dict__,
+                ),
+            )
+        # the default: fails for functions and classes that only exist in the namespace
+        return NotImplemented
+
+
+class _NamespaceUnpickler(pickle.Unpickler):
+    def __init__(self, file, namespaces: Mapping[str, dict]):
+        super().__init__(file)
+        self.namespaces = namespaces
+
+    def persistent_load(self, pid: str) -> Any:
+        if pid == "builtins":
+            return builtins.__dict__
+        elif pid in self.namespaces:
+            return self.namespaces[pid]
+        raise pickle.UnpicklingError(f"Unknown persistent ID {pid}")
+
+
+def dump_namespace(namespace: dict) -> Optional[bytes]:
+    """Returns a snapshot of namespace, or None if some of it can't be saved."""
+    if "matplotlib" in sys.modules:
+        rc_params = dict(sys.modules["matplotlib"].rcParams)
+    else:
+        rc_params = None
+
+    contents = {k: v for k, v in namespace.items() if k != "__builtins__"}
+    bio = io.BytesIO()
+    try:
+        _NamespacePickler(bio, {"namespace": namespace}).dump((contents, rc_params))
+    except Exception as e:
+        logger.debug(f"Can't snapshot setup state: {e}")
+        return None
+    return bio.getvalue()
+
+
+def load_namespace(data: bytes) -> Optional[dict]:
+    """Returns the namespace in a snapshot from dump_namespace(), or None if it can't be loaded.
+    Restores the Matplotlib settings saved with it."""
+    namespace = {"__builtins__": builtins.__dict__}
+    try:
+        contents, rc_params = _NamespaceUnpickler(io.BytesIO(data), {"namespace": namespace}).load()
+    except Exception as e:
+        logger.debug(f"Can't load setup state snapshot: {e}")
+        return None
+
+    namespace.update(contents)
+    if rc_params is not None:
+        import matplotlib
+
+        # these were valid when they were saved, so skip validation like rc_context() does
+        dict.update(matplotlib.rcParams, rc_params)
+    return namespace
+
+
+class SnapshotCache(RenderCache):
+    """An on-disk cache of setup state snapshots, with the same size limit and least-recently-used
+    eviction as RenderCache. Entries are the bytes from dump_namespace()."""
+
+    suffix = ".pickle"
+    binary = True
+
+    def _load(self, infile) -> bytes:
+        return infile.read()
+
+    def _dump(self, value: bytes, outfile):
+        outfile.write(value)
@@ -1,8 +1,7 @@
 """Defines Stars. A Star is a single page, part of a Constellation."""
 
 from enum import Enum
-from typing import Sequence, Union, Tuple
-from yapf.yapflib.yapf_api import FormatCode
+from typing import Iterable, Iterator, List, Optional, Sequence, Union, Tuple
 import json
 
 import logging
@@ -11,11 +10,13 @@ import click_log
 logger = logging.getLogger(__name__)
 click_log.basic_config(logger)
 
+from .formatting import current_formatter
+
 
 def fix_code(code: str) -> str:
-    """Formats code using YAPF."""
-    formatted, _ = FormatCode(code)
-    return formatted
+    """Formats code with the current formatter, YAPF by default: see formatting.py. Formatting code
+    that's already formatted is free, so Stars format their code in __init__ and nowhere else."""
+    return current_formatter().format(code)
 
 
 class Star:
@@ -36,6 +37,12 @@ class Star:
         and a number of cells that were consumed if successful, and None if not successful."""
         raise NotImplementedError()
 
+    @classmethod
+    def from_cells(cls, cells):
+        """Creates a Star from cells that parse() matches, all of which it consumes. parse_stars()
+        uses this once it has matched the cells itself."""
+        raise NotImplementedError()
+
     def serialize(self) -> dict:
         return {"kind": self.star_type}
 
@@ -59,10 +66,14 @@ class PureMarkdown(Star):
     @classmethod
     def parse(cls, cells):
         if cells and cells[0]["cell_type"] == "markdown":
-            return (1, cls("".join(cells[0]["source"])))
+            return (1, cls.from_cells(cells[:1]))
         else:
             return None
 
+    @classmethod
+    def from_cells(cls, cells):
+        return cls("".join(cells[0]["source"]))
+
 
 class PlotType(Enum):
     """A plot type for a cell producing a visual."""
@@ -180,26 +191,26 @@ class MarkdownPanel(Star):
         ):
             # figure out if mpl or panel
             if guess_plot_type(cells[1]) == PlotType.PANEL:
-                return (
-                    2,
-                    cls(
-                        "".join(cells[0]["source"]),
-                        fix_code("".join(strip_metadata(cells[1]["source"]))),
-                    ),
-                )
+                return (2, cls.from_cells(cells[:2]))
         else:
             return None
 
+    @classmethod
+    def from_cells(cls, cells):
+        return cls("".join(cells[0]["source"]), "".join(strip_metadata(cells[1]["source"])))
+
 
 class MarkdownMatplotlib(Star):
     """A Star with Markdown and code that outputs a matplotlib figure."""
 
     star_type = "markdown_matplotlib"
 
-    def __init__(self, md, code):
+    def __init__(self, md, code, outputs=()):
         super().__init__()
         self.md = md
         self.code = fix_code(code)
+        # the outputs the notebook was saved with, which may be used instead of running the code
+        self.outputs = outputs
 
     def serialize(self):
         obj = super().serialize()
@@ -215,16 +226,18 @@ class MarkdownMatplotlib(Star):
         ):
             # figure out if mpl or panel
             if guess_plot_type(cells[1]) == PlotType.MATPLOTLIB:
-                return (
-                    2,
-                    cls(
-                        "".join(cells[0]["source"]),
-                        fix_code("".join(strip_metadata(cells[1]["source"]))),
-                    ),
-                )
+                return (2, cls.from_cells(cells[:2]))
         else:
             return None
 
+    @classmethod
+    def from_cells(cls, cells):
+        return cls(
+            "".join(cells[0]["source"]),
+            "".join(strip_metadata(cells[1]["source"])),
+            cells[1].get("outputs", []),
+        )
+
 
 class MarkdownLatex(Star):
     """A Star with Markdown accompanying LaTeX on the side."""
@@ -249,16 +262,14 @@ class MarkdownLatex(Star):
             "markdown",
         ):
             if cells[1]["source"][0].strip().lower() == "#constellate: latex":
-                return (
-                    2,
-                    cls(
-                        "".join(cells[0]["source"]),
-                        "".join(strip_metadata(cells[1]["source"])),
-                    ),
-                )
+                return (2, cls.from_cells(cells[:2]))
         else:
             return None
 
+    @classmethod
+    def from_cells(cls, cells):
+        return cls("".join(cells[0]["source"]), "".join(strip_metadata(cells[1]["source"])))
+
 
 class MarkdownPlotly(Star):
     """A Markdown cell with an attached Plotly visual."""
@@ -291,25 +302,26 @@ class MarkdownPlotly(Star):
             "code",
         ):
             if guess_plot_type(cells[1]) == PlotType.PLOTLY:
-                return (
-                    2,
-                    cls(
-                        "".join(cells[0]["source"]),
-                        fix_code("".join(strip_metadata(cells[1]["source"]))),
-                        # if this figure doesn't exist, unlike Matplotlib/Panel
-                        # there's no clean way of saying "get the current figure
-                        # and plot it", so we're stuck. Not sure how we can
-                        # handle this, but for now you have to actually run
-                        # Plotly cells.
-                        cells[1]
-                        .get("outputs", [{}])[0]
-                        .get("data", {})
-                        .get("application/vnd.plotly.v1+json", None),
-                    ),
-                )
+                return (2, cls.from_cells(cells[:2]))
         else:
             return None
 
+    @classmethod
+    def from_cells(cls, cells):
+        return cls(
+            "".join(cells[0]["source"]),
+            "".join(strip_metadata(cells[1]["source"])),
+            # if this figure doesn't exist, unlike Matplotlib/Panel
+            # there's no clean way of saying "get the current figure
+            # and plot it", so we're stuck. Not sure how we can
+            # handle this, but for now you have to actually run
+            # Plotly cells.
+            cells[1]
+            .get("outputs", [{}])[0]
+            .get("data", {})
+            .get("application/vnd.plotly.v1+json", None),
+        )
+
 
 class MarkdownVega(Star):
     """A Markdown cell with an Altair Vega chart."""
@@ -358,29 +370,25 @@ class MarkdownVega(Star):
             "code",
         ):
             if guess_plot_type(cells[1]) == PlotType.VEGA:
-                return (
-                    2,
-                    cls(
-                        "".join(cells[0]["source"]),
-                        "".join(strip_metadata(cells[1]["source"])),
-                        # if this figure doesn't exist, unlike Matplotlib/Panel
-                        # there's no clean way of saying "get the current figure
-                        # and plot it", so we're stuck. Not sure how we can
-                        # handle this, but for now you have to actually run
-                        # Plotly cells.
-                        cells[1]
-                        .get("outputs", [{}])[0]
-                        .get("data", {})
-                        .get("text/html", None),
-                        cells[1]
-                        .get("outputs", [{}])[0]
-                        .get("data", {})
-                        .get("application/vnd.vegalite.v4+json", None),
-                    ),
-                )
+                return (2, cls.from_cells(cells[:2]))
         else:
             return None
 
+    @classmethod
+    def from_cells(cls, cells):
+        data = cells[1].get("outputs", [{}])[0].get("data", {})
+        return cls(
+            "".join(cells[0]["source"]),
+            "".join(strip_metadata(cells[1]["source"])),
+            # if this figure doesn't exist, unlike Matplotlib/Panel
+            # there's no clean way of saying "get the current figure
+            # and plot it", so we're stuck. Not sure how we can
+            # handle this, but for now you have to actually run
+            # Plotly cells.
+            data.get("text/html", None),
+            data.get("application/vnd.vegalite.v4+json", None),
+        )
+
 
 class MarkdownWidget(Star):
     """A Markdown cell with an attached ipywidget visual."""
@@ -412,36 +420,39 @@ class MarkdownWidget(Star):
             "code",
         ):
             if guess_plot_type(cells[1]) == PlotType.PLOTLY:
-                return (
-                    2,
-                    cls(
-                        "".join(cells[0]["source"]),
-                        fix_code("".join(strip_metadata(cells[1]["source"]))),
-                        # if this figure doesn't exist, unlike Matplotlib/Panel
-                        # there's no clean way of saying "get the current figure
-                        # and plot it", so we're stuck. Not sure how we can
-                        # handle this, but for now you have to actually run
-                        # Plotly cells.
-                        cells[1]
-                        .get("outputs", [{}])[0]
-                        .get("data", {})
-                        .get("application/vnd.plotly.v1+json", None),
-                    ),
-                )
+                return (2, cls.from_cells(cells[:2]))
         else:
             return None
 
+    @classmethod
+    def from_cells(cls, cells):
+        return cls(
+            "".join(cells[0]["source"]),
+            "".join(strip_metadata(cells[1]["source"])),
+            # if this figure doesn't exist, unlike Matplotlib/Panel
+            # there's no clean way of saying "get the current figure
+            # and plot it", so we're stuck. Not sure how we can
+            # handle this, but for now you have to actually run
+            # Plotly cells.
+            cells[1]
+            .get("outputs", [{}])[0]
+            .get("data", {})
+            .get("application/vnd.plotly.v1+json", None),
+        )
+
 
 class MarkdownDataframe(Star):
     """A Star with Markdown and a Pandas DataFrame."""
 
     star_type = "markdown_dataframe"
 
-    def __init__(self, md, code, df_expr):
+    def __init__(self, md, code, df_expr, outputs=()):
         super().__init__()
         self.md = md
-        self.code = code
+        self.code = fix_code(code)
         self.df_expr = df_expr
+        # the outputs the notebook was saved with, which may be used instead of running the code
+        self.outputs = outputs
 
     def serialize(self):
         obj = super().serialize()
@@ -458,28 +469,30 @@ class MarkdownDataframe(Star):
             and (cells[0]["cell_type"], cells[1]["cell_type"]) == ("markdown", "code",)
             and guess_plot_type(cells[1]) == PlotType.DATAFRAME
         ):
-            df_expr = ""
-            for line in cells[1]["source"]:
-                if line.startswith("#constellate: dataframe"):
-                    df_expr = line.replace("#constellate: dataframe", "").strip()
-
-            if not df_expr:
-                # no explicit name was given, use last non-empty line
-                for line in reversed(cells[1]["source"]):
-                    if line.strip():
-                        df_expr = line.strip()
-                        break
-            return (
-                2,
-                cls(
-                    "".join(cells[0]["source"]),
-                    fix_code("".join(strip_metadata(cells[1]["source"]))),
-                    df_expr,
-                ),
-            )
+            return (2, cls.from_cells(cells[:2]))
         else:
             return None
 
+    @classmethod
+    def from_cells(cls, cells):
+        df_expr = ""
+        for line in cells[1]["source"]:
+            if line.startswith("#constellate: dataframe"):
+                df_expr = line.replace("#constellate: dataframe", "").strip()
+
+        if not df_expr:
+            # no explicit name was given, use last non-empty line
+            for line in reversed(cells[1]["source"]):
+                if line.strip():
+                    df_expr = line.strip()
+                    break
+        return cls(
+            "".join(cells[0]["source"]),
+            "".join(strip_metadata(cells[1]["source"])),
+            df_expr,
+            cells[1].get("outputs", []),
+        )
+
 
 class MarkdownCode(Star):
     # code that makes a diagram should be treated as such: run this after any of those parsers
@@ -536,41 +549,47 @@ class MarkdownCode(Star):
             "code",
         ):
             if guess_plot_type(cells[1]) is PlotType.PLAIN:
-                outs = cells[1]["outputs"]
-                if outs and "data" in outs[0] and "text/plain" in outs[0]["data"]:
-                    output = outs[0]["data"]["text/plain"]
-                elif outs and "name" in outs[0] and outs[0]["name"] == "stdout":
-                    output = outs[0]["text"]
-                else:
-                    logger.warn(
-                        "No output. Is that really what you wanted? Cell source:\n{}".format(
-                            "".join(cells[1]["source"])
-                        )
-                    )
-                    output = ""
-
-                return (
-                    2,
-                    cls(
-                        "".join(cells[0]["source"]),
-                        "".join(strip_metadata(cells[1]["source"])),
-                        output,
-                        "python",
-                    ),
-                )
+                return (2, cls.from_cells(cells[:2]))
         elif len(cells) >= 2 and cells[0]["cell_type"] == "markdown":
             src_lang = cls.detect_code_block(cells[1])
             if src_lang is not None:
-                src, lang = src_lang
-                return (2, cls("".join(cells[0]["source"]), "".join(src), "", lang))
+                return (2, cls.from_cells(cells[:2], src_lang))
             return None
         else:
             return None
 
+    @classmethod
+    def from_cells(cls, cells, src_lang=None):
+        """Creates a Star from a Markdown cell and either a code cell or, if src_lang is given, the
+        Markdown code block detect_code_block() found in the second cell."""
+        if cells[1]["cell_type"] == "markdown":
+            src, lang = src_lang if src_lang is not None else cls.detect_code_block(cells[1])
+            return cls("".join(cells[0]["source"]), "".join(src), "", lang)
+
+        outs = cells[1]["outputs"]
+        if outs and "data" in outs[0] and "text/plain" in outs[0]["data"]:
+            output = outs[0]["data"]["text/plain"]
+        elif outs and "name" in outs[0] and outs[0]["name"] == "stdout":
+            output = outs[0]["text"]
+        else:
+            logger.warn(
+                "No output. Is that really what you wanted? Cell source:\n{}".format(
+                    "".join(cells[1]["source"])
+                )
+            )
+            output = ""
+
+        return cls(
+            "".join(cells[0]["source"]),
+            "".join(strip_metadata(cells[1]["source"])),
+            output,
+            "python",
+        )
+
 
 # The list of stars that are automatically parsed from a notebook. The order of
 # this tuple will break precedence ties in determining which parsers get run
-# first.
+# first. parse_stars() parses them all at once.
 NB_STARS = (
     MarkdownCode,
     MarkdownLatex,
@@ -581,3 +600,102 @@ NB_STARS = (
     MarkdownDataframe,
     PureMarkdown,
 )
+
+
+# The Star a Markdown cell followed by a code cell of each plot type makes. Widgets aren't parsed
+# from notebooks, so their Markdown cell is parsed as PureMarkdown and the code cell can't be.
+CODE_STARS = {
+    PlotType.MATPLOTLIB: MarkdownMatplotlib,
+    PlotType.PANEL: MarkdownPanel,
+    PlotType.PLOTLY: MarkdownPlotly,
+    PlotType.VEGA: MarkdownVega,
+    PlotType.DATAFRAME: MarkdownDataframe,
+    PlotType.PLAIN: MarkdownCode,
+}
+
+
+class CellFeatures:
+    """What decides the Star a cell following a Markdown cell makes, worked out once per cell."""
+
+    def __init__(self, cell):
+        self.cell_type = cell["cell_type"]
+        # the plot type of code cells
+        self.plot_type: Optional[PlotType] = None
+        # whether a Markdown cell is LaTeX
+        self.is_latex = False
+        # the source and language of a Markdown cell that's a single code block
+        self.code_block: Optional[Tuple[Sequence[str], str]] = None
+
+        if self.cell_type == "code":
+            self.plot_type = guess_plot_type(cell)
+        elif self.cell_type == "markdown":
+            self.is_latex = cell["source"][0].strip().lower() == "#constellate: latex"
+            if not self.is_latex:
+                self.code_block = MarkdownCode.detect_code_block(cell)
+
+
+def _pair_star(pair: Sequence[dict]) -> Optional[Star]:
+    """Returns the Star a Markdown cell and the cell after it make together, or None if they
+    don't make one."""
+    features = CellFeatures(pair[1])
+    if features.is_latex:
+        return MarkdownLatex.from_cells(pair)
+    elif features.code_block is not None:
+        return MarkdownCode.from_cells(pair, features.code_block)
+    elif features.plot_type in CODE_STARS:
+        return CODE_STARS[features.plot_type].from_cells(pair)
+    return None
+
+
+def iter_stars(cells: Iterable[dict]) -> Iterator[Tuple[List[dict], Optional[Star]]]:
+    """Parses Stars from cells as they come, looking at most one cell ahead, so cells can be
+    parsed while the rest of the notebook is still being read.
+
+    Yields each Star with the cells it was parsed from. If a cell can't be parsed, yields it with
+    None and stops. This gives the same Stars as parse_stars().
+    """
+    pending = None
+    for cell in cells:
+        if pending is None:
+            if cell["cell_type"] != "markdown":
+                yield ([cell], None)
+                return
+            pending = cell
+            continue
+
+        star = _pair_star([pending, cell])
+        if star is not None:
+            yield ([pending, cell], star)
+            pending = None
+            continue
+
+        yield ([pending], PureMarkdown.from_cells([pending]))
+        if cell["cell_type"] != "markdown":
+            yield ([cell], None)
+            return
+        pending = cell
+
+    if pending is not None:
+        yield ([pending], PureMarkdown.from_cells([pending]))
+
+
+def parse_stars(cells: Sequence[dict]) -> Tuple[List[Tuple[int, Star]], int]:
+    """Parses Stars from the beginning of cells, in one pass.
+
+    This gives the same Stars as parsing with each of NB_STARS in order of precedence until none
+    parses, but only classifies each cell once, so it takes linear time.
+
+    Returns
+    -------
+    (stars, end)
+        The Stars, each with the number of cells it was parsed from, and the index of the first
+        cell that couldn't be parsed, which is len(cells) if all of them could.
+    """
+    stars = []
+    i = 0
+    for consumed, star in iter_stars(cells):
+        if star is None:
+            break
+        stars.append((len(consumed), star))
+        i += len(consumed)
+    return (stars, i)
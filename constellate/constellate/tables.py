@@ -0,0 +1,367 @@
+"""Exports DataFrames as columnar, paginated tables for the site.
+
+A table is a JSON object:
+
+```json
+{
+  "version": 1,
+  "columns": [
+    {"name": "x", "type": "number", "dtype": "float64",
+     "stats": {"count": 3, "nulls": 0, "min": 0.5, "max": 2.0, "mean": 1.25, "std": 0.75}}
+  ],
+  "total_rows": 3,
+  "num_rows": 3,
+  "page_rows": 500,
+  "pages": [[[0.5, 1.25, 2.0]]]
+}
+```
+
+Each page has a list of values per column, in the order of "columns", for up to "page_rows" rows.
+Only the first "num_rows" of the "total_rows" rows are exported, but the stats are of every row.
+When a Constellation is written with an AssetStore, pages after the first are stored as separate
+files and replaced by their URLs, so the site only loads the pages that are shown.
+
+Storing the values of each column together means column names aren't repeated on every row, as in
+the records `to_json` writes, and converting the DataFrame directly avoids encoding it as JSON and
+decoding it again.
+"""
+from __future__ import annotations
+
+import math
+import statistics
+from collections import Counter
+from typing import Any, List, Mapping, Optional, Sequence, Tuple
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+from .assets import AssetStore
+
+# Bumped whenever the format of tables changes.
+TABLE_VERSION = 1
+
+# The types of columns. Values in "mixed" columns are JSON values of different types, and values
+# that have no JSON type are written as text.
+COLUMN_TYPES = ("integer", "number", "boolean", "datetime", "string", "mixed")
+
+
+class TableOptions:
+    """How DataFrames are exported.
+
+    Set in the `[dataframes]` table of `constellate.toml`: see ConstellateConfig.
+    """
+
+    def __init__(self, page_rows: int = 500, max_rows: int = 100000, precision: int = 4):
+        """Creates the options.
+
+        Parameters
+        ----------
+        page_rows : int
+            The number of rows in each page. The first page is part of the Constellation, and the
+            others are loaded when they're shown.
+        max_rows : int
+            The number of rows exported. Stats are still of every row.
+        precision : int
+            The number of decimal places numbers are rounded to.
+
+        Raises
+        ------
+        ValueError
+            If an option isn't positive.
+        """
+        if page_rows < 1 or max_rows < 1:
+            raise ValueError("DataFrames need to be exported with at least one row per page")
+        if precision < 0:
+            raise ValueError(f"Invalid DataFrame precision {precision}")
+        self.page_rows = page_rows
+        self.max_rows = max_rows
+        self.precision = precision
+
+    @property
+    def key(self) -> list:
+        """The options, as a JSON-serializable value for cache keys."""
+        return [TABLE_VERSION, self.page_rows, self.max_rows, self.precision]
+
+
+def _number(value: Any, precision: int) -> Optional[float]:
+    """Returns a number rounded for the table, or None if it's missing or not finite."""
+    if value is None:
+        return None
+    value = float(value)
+    return round(value, precision) if math.isfinite(value) else None
+
+
+def _is_missing(value: Any) -> bool:
+    if value is None or type(value).__name__ in ("NAType", "NaTType"):
+        return True
+    try:
+        # NaN
+        return bool(value != value)
+    except (TypeError, ValueError):
+        # values that can't be compared as a whole, like arrays
+        return False
+
+
+def _plain_value(value: Any) -> Any:
+    """Returns a value as a JSON value: None if it's missing, and text if it has no JSON type."""
+    if _is_missing(value):
+        return None
+    elif type(value).__module__ == "numpy" and hasattr(value, "item"):
+        value = value.item()
+    return value if isinstance(value, (bool, int, float, str)) else str(value)
+
+
+def _value_type(value: Any) -> str:
+    if isinstance(value, bool):
+        return "boolean"
+    elif isinstance(value, int):
+        return "integer"
+    elif isinstance(value, float):
+        return "number"
+    else:
+        return "string"
+
+
+def _plain_values(values: Sequence[Any], precision: int) -> Tuple[List[Any], str]:
+    """Returns a column of arbitrary Python values as JSON values, with its type."""
+    values = [_plain_value(value) for value in values]
+    types = set([_value_type(value) for value in values if value is not None])
+    if not types:
+        column_type = "string"
+    elif len(types) == 1:
+        column_type = types.pop()
+    elif types == {"integer", "number"}:
+        column_type = "number"
+    else:
+        column_type = "mixed"
+
+    if column_type in ("number", "mixed"):
+        values = [
+            _number(value, precision) if _value_type(value) in ("integer", "number") else value
+            for value in values
+        ]
+    return (values, column_type)
+
+
+def _stats(values: Sequence[Any], column_type: str, precision: int) -> dict:
+    """Returns the summary stats of a column of JSON values."""
+    present = [value for value in values if value is not None]
+    stats = {"count": len(present), "nulls": len(values) - len(present)}
+    if column_type in ("integer", "number"):
+        if present:
+            stats["min"] = min(present)
+            stats["max"] = max(present)
+            stats["mean"] = _number(statistics.fmean(present), precision)
+        stats["std"] = _number(statistics.stdev(present), precision) if len(present) > 1 else None
+    elif column_type == "boolean":
+        stats["true"] = sum([1 for value in present if value])
+    elif column_type == "datetime":
+        if present:
+            stats["min"] = min(present)
+            stats["max"] = max(present)
+    else:
+        counts = Counter([str(value) for value in present])
+        stats["unique"] = len(counts)
+        if counts:
+            stats["top"], stats["freq"] = counts.most_common(1)[0]
+    return stats
+
+
+def _table(
+    columns: List[dict], values: List[List[Any]], total_rows: int, options: TableOptions
+) -> dict:
+    num_rows = len(values[0]) if values else 0
+    pages = [
+        [column[start : start + options.page_rows] for column in values]
+        for start in range(0, num_rows, options.page_rows)
+    ]
+    return {
+        "version": TABLE_VERSION,
+        "columns": columns,
+        "total_rows": total_rows,
+        "num_rows": num_rows,
+        "page_rows": options.page_rows,
+        # an empty table still has a page, with no rows
+        "pages": pages if pages else [[[] for _ in columns]],
+    }
+
+
+def _has_default_index(df) -> bool:
+    """Returns whether a DataFrame's index is just the row numbers, which tables leave out."""
+    import pandas as pd
+
+    index = df.index
+    return (
+        isinstance(index, pd.RangeIndex)
+        and index.start == 0
+        and index.step == 1
+        and index.name is None
+    )
+
+
+def as_dataframe(value):
+    """Returns a DataFrame or Series, like the result of `value_counts()`, as a DataFrame with its
+    index as its first columns, unless it's the default one, or None if value is neither.
+
+    Index columns are named as `reset_index()` names them, but can have the same name as a column.
+    """
+    import pandas as pd
+
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    elif not isinstance(value, pd.DataFrame):
+        return None
+    if _has_default_index(value):
+        return value
+
+    index = value.index
+    names = [
+        name if name is not None else ("index" if index.nlevels == 1 else f"level_{i}")
+        for i, name in enumerate(index.names)
+    ]
+    index_columns = index.to_frame(index=False, name=names if index.nlevels > 1 else names[0])
+    return pd.concat([index_columns, value.reset_index(drop=True)], axis=1)
+
+
+def dataframe_table(df, options: Optional[TableOptions] = None) -> dict:
+    """Returns a DataFrame as a table, with its index as its first columns unless it's the default
+    one: see as_dataframe().
+
+    Parameters
+    ----------
+    df : pd.DataFrame or pd.Series
+        The DataFrame, or a Series, which is a table with a single column besides its index.
+    options : Optional[TableOptions]
+        How to export it. Defaults to TableOptions().
+
+    Raises
+    ------
+    ValueError
+        If df isn't a DataFrame or Series.
+    """
+    import numpy as np
+
+    frame = as_dataframe(df)
+    if frame is None:
+        raise ValueError(f"Expected a DataFrame or Series, not a {type(df).__name__}")
+    df = frame
+    if options is None:
+        options = TableOptions()
+    precision = options.precision
+
+    columns = []
+    values = []
+    for i in range(df.shape[1]):
+        series = df.iloc[:, i]
+        exported = series.iloc[: options.max_rows]
+        kind = series.dtype.kind
+        column = {"name": str(series.name), "dtype": str(series.dtype)}
+
+        # nullable integers and booleans with missing values are handled like Python objects
+        if kind == "b" and not series.hasnans:
+            column["type"] = "boolean"
+            column_values = exported.tolist()
+            column["stats"] = {"count": len(series), "nulls": 0, "true": int(series.sum())}
+        elif kind in "iu" and not series.hasnans:
+            column["type"] = "integer"
+            column_values = exported.tolist()
+            column["stats"] = {"count": len(series), "nulls": 0}
+            if len(series):
+                column["stats"]["min"] = int(series.min())
+                column["stats"]["max"] = int(series.max())
+                column["stats"]["mean"] = _number(series.mean(), precision)
+            # NaN, and so None, with fewer than two rows
+            column["stats"]["std"] = _number(series.std(), precision)
+        elif kind == "f":
+            column["type"] = "number"
+            finite = series.replace([np.inf, -np.inf], np.nan)
+            rounded = finite.iloc[: options.max_rows].round(precision)
+            column_values = rounded.astype(object).where(rounded.notna(), None).tolist()
+            count = int(finite.count())
+            column["stats"] = {"count": count, "nulls": len(series) - count}
+            if count:
+                column["stats"]["min"] = _number(finite.min(), precision)
+                column["stats"]["max"] = _number(finite.max(), precision)
+                column["stats"]["mean"] = _number(finite.mean(), precision)
+            column["stats"]["std"] = _number(finite.std(), precision)
+        elif kind == "M":
+            column["type"] = "datetime"
+            column_values = [None if _is_missing(t) else t.isoformat() for t in exported]
+            count = int(series.count())
+            column["stats"] = {"count": count, "nulls": len(series) - count}
+            if count:
+                column["stats"]["min"] = series.min().isoformat()
+                column["stats"]["max"] = series.max().isoformat()
+        else:
+            # text, categories, nullable types with missing values, and Python objects
+            column_values, column["type"] = _plain_values(exported.tolist(), precision)
+            if len(series) > len(exported):
+                full_values, _ = _plain_values(series.tolist(), precision)
+            else:
+                full_values = column_values
+            column["stats"] = _stats(full_values, column["type"], precision)
+
+        columns.append(column)
+        values.append(column_values)
+
+    return _table(columns, values, len(df), options)
+
+
+def records_table(
+    records: Sequence[Mapping[str, Any]], options: Optional[TableOptions] = None
+) -> dict:
+    """Returns a table from records, as `to_json` writes for `orient="records"`, with the columns
+    in the order they first appear.
+
+    Parameters
+    ----------
+    records : Sequence[Mapping[str, Any]]
+        The records.
+    options : Optional[TableOptions]
+        How to export them. Defaults to TableOptions().
+    """
+    if options is None:
+        options = TableOptions()
+
+    names = {}
+    for record in records:
+        for name in record:
+            names.setdefault(name, None)
+
+    columns = []
+    values = []
+    for name in names:
+        column_values, column_type = _plain_values(
+            [record.get(name) for record in records], options.precision
+        )
+        columns.append(
+            {
+                "name": str(name),
+                "dtype": "object",
+                "type": column_type,
+                "stats": _stats(column_values, column_type, options.precision),
+            }
+        )
+        values.append(column_values[: options.max_rows])
+
+    return _table(columns, values, len(records), options)
+
+
+def page_urls(table: Mapping) -> List[str]:
+    """Returns the URLs of the pages of a table that are stored as assets."""
+    return [page for page in table.get("pages", []) if isinstance(page, str)]
+
+
+def store_pages(table: Mapping, assets: AssetStore) -> dict:
+    """Returns a table with every page but the first stored as an asset and replaced by its URL.
+    Pages small enough to leave inline, and pages that are already URLs, are left as they are."""
+    pages = list(table.get("pages", []))
+    for i in range(1, len(pages)):
+        if not isinstance(pages[i], str):
+            url = assets.add_json(pages[i])
+            if url is not None:
+                pages[i] = url
+    return {**table, "pages": pages}
@@ -0,0 +1,305 @@
+"""Color themes for Matplotlib figures.
+
+Every Matplotlib Star is shown in a light and a dark theme. Instead of running the plotting code
+once per theme, the figure is drawn in the first theme and then re-styled for the other by
+swapping every color that comes from the theme for its counterpart. Code that depends on the theme
+in some other way, by reading `IS_DARK` or `theme`, by using a library that derives new colors
+from the theme's, or by calling a setup helper that does either, is run once per theme instead.
+"""
+
+import ast
+from functools import lru_cache
+from typing import Any, FrozenSet, Mapping, Optional, Sequence, Set, Tuple
+
+import logging
+import click_log
+
+logger = logging.getLogger(__name__)
+click_log.basic_config(logger)
+
+COLOR_MODES = ("light", "dark")
+
+# Theme setup run before each Matplotlib cell, in the cell's scope.
+THEME_SETUP_SOURCE = """
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import rho_plus
+plt.close('all')
+IS_DARK = {is_dark}
+theme, cs = rho_plus.mpl_setup(IS_DARK)
+(c1, c2, c3, c4, c5, c6, c7, c8, c9, c10, c11, c12) = cs
+matplotlib.rcParams['svg.hashsalt'] = 'constellate'
+"""
+
+# The theme setup, compiled once rather than every time a Star is rendered.
+THEME_SETUP = {
+    color_mode: compile(
+        THEME_SETUP_SOURCE.format(is_dark=color_mode == "dark"),
+        f"<constellate {color_mode} theme>",
+        "exec",
+    )
+    for color_mode in COLOR_MODES
+}
+
+# Names defined by the theme setup that let code behave differently per theme. Code that reads any
+# of them can't be re-styled after the fact.
+THEME_NAMES = ("IS_DARK", "theme")
+
+# Libraries that compute colors from the theme's, like Seaborn's desaturated box fills and gray
+# outlines. Those colors have no counterpart in the other theme to swap them for.
+DERIVING_LIBRARIES = ("sns", "seaborn")
+
+# Color properties of artists, each with a get_ and set_ method.
+COLOR_PROPS = (
+    "facecolor",
+    "edgecolor",
+    "color",
+    "markerfacecolor",
+    "markeredgecolor",
+    "markerfacecoloralt",
+)
+
+
+def _mentions_theme(tree: ast.AST) -> bool:
+    """Returns whether code reads any of the theme variables besides the colors or uses a library
+    that derives colors from the theme."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in THEME_NAMES + DERIVING_LIBRARIES:
+            return True
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            modules = [alias.name for alias in node.names]
+            if isinstance(node, ast.ImportFrom) and node.module is not None:
+                modules.append(node.module)
+            if any([mod.split(".")[0] in DERIVING_LIBRARIES for mod in modules]):
+                return True
+    return False
+
+
+def _bound_names(node: ast.AST) -> Set[str]:
+    """Returns the global names a top-level statement binds. The names bound in the bodies of
+    functions and classes are their own."""
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return {node.name}
+    elif isinstance(node, ast.Name):
+        return {node.id} if isinstance(node.ctx, ast.Store) else set()
+    elif isinstance(node, (ast.Import, ast.ImportFrom)):
+        return set([(alias.asname or alias.name).split(".")[0] for alias in node.names])
+
+    names = set()
+    for child in ast.iter_child_nodes(node):
+        names |= _bound_names(child)
+    return names
+
+
+@lru_cache(maxsize=64)
+def theme_dependent_names(setup_cells: Tuple[str, ...]) -> Optional[FrozenSet[str]]:
+    """Returns the names defined by setup cells that depend on the theme, or None if that can't be
+    told because a cell can't be parsed or imports every name of a module.
+
+    A name depends on the theme if the statement that defines it, like the definition of a helper
+    function, mentions the theme as is_theme_dependent() checks for, or uses a name that depends
+    on the theme itself, wherever in the setup cells that's defined.
+    """
+    statements = []
+    for cell in setup_cells:
+        try:
+            tree = ast.parse(cell)
+        except SyntaxError:
+            return None
+        for node in tree.body:
+            if isinstance(node, ast.ImportFrom) and any([a.name == "*" for a in node.names]):
+                return None
+            used = set([name.id for name in ast.walk(node) if isinstance(name, ast.Name)])
+            statements.append((_bound_names(node), used, _mentions_theme(node)))
+
+    # helpers can call ones defined after them, so this repeats until no more names are found
+    dependent = set()
+    changed = True
+    while changed:
+        changed = False
+        for bound, used, mentions_theme in statements:
+            if not bound <= dependent and (mentions_theme or used & dependent):
+                dependent |= bound
+                changed = True
+    return frozenset(dependent)
+
+
+def is_theme_dependent(code: str, setup_cells: Sequence[str] = ()) -> bool:
+    """Returns whether code reads any of the theme variables besides the colors or uses a library
+    that derives colors from the theme, meaning it must be run once per theme. So does code that
+    uses a name from the setup cells that depends on the theme: see theme_dependent_names(). Code
+    that can't be parsed, or that uses setup cells that can't be checked, is assumed to be
+    theme-dependent."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return True
+
+    if _mentions_theme(tree):
+        return True
+    elif not setup_cells:
+        return False
+
+    setup_names = theme_dependent_names(tuple(setup_cells))
+    if setup_names is None:
+        return True
+    return any([isinstance(node, ast.Name) and node.id in setup_names for node in ast.walk(tree)])
+
+
+def _hex(color: Any) -> Optional[str]:
+    from matplotlib.colors import to_hex
+
+    try:
+        return to_hex(color, keep_alpha=False)
+    except (ValueError, TypeError):
+        return None
+
+
+@lru_cache(maxsize=None)
+def _theme_settings() -> Mapping[str, Tuple[dict, list]]:
+    """Returns the Matplotlib settings and color list of each theme."""
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    settings = {}
+    for color_mode in COLOR_MODES:
+        with matplotlib.rc_context():
+            scope = {}
+            exec(THEME_SETUP[color_mode], scope)
+            settings[color_mode] = (dict(matplotlib.rcParams), list(scope["cs"]))
+            plt.close("all")
+    return settings
+
+
+def theme_colors(color_mode: str) -> Tuple[str, ...]:
+    """Returns the colors set by a theme, in a consistent order across themes: the colors of the
+    Matplotlib settings that differ between themes, then the color cycle."""
+    settings = _theme_settings()
+    colors = []
+    for key in sorted(settings["light"][0]):
+        light, dark = (_hex(settings[mode][0][key]) for mode in COLOR_MODES)
+        if light is not None and dark is not None and light != dark:
+            colors.append(_hex(settings[color_mode][0][key]))
+
+    colors.extend([_hex(color) for color in settings[color_mode][1]])
+    return tuple(colors)
+
+
+@lru_cache(maxsize=None)
+def theme_color_map(from_mode: str, to_mode: str) -> Mapping[str, str]:
+    """Maps each color of one theme to the corresponding color of another.
+
+    The first call runs the setup of every theme, which resets pyplot, so make it before drawing.
+    Colors that would be ambiguous, because they correspond to different colors in different
+    places, are left out: it's better to leave a color alone than to change it to the wrong one.
+    """
+    mapping = {}
+    ambiguous = set()
+    for src, dst in zip(theme_colors(from_mode), theme_colors(to_mode)):
+        if mapping.get(src, dst) != dst:
+            ambiguous.add(src)
+        mapping[src] = dst
+
+    for color in ambiguous:
+        logger.debug(f"Not re-styling ambiguous theme color {color}")
+        del mapping[color]
+    return mapping
+
+
+def _remap(value: Any, color_map: Mapping[str, str]) -> Any:
+    """Returns value with the colors in color_map replaced, keeping transparency, or None if
+    nothing changes. value can be a single color or an array of colors."""
+    from matplotlib.colors import to_rgba
+
+    if isinstance(value, str):
+        new = color_map.get(_hex(value))
+        return None if new is None else to_rgba(new, to_rgba(value)[3])
+
+    try:
+        import numpy as np
+
+        arr = np.asarray(value, dtype=float)
+    except (ValueError, TypeError):
+        return None
+
+    if arr.ndim == 1 and arr.shape[0] in (3, 4):
+        new = color_map.get(_hex(arr))
+        alpha = arr[3] if arr.shape[0] == 4 else 1.0
+        return None if new is None else to_rgba(new, alpha)
+    elif arr.ndim == 2 and arr.shape[1] == 4:
+        changed = False
+        out = arr.copy()
+        for i, row in enumerate(arr):
+            new = color_map.get(_hex(row))
+            if new is not None:
+                out[i] = to_rgba(new, row[3])
+                changed = True
+        return out if changed else None
+    else:
+        return None
+
+
+def restyle_figure(fig, from_mode: str, to_mode: str):
+    """Re-styles a figure drawn in one theme for another, in place.
+
+    The Matplotlib settings for to_mode must be active when this is called and when the figure is
+    saved afterwards, so the figure background and anything created lazily while drawing match.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        The figure.
+    from_mode : str
+        The theme the figure was drawn in.
+    to_mode : str
+        The theme to change it to.
+    """
+    import matplotlib
+    from matplotlib.axes import Axes
+    from matplotlib.cm import ScalarMappable
+    from matplotlib.figure import FigureBase
+
+    color_map = theme_color_map(from_mode, to_mode)
+
+    artists = fig.findobj()
+    for artist in list(artists):
+        get_bbox_patch = getattr(artist, "get_bbox_patch", None)
+        if get_bbox_patch is not None and get_bbox_patch() is not None:
+            artists.append(get_bbox_patch())
+
+    seen = set()
+    for artist in artists:
+        # figures and axes only delegate to their background patch, which is handled on its own:
+        # changing both would change the color twice
+        if id(artist) in seen or isinstance(artist, (FigureBase, Axes)):
+            continue
+        seen.add(id(artist))
+
+        is_mapped = isinstance(artist, ScalarMappable) and artist.get_array() is not None
+        if isinstance(artist, ScalarMappable):
+            cmap_name = artist.get_cmap().name
+            # the theme's colormaps have the same names in both themes
+            if cmap_name.startswith("rho_") and cmap_name in matplotlib.colormaps:
+                artist.set_cmap(matplotlib.colormaps[cmap_name])
+
+        # read everything before changing anything: some properties, like a marker color of
+        # "auto", follow others
+        updates = {}
+        for prop in COLOR_PROPS:
+            if is_mapped and prop in ("facecolor", "edgecolor"):
+                # these come from the colormap, and setting them would override it
+                continue
+            getter = getattr(artist, "get_" + prop, None)
+            setter = getattr(artist, "set_" + prop, None)
+            if getter is None or setter is None:
+                continue
+            try:
+                new = _remap(getter(), color_map)
+            except Exception:
+                continue
+            if new is not None:
+                updates[setter] = new
+
+        for setter, new in updates.items():
+            setter(new)
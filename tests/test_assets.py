@@ -0,0 +1,78 @@
+"""Tests storing artifacts as content-addressed asset files."""
+import base64
+import os
+import stat
+
+import pytest
+
+from constellate.constellate.assets import ASSET_URL_PREFIX, AssetStore, decode_data_uri
+from constellate.constellate.cache import new_file_mode
+
+
+def test_add_is_content_addressed(tmp_path):
+    assets = AssetStore(tmp_path)
+    url = assets.add(b"data", "svg")
+    assert url.startswith(ASSET_URL_PREFIX) and url.endswith(".svg")
+    assert assets.add(b"data", "svg") == url
+    assert [path.name for path in tmp_path.iterdir()] == [url[len(ASSET_URL_PREFIX) :]]
+    assert assets.path(url).read_bytes() == b"data"
+    assert assets.add(b"other", "svg") != url
+
+
+def test_files_follow_umask(tmp_path):
+    assets = AssetStore(tmp_path)
+    path = assets.path(assets.add(b"data", "svg"))
+    assert stat.S_IMODE(path.stat().st_mode) == new_file_mode()
+    umask = os.umask(0)
+    os.umask(umask)
+    assert new_file_mode() == 0o666 & ~umask
+
+
+def test_path(tmp_path):
+    assets = AssetStore(tmp_path)
+    url = assets.add(b"data", "svg")
+    # URLs from the root of the site, as earlier builds wrote them
+    assert assets.path("/" + url) == assets.path(url)
+    assert assets.path(ASSET_URL_PREFIX + "../secret.svg") is None
+    assert assets.path("data:image/svg+xml,<svg/>") is None
+
+
+def test_add_image(tmp_path):
+    assets = AssetStore(tmp_path, min_size=100)
+    small = "data:image/svg+xml;utf8,<svg/>"
+    assert assets.add_image(small) == small
+
+    png = b"\x89PNG" + bytes(200)
+    url = assets.add_image("data:image/png;base64," + base64.b64encode(png).decode())
+    assert url.endswith(".png")
+    assert assets.path(url).read_bytes() == png
+    assert assets.add_image(url) == url
+
+
+def test_decode_data_uri():
+    assert decode_data_uri("data:image/svg+xml;utf8,%3Csvg%2F%3E") == (b"<svg/>", "svg")
+    with pytest.raises(ValueError):
+        decode_data_uri("data:text/plain,hi")
+    with pytest.raises(ValueError):
+        decode_data_uri("https://example.com/a.png")
+
+
+def test_add_json(tmp_path):
+    assets = AssetStore(tmp_path, min_size=10)
+    assert assets.add_json([1]) is None
+    value = {"text": "é" * 20}
+    assert assets.read_json(assets.add_json(value)) == value
+
+
+def test_prune(tmp_path):
+    assets = AssetStore(tmp_path / "assets")
+    kept = assets.add(b"kept", "svg")
+    removed = assets.add(b"removed", "svg")
+    (tmp_path / "assets" / (kept[len(ASSET_URL_PREFIX) :] + ".gz")).write_bytes(b"")
+    constellation = tmp_path / "a.constellate"
+    constellation.write_text(f'{{"title": "é", "light": "{kept}"}}', encoding="utf-8")
+
+    assets.prune([constellation])
+    assert assets.contains(kept)
+    assert not assets.contains(removed)
+    assert len(list((tmp_path / "assets").iterdir())) == 2
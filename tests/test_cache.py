@@ -0,0 +1,60 @@
+"""Tests the cache of rendered Star artifacts."""
+import os
+
+from constellate.constellate.cache import RenderCache, render_key
+
+
+def test_render_key():
+    key = render_key("matplotlib", ["import numpy as np"], "plt.plot([1])", "light")
+    assert key == render_key("matplotlib", ("import numpy as np",), "plt.plot([1])", "light")
+    assert len(key) == 64
+    assert key != render_key("matplotlib", ["import numpy as np"], "plt.plot([1])", "dark")
+    assert key != render_key("matplotlib", [], "plt.plot([1])", "light")
+    assert key != render_key("matplotlib", ["import numpy as np"], "plt.plot([2])", "light")
+    assert key != render_key("dataframe", ["import numpy as np"], "plt.plot([1])", "light")
+    # setup cells aren't just concatenated
+    assert render_key("x", ["a", "b"], "") != render_key("x", ["ab"], "")
+
+
+def test_get_and_put(tmp_path):
+    cache = RenderCache(tmp_path / "cache", max_size=10 ** 6)
+    key = render_key("matplotlib", [], "plt.plot([1])")
+    assert cache.get(key) is None
+    cache.put(key, {"image": "data:image/svg+xml,<svg/>"})
+    assert cache.get(key) == {"image": "data:image/svg+xml,<svg/>"}
+    # shared with other caches in the same directory
+    assert RenderCache(tmp_path / "cache", max_size=10 ** 6).get(key) == cache.get(key)
+
+    cache.clear()
+    assert cache.get(key) is None
+
+
+def test_unreadable_entry(tmp_path):
+    cache = RenderCache(tmp_path, max_size=10 ** 6)
+    cache.put("ab" * 32, [1])
+    cache._path("ab" * 32).write_text("{")
+    assert cache.get("ab" * 32) is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    value = "x" * 100
+    cache = RenderCache(tmp_path, max_size=350)
+    keys = [render_key("test", [], str(i)) for i in range(3)]
+    for age, key in zip([300, 200, 100], keys):
+        cache.put(key, value)
+        past = cache._path(key).stat().st_mtime - age
+        os.utime(cache._path(key), (past, past))
+
+    # reading the oldest entry makes it the most recently used
+    assert cache.get(keys[0]) == value
+    cache.put(render_key("test", [], "3"), value)
+    assert cache.get(keys[1]) is None
+    assert [cache.get(key) for key in [keys[0], keys[2]]] == [value, value]
+
+
+def test_put_many_evicts_once(tmp_path):
+    cache = RenderCache(tmp_path, max_size=250)
+    entries = {render_key("test", [], str(i)): "x" * 100 for i in range(5)}
+    cache.put_many(entries)
+    kept = [key for key in entries if cache.get(key) is not None]
+    assert len(kept) == 2
@@ -0,0 +1,84 @@
+"""Tests writing pre-compressed copies of build outputs."""
+import gzip
+import os
+
+import pytest
+
+from constellate.constellate.compress import (
+    MIN_COMPRESS_SIZE,
+    check_formats,
+    compress_file,
+    compress_outputs,
+    compressed_path,
+    output_files,
+    remove_stale,
+)
+
+DATA = b'{"stars": []}' * 100
+
+
+def test_compress_file(tmp_path):
+    path = tmp_path / "intro.constellate"
+    path.write_bytes(DATA)
+    assert compress_file(path, ["gzip"]) == [tmp_path / "intro.constellate.gz"]
+    assert gzip.decompress(compressed_path(path, "gzip").read_bytes()) == DATA
+    # up to date, so not written again
+    assert compress_file(path, ["gzip"]) == []
+
+
+def test_gzip_is_deterministic(tmp_path):
+    path = tmp_path / "intro.constellate"
+    path.write_bytes(DATA)
+    compress_file(path, ["gzip"])
+    first = compressed_path(path, "gzip").read_bytes()
+    compressed_path(path, "gzip").unlink()
+    compress_file(path, ["gzip"])
+    assert compressed_path(path, "gzip").read_bytes() == first
+
+
+def test_check_formats():
+    check_formats(["gzip"])
+    with pytest.raises(ValueError):
+        check_formats(["gzip", "lzma"])
+
+
+def test_output_files(tmp_path):
+    for name in ["intro.constellate", "manifest.json", "other.json", "intro.constellate.gz"]:
+        (tmp_path / name).write_bytes(DATA)
+    (tmp_path / "small.constellate").write_bytes(DATA[: MIN_COMPRESS_SIZE - 1])
+    (tmp_path / "shards" / "intro").mkdir(parents=True)
+    (tmp_path / "shards" / "intro" / "0.json").write_bytes(DATA)
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "assets" / "abc.svg").write_bytes(DATA)
+    (tmp_path / "assets" / "abc.png").write_bytes(DATA)
+
+    assert sorted([str(path.relative_to(tmp_path)) for path in output_files(tmp_path)]) == [
+        "assets/abc.svg",
+        "intro.constellate",
+        "manifest.json",
+        "shards/intro/0.json",
+    ]
+
+
+def test_remove_stale(tmp_path):
+    fresh = tmp_path / "fresh.constellate"
+    stale = tmp_path / "stale.constellate"
+    for path in [fresh, stale]:
+        path.write_bytes(DATA)
+        compress_file(path, ["gzip"])
+    (tmp_path / "removed.constellate.gz").write_bytes(b"")
+    mtime = compressed_path(stale, "gzip").stat().st_mtime_ns
+    os.utime(stale, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+    remove_stale(tmp_path, ["gzip"])
+    assert sorted([path.name for path in tmp_path.glob("*.gz")]) == ["fresh.constellate.gz"]
+    remove_stale(tmp_path, [])
+    assert list(tmp_path.glob("*.gz")) == []
+
+
+def test_compress_outputs(tmp_path):
+    (tmp_path / "intro.constellate").write_bytes(DATA)
+    compress_outputs(tmp_path, ["gzip"], workers=1)
+    assert (tmp_path / "intro.constellate.gz").exists()
+    compress_outputs(tmp_path, [])
+    assert not (tmp_path / "intro.constellate.gz").exists()
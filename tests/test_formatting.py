@@ -0,0 +1,35 @@
+"""Tests formatting the code of Stars."""
+from constellate.constellate.formatting import CodeFormatter
+
+
+def counting_formatter(max_remembered):
+    formatter = CodeFormatter("none", max_remembered=max_remembered)
+    calls = []
+
+    def format_code(code):
+        calls.append(code)
+        return code.strip() + "\n"
+
+    formatter._format = format_code
+    return (formatter, calls)
+
+
+def test_formats_each_source_once():
+    formatter, calls = counting_formatter(10)
+    assert formatter.format("x = 1  ") == "x = 1\n"
+    assert formatter.format("x = 1  ") == "x = 1\n"
+    assert calls == ["x = 1  "]
+    # formatted code isn't assumed to format to itself
+    formatter.format("x = 1\n")
+    assert calls == ["x = 1  ", "x = 1\n"]
+
+
+def test_forgets_least_recently_used():
+    formatter, calls = counting_formatter(2)
+    for code in ["a", "b", "a", "c"]:
+        formatter.format(code)
+    assert len(formatter._formatted) == 2
+    # "b" was used least recently, so it's formatted again, but "a" isn't
+    formatter.format("a")
+    formatter.format("b")
+    assert calls == ["a", "b", "c", "b"]
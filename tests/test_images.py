@@ -0,0 +1,107 @@
+"""Tests encoding Matplotlib figures as compact data URIs."""
+import base64
+from urllib.parse import unquote
+
+import matplotlib
+import numpy as np
+import pytest
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from constellate.constellate.images import (
+    ImageOptions,
+    _MIN_RASTERIZED_BYTES,
+    encode_figure,
+    heavy_artists,
+    minify_svg,
+    svg_data_uri,
+)
+
+SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="100.123pt" height="50pt">'
+    "<metadata><rdf:RDF>created by Matplotlib</rdf:RDF></metadata>\n"
+    "<!-- a comment -->\n"
+    '<defs>\n  <path id="m0123abcd" d="M 0.123456 -1.5 L 2.000001 3.1 z" '
+    'style="stroke: #000000; stroke-width: 0.5"/>\n</defs>\n'
+    '<g id="figure_1"><g id="axes_1">'
+    '<use xlink:href="#m0123abcd" x="10.55555" y="-0.0001" '
+    'transform="scale(0.015625)"/></g></g>\n<g/>'
+    "</svg>"
+)
+
+
+@pytest.fixture
+def figure():
+    fig, ax = plt.subplots()
+    yield fig, ax
+    plt.close(fig)
+
+
+def test_minify_svg():
+    svg = minify_svg(SVG, precision=2)
+    assert "metadata" not in svg and "comment" not in svg and "<g/>" not in svg
+    assert "\n" not in svg
+    # referenced IDs are shortened and the rest are removed
+    assert '<path id="a" d="M0.12 -1.5L2 3.1z"' in svg
+    assert 'xlink:href="#a"' in svg
+    assert "figure_1" not in svg
+    assert 'x="10.56" y="0"' in svg
+    assert 'width="100.12pt"' in svg
+    # transforms aren't rounded
+    assert 'transform="scale(0.015625)"' in svg
+    assert 'style="stroke:#000000;stroke-width:0.5"' in svg
+
+
+def test_svg_data_uri():
+    svg = '<svg><text fill="#fff">100% é</text></svg>'
+    uri = svg_data_uri(svg)
+    prefix = "data:image/svg+xml;utf8,"
+    assert uri.startswith(prefix)
+    assert unquote(uri[len(prefix) :]) == svg
+    assert "#" not in uri and "é" not in uri
+    # only what has to be escaped is
+    assert '<svg><text fill="' in uri
+
+
+def test_image_options():
+    with pytest.raises(ValueError):
+        ImageOptions(format="jpg")
+    with pytest.raises(ValueError):
+        ImageOptions(raster_format="svg")
+    assert ImageOptions().key != ImageOptions(dpi=100).key
+
+
+def test_auto_format(figure):
+    fig, ax = figure
+    ax.plot([1, 2, 3])
+    assert encode_figure(fig, ImageOptions()).startswith("data:image/svg+xml")
+    ax.scatter(np.arange(100), np.arange(100))
+    uri = encode_figure(fig, ImageOptions(max_elements=50, dpi=20))
+    assert uri.startswith("data:image/png;base64,")
+    assert base64.b64decode(uri.split(",", 1)[1]).startswith(b"\x89PNG")
+
+
+def test_heavy_artists(figure):
+    fig, ax = figure
+    (line,) = ax.plot([1, 2])
+    scatter = ax.scatter(np.arange(5000), np.arange(5000))
+    trace = ax.plot(np.arange(20000))[0]
+    total, heavy = heavy_artists(fig, budget=10 ** 9)
+    assert total > 5000 * 100 and heavy == []
+    total, heavy = heavy_artists(fig, budget=2 * _MIN_RASTERIZED_BYTES)
+    assert heavy == [scatter, trace]
+    assert line not in heavy
+
+
+def test_adaptive_rasterizes_heavy_artists(figure):
+    fig, ax = figure
+    ax.plot([1, 2])
+    scatter = ax.scatter(np.arange(20000) % 97, np.arange(20000) % 89)
+    uri = encode_figure(fig, ImageOptions(format="adaptive", budget_kb=300, dpi=50))
+    svg = unquote(uri.split(",", 1)[1])
+    assert uri.startswith("data:image/svg+xml") and "<image" in svg
+    # the text stays as vector paths
+    assert "<path" in svg
+    # the figure is left as it was
+    assert not scatter.get_rasterized()
@@ -0,0 +1,132 @@
+"""Tests that iter_cells() reads notebooks the same as json.load() and prune_cell() do, however the
+file is split into reads."""
+import copy
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from constellate.constellate.ipynb import iter_cells, prune_cell
+
+CELLS = [
+    {
+        "cell_type": "markdown",
+        "metadata": {},
+        "source": ["# A title, with \"quotes\", \\ and é\n", "\n", "Text"],
+        "attachments": {"image.png": {"image/png": "iVBORw0KGgo="}},
+    },
+    {
+        "cell_type": "code",
+        "execution_count": 123456789,
+        "metadata": {"collapsed": False, "scrolled": True, "tags": None},
+        "outputs": [
+            {
+                "output_type": "execute_result",
+                "execution_count": 123456789,
+                "metadata": {},
+                "data": {
+                    "text/plain": ["-1.5e-10"],
+                    "image/png": "iVBORw0KGgo=",
+                    "image/svg+xml": ["<svg></svg>"],
+                },
+            }
+        ],
+        "source": ["x = [-0.25, 1e308, 3]\n", "x"],
+    },
+    {"cell_type": "raw", "metadata": {}, "source": []},
+]
+
+METADATA = {"kernelspec": {"name": "python3"}, "scale": -12.5e3, "trusted": True, "tag": None}
+
+
+def notebooks():
+    """Yields the text of notebooks with the same cells, with their keys in different orders and
+    with values of every JSON type last, where they end reads."""
+    items = [
+        ("cells", CELLS),
+        ("metadata", METADATA),
+        ("nbformat", 4),
+        ("nbformat_minor", 12345),
+    ]
+    orders = [
+        items,
+        items[1:] + items[:1],
+        [items[2], items[0], items[3], items[1]],
+        items[:1] + [("flag", True)],
+        items[:1] + [("flag", False)],
+        items[:1] + [("flag", None)],
+        items[:1] + [("flag", -0.125e-3)],
+    ]
+    for order in orders:
+        yield json.dumps(dict(order), indent=1)
+        yield json.dumps(dict(order), separators=(",", ":"))
+
+
+def expected_cells(text, keep_stored=False):
+    return [prune_cell(cell, keep_stored) for cell in json.loads(text)["cells"]]
+
+
+def read_cells(text, chunk_size, keep_stored=False):
+    return list(iter_cells(io.StringIO(text), keep_stored, chunk_size))
+
+
+@pytest.mark.parametrize("text", list(notebooks()))
+def test_matches_json_load_for_every_chunk_size(text):
+    expected = expected_cells(text)
+    for chunk_size in range(1, len(text) + 2):
+        assert read_cells(text, chunk_size) == expected, f"chunk size {chunk_size}"
+
+
+@pytest.mark.parametrize("keep_stored", [False, True])
+def test_prunes_outputs(keep_stored):
+    text = next(notebooks())
+    cells = read_cells(text, 7, keep_stored)
+    assert cells == expected_cells(text, keep_stored)
+    assert "attachments" not in cells[0]
+    data = cells[1]["outputs"][0]["data"]
+    assert data["text/plain"] == ["-1.5e-10"]
+    assert (data["image/png"] is not None) == keep_stored
+
+
+def test_empty_cells():
+    for text in ['{"cells": []}', '{"metadata": {}, "cells": [ ] }']:
+        for chunk_size in range(1, len(text) + 2):
+            assert read_cells(text, chunk_size) == []
+
+
+def test_notebook_file():
+    path = Path(__file__).parent / "test-namespaces.ipynb"
+    text = path.read_text(encoding="utf-8")
+    expected = expected_cells(text)
+    for chunk_size in [1, 2, 3, 7, 100, 4096, len(text), 1 << 16]:
+        assert read_cells(text, chunk_size) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "[]",
+        "{}",
+        '{"metadata": {}}',
+        '{"cells": {}}',
+        '{"cells": [1]}',
+        '{"cells": [{}] "metadata": {}}',
+        '{"cells": [{},]}',
+        '{"cells": [{"source": [}]}',
+        "{cells: []}",
+    ],
+)
+def test_malformed(text):
+    for chunk_size in range(1, len(text) + 2):
+        with pytest.raises(ValueError):
+            read_cells(text, chunk_size)
+
+
+def test_truncated():
+    text = json.dumps(dict(cells=copy.deepcopy(CELLS), nbformat=4), separators=(",", ":"))
+    for end in range(len(text)):
+        for chunk_size in [1, 5, 64]:
+            with pytest.raises(ValueError):
+                read_cells(text[:end], chunk_size)
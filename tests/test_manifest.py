@@ -0,0 +1,89 @@
+"""Tests writing the site manifest, covers and per-Star shards."""
+import json
+import os
+
+from constellate.constellate.manifest import (
+    COVERS_NAME,
+    MANIFEST_NAME,
+    MANIFEST_VERSION,
+    SHARD_DIR_NAME,
+    update_manifest,
+)
+
+
+def star(star_id, kind="markdown"):
+    value = {"star_id": star_id, "kind": kind, "markdown": f"Star {star_id}"}
+    if kind == "markdown_matplotlib":
+        value.update({"light": f"{star_id}-light.svg", "dark": f"{star_id}-dark.svg"})
+    return value
+
+
+def write(path, title, stars):
+    data = {
+        "title": title,
+        "star_titles": [s["star_id"] for s in stars],
+        "breadcrumbs": [],
+        "stars": stars,
+    }
+    path.write_text(json.dumps(data), encoding="utf-8")
+    # so a rewrite is seen even within the resolution of the file system's timestamps
+    os.utime(path, ns=(path.stat().st_mtime_ns, path.stat().st_mtime_ns + 10 ** 9))
+
+
+def read(path):
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def test_update_manifest(tmp_path):
+    write(tmp_path / "intro.constellate", "Intro", [star("a"), star("b", "markdown_matplotlib")])
+    write(tmp_path / "notes.constellate", "Notes", [star("c")])
+    update_manifest(tmp_path)
+
+    manifest = read(tmp_path / MANIFEST_NAME)
+    assert manifest["version"] == MANIFEST_VERSION
+    entries = {entry["slug"]: entry for entry in manifest["constellations"]}
+    assert entries["intro"]["title"] == "Intro"
+    assert entries["intro"]["star_ids"] == ["a", "b"]
+    assert entries["intro"]["num_stars"] == 2
+
+    covers = read(tmp_path / COVERS_NAME)["covers"]
+    assert covers == {"intro": {"light": "b-light.svg", "dark": "b-dark.svg"}, "notes": None}
+
+    shards = tmp_path / SHARD_DIR_NAME
+    assert read(shards / "intro" / "1.json") == star("b", "markdown_matplotlib")
+    assert sorted([path.name for path in (shards / "intro").iterdir()]) == ["0.json", "1.json"]
+
+
+def test_only_changed_files_are_sharded(tmp_path):
+    write(tmp_path / "intro.constellate", "Intro", [star("a"), star("b")])
+    write(tmp_path / "notes.constellate", "Notes", [star("c")])
+    update_manifest(tmp_path)
+    notes_shard = tmp_path / SHARD_DIR_NAME / "notes" / "0.json"
+    notes_shard.write_text("unchanged", encoding="utf-8")
+
+    write(tmp_path / "intro.constellate", "Intro", [star("d")])
+    update_manifest(tmp_path)
+    intro = tmp_path / SHARD_DIR_NAME / "intro"
+    assert [path.name for path in intro.iterdir()] == ["0.json"]
+    assert read(intro / "0.json") == star("d")
+    assert notes_shard.read_text(encoding="utf-8") == "unchanged"
+
+
+def test_removed_files(tmp_path):
+    write(tmp_path / "intro.constellate", "Intro", [star("a")])
+    write(tmp_path / "notes.constellate", "Notes", [star("c")])
+    update_manifest(tmp_path)
+
+    (tmp_path / "notes.constellate").unlink()
+    update_manifest(tmp_path)
+    assert [e["slug"] for e in read(tmp_path / MANIFEST_NAME)["constellations"]] == ["intro"]
+    assert list(read(tmp_path / COVERS_NAME)["covers"]) == ["intro"]
+    assert not (tmp_path / SHARD_DIR_NAME / "notes").exists()
+
+
+def test_old_manifest_is_rebuilt(tmp_path):
+    write(tmp_path / "intro.constellate", "Intro", [star("a")])
+    (tmp_path / MANIFEST_NAME).write_text(json.dumps({"constellations": []}), encoding="utf-8")
+    update_manifest(tmp_path)
+    assert read(tmp_path / MANIFEST_NAME)["constellations"][0]["slug"] == "intro"
+    assert (tmp_path / SHARD_DIR_NAME / "intro" / "0.json").exists()
@@ -0,0 +1,68 @@
+"""Tests reading the outputs notebooks were saved with."""
+import pandas as pd
+
+from constellate.constellate.outputs import fresh_code_cells, mark_fresh, stored_dataframe
+
+
+def result(df):
+    """Returns the output Jupyter saves for a DataFrame or Series that's the value of a cell, with
+    Pandas' table schema output on."""
+    data = {"text/plain": repr(df).splitlines(True)}
+    if isinstance(df, pd.DataFrame):
+        data["text/html"] = df._repr_html_().splitlines(True)
+    with pd.option_context("display.html.table_schema", True):
+        data["application/vnd.dataresource+json"] = df._repr_data_resource_()
+    return {"output_type": "execute_result", "execution_count": 1, "metadata": {}, "data": data}
+
+
+def code(execution_count):
+    return {"cell_type": "code", "execution_count": execution_count, "source": [], "outputs": []}
+
+
+def test_stored_dataframe_keeps_values():
+    df = pd.DataFrame({"s": ["007", "1", "2.50"], "x": [12345678.9, 1.0, 2.5]})
+    assert stored_dataframe([result(df)], "df = load()\ndf", "df") == [
+        {"s": "007", "x": 12345678.9},
+        {"s": "1", "x": 1.0},
+        {"s": "2.50", "x": 2.5},
+    ]
+
+
+def test_stored_dataframe_needs_df_expr_last():
+    df = pd.DataFrame({"a": range(10)})
+    outputs = [result(df.head())]
+    assert stored_dataframe(outputs, "#constellate: dataframe df\ndf.head()", "df") is None
+    assert stored_dataframe(outputs, "df.head( )", "df.head()") is not None
+    assert stored_dataframe(outputs, "x = df.head()", "x") is None
+
+
+def test_stored_dataframe_needs_table_schema():
+    df = pd.DataFrame({"a": range(10)})
+    output = result(df)
+    del output["data"]["application/vnd.dataresource+json"]
+    assert stored_dataframe([output], "df", "df") is None
+    # only the value of the cell is the DataFrame
+    display = {**result(df), "output_type": "display_data"}
+    assert stored_dataframe([display], "df", "df") is None
+
+
+def test_stored_dataframe_rejects_truncated():
+    df = pd.DataFrame({"a": range(100)})
+    assert stored_dataframe([result(df)], "df", "df") is None
+    assert stored_dataframe([result(df["a"])], "df['a']", "df['a']") is None
+    # without a shape footer, a DataFrame of exactly display.max_rows rows may have been cut
+    output = result(df.head(60))
+    del output["data"]["text/plain"], output["data"]["text/html"]
+    assert stored_dataframe([output], "df", "df") is None
+    with pd.option_context("display.max_rows", 200):
+        assert len(stored_dataframe([result(df)], "df", "df")) == 100
+
+
+def test_fresh_code_cells():
+    markdown = {"cell_type": "markdown", "source": []}
+    cells = [markdown, code(1), code(2), markdown, code(4), code(3), code(5)]
+    assert fresh_code_cells(cells) == {1, 2, 4}
+    assert [fresh for _cell, fresh in mark_fresh(cells)] == [
+        False, True, True, False, True, False, False
+    ]
+    assert fresh_code_cells([code(None), code(1)]) == set()
@@ -0,0 +1,112 @@
+"""Tests parsing Constellations from notebook cells as they're read."""
+import itertools
+import json
+
+from constellate.constellate.constellation import Constellation
+from constellate.constellate.star import MarkdownMatplotlib, PureMarkdown, iter_stars, parse_stars
+
+SVG_OUTPUT = {
+    "output_type": "display_data",
+    "metadata": {},
+    "data": {"image/svg+xml": ["<svg></svg>"], "text/plain": ["<Figure>"]},
+}
+
+
+def markdown(text):
+    return {"cell_type": "markdown", "metadata": {}, "source": [text]}
+
+
+def code(source, execution_count=None, outputs=()):
+    return {
+        "cell_type": "code",
+        "metadata": {},
+        "execution_count": execution_count,
+        "outputs": list(outputs),
+        "source": source.splitlines(True),
+    }
+
+
+def plot_cells(num_stars, first_count):
+    """Returns Markdown and Matplotlib cells for num_stars Stars, each with stored outputs and run
+    in order from first_count on, with setup and ignored cells between them."""
+    cells = []
+    count = itertools.count(first_count)
+    for i in range(num_stars):
+        cells.append(code(f"#constellate: setup\nX{i} = {i}", next(count)))
+        cells.append(code("#constellate: ignore\nprint('ignored')", next(count)))
+        cells.append(markdown(f"Plot {i}"))
+        cells.append(code("#constellate: matplotlib\nplt.plot([1, 2])", next(count), [SVG_OUTPUT]))
+    return cells
+
+
+def is_dropped(cell):
+    """Returns whether the parser drops a cell once it's read: setup and ignored cells."""
+    return cell["cell_type"] == "code" and cell["source"][0].startswith(
+        ("#constellate: setup", "#constellate: ignore")
+    )
+
+
+def read(cells):
+    """Yields copies of the cells, reusing the dicts of cells the parser drops for later code
+    cells, as Python can once they're freed. So cells can't be told apart by their id().
+    """
+    dropped = []
+    for cell in cells:
+        copy = json.loads(json.dumps(cell))
+        if dropped and cell["cell_type"] == "code" and not is_dropped(cell):
+            reused = dropped.pop(0)
+            reused.clear()
+            reused.update(copy)
+            copy = reused
+        yield copy
+        if is_dropped(copy):
+            dropped.append(copy)
+
+
+def test_stale_cells_lose_outputs():
+    # the cell before every plot didn't run, so none of their outputs can be trusted, even though
+    # the cells before it, which are dropped once they're read, did
+    fresh = plot_cells(30, 1)
+    skipped = code("#constellate: ignore\nprint('not run')", None)
+    cells = [markdown("# Title")] + fresh + [skipped] + plot_cells(30, 1000)
+    con = Constellation.from_ipynb_cells(read(cells))
+    plots = [star for star in con.stars if isinstance(star, MarkdownMatplotlib)]
+    assert len(plots) == 60
+    assert all([star.outputs == [SVG_OUTPUT] for star in plots[:30]])
+    assert all([star.outputs == [] for star in plots[30:]])
+
+
+def test_fresh_cells_keep_outputs():
+    cells = [markdown("# Title")] + plot_cells(30, 1)
+    con = Constellation.from_ipynb_cells(read(cells))
+    plots = [star for star in con.stars if isinstance(star, MarkdownMatplotlib)]
+    assert len(plots) == 30
+    assert all([star.outputs == [SVG_OUTPUT] for star in plots])
+    assert len(con.shared_setup) == 30
+
+
+def test_iter_stars_parses_before_the_end():
+    read = []
+
+    def cells():
+        for cell in [markdown("# Title"), markdown("Plot"), code("plt.plot([1])")]:
+            read.append(cell)
+            yield cell
+        raise AssertionError("Read past the cells")
+
+    stars = iter_stars(cells())
+    consumed, star = next(stars)
+    assert isinstance(star, PureMarkdown)
+    assert len(read) == 2
+    consumed, star = next(stars)
+    assert isinstance(star, MarkdownMatplotlib)
+    assert len(consumed) == 2 and len(read) == 3
+
+
+def test_iter_stars_stops_at_unparseable_cell():
+    cells = [markdown("a"), markdown("b"), code("x = 1"), code("y = 2"), markdown("c")]
+    parsed = list(iter_stars(cells))
+    assert parsed[-1] == ([cells[3]], None)
+    stars, end = parse_stars(cells)
+    assert end == 3
+    assert [n for n, _star in stars] == [1, 2]
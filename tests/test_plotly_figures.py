@@ -0,0 +1,100 @@
+"""Tests compacting Plotly figures."""
+import numpy as np
+import pytest
+
+from constellate.constellate.plotly_figures import (
+    MIN_ARRAY_LENGTH,
+    PlotlyOptions,
+    _encode,
+    _numeric_array,
+    compact_figure,
+    lttb,
+)
+
+
+def decode(value):
+    return _numeric_array(value)
+
+
+def test_encode_integers():
+    assert _encode(np.arange(20), PlotlyOptions())["dtype"] == "u1"
+    assert _encode(np.arange(-5, 15), PlotlyOptions())["dtype"] == "i1"
+    assert _encode(np.array([0, 70000] * 10), PlotlyOptions())["dtype"] == "u4"
+    huge = np.array([2 ** 40] * 20)
+    assert _encode(huge, PlotlyOptions())["dtype"] == "f8"
+    assert decode(_encode(huge, PlotlyOptions())).tolist() == huge.tolist()
+
+
+def test_encode_floats():
+    values = np.linspace(0, 1, 20)
+    encoded = _encode(values, PlotlyOptions())
+    assert encoded["dtype"] == "f4"
+    assert np.allclose(decode(encoded), values)
+    assert _encode(values, PlotlyOptions(precision=10))["dtype"] == "f8"
+    assert _encode(np.array([1e300] * 20), PlotlyOptions())["dtype"] == "f8"
+
+    rounded = _encode(np.array([1 / 3, np.nan] * 10), PlotlyOptions(binary=False, precision=3))
+    assert rounded[:2] == [0.333, None]
+
+
+def test_encode_2d():
+    z = np.arange(24, dtype=float).reshape(4, 6)
+    encoded = _encode(z, PlotlyOptions())
+    assert encoded["shape"] == "4,6"
+    assert decode(encoded).tolist() == z.tolist()
+
+
+def test_lttb():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros(1000)
+    y[500] = 10
+    y[777] = -3
+    indices = lttb(x, y, 20)
+    assert len(indices) == 20
+    assert indices[0] == 0 and indices[-1] == 999
+    assert list(indices) == sorted(indices)
+    # the peaks that shape the line are kept
+    assert 500 in indices and 777 in indices
+    assert list(lttb(x[:10], y[:10], 20)) == list(range(10))
+
+
+def test_compact_figure():
+    n = 1000
+    fig = {
+        "data": [
+            {
+                "type": "scatter",
+                "mode": "lines",
+                "x": list(range(n)),
+                "y": [float(i % 7) for i in range(n)],
+                "text": [str(i) for i in range(n)],
+                "marker": {"color": list(range(n))},
+                "name": "line",
+            },
+            {"type": "bar", "x": ["a", "b"], "y": [1, 2]},
+        ],
+        "layout": {"title": {"text": "Plot"}},
+    }
+    compact = compact_figure(fig, PlotlyOptions(max_points=100))
+    line, bar = compact["data"]
+    assert len(decode(line["x"])) == 100
+    assert len(line["text"]) == 100 and len(decode(line["marker"]["color"])) == 100
+    assert decode(line["x"]).tolist() == [int(text) for text in line["text"]]
+    assert line["name"] == "line"
+    # short arrays and the layout are left alone
+    assert bar == fig["data"][1]
+    assert compact["layout"] == fig["layout"]
+    # the figure isn't modified
+    assert len(fig["data"][0]["x"]) == n
+
+
+def test_short_arrays_are_left_alone():
+    fig = {"data": [{"y": list(range(MIN_ARRAY_LENGTH - 1))}]}
+    assert compact_figure(fig) == fig
+
+
+def test_options():
+    with pytest.raises(ValueError):
+        PlotlyOptions(precision=0)
+    with pytest.raises(ValueError):
+        PlotlyOptions(max_points=2)
@@ -0,0 +1,66 @@
+"""Tests saving and loading the global state setup cells create."""
+import matplotlib
+
+from constellate.constellate.namespace import run_setup
+from constellate.constellate.snapshot import (
+    SnapshotCache,
+    dump_namespace,
+    load_namespace,
+    snapshot_key,
+)
+
+SETUP = """
+import math
+import numpy as np
+
+SCALE = 2
+data = {"x": np.arange(3)}
+
+def scale(x, by=None, *, offset=0):
+    return x * (SCALE if by is None else by) + offset
+
+def total():
+    return float(scale(data["x"]).sum()) + math.pi
+"""
+
+
+def test_round_trip():
+    namespace = run_setup([SETUP])
+    loaded = load_namespace(dump_namespace(namespace))
+    assert loaded is not None
+    assert loaded["math"] is namespace["math"]
+    assert loaded["data"]["x"].tolist() == [0, 1, 2]
+    assert loaded["scale"](1, offset=1) == 3
+    assert loaded["total"]() == namespace["total"]()
+
+    # functions use the loaded namespace as their globals, not the one they were saved from
+    assert loaded["scale"].__globals__ is loaded
+    loaded["SCALE"] = 10
+    assert loaded["scale"](1) == 10
+    assert namespace["scale"](1) == 2
+
+
+def test_restores_matplotlib_settings():
+    with matplotlib.rc_context():
+        namespace = run_setup(["import matplotlib\nmatplotlib.rcParams['lines.linewidth'] = 7"])
+        data = dump_namespace(namespace)
+    with matplotlib.rc_context():
+        assert matplotlib.rcParams["lines.linewidth"] != 7
+        load_namespace(data)
+        assert matplotlib.rcParams["lines.linewidth"] == 7
+
+
+def test_unsaveable():
+    assert dump_namespace(run_setup(["class Point:\n    pass\np = Point()"])) is None
+    closure = "def outer():\n    x = 1\n    return lambda: x\nf = outer()"
+    assert dump_namespace(run_setup([closure])) is None
+    assert dump_namespace(run_setup(["f = open(__import__('os').devnull)"])) is None
+    assert load_namespace(b"not a pickle") is None
+
+
+def test_snapshot_cache(tmp_path):
+    cache = SnapshotCache(tmp_path, max_size=10 ** 6)
+    key = snapshot_key([SETUP])
+    assert key != snapshot_key([SETUP, "x = 1"])
+    cache.put(key, dump_namespace(run_setup([SETUP])))
+    assert load_namespace(cache.get(key))["scale"](2) == 4
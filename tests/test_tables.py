@@ -0,0 +1,112 @@
+"""Tests exporting DataFrames as tables."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from constellate.constellate.assets import AssetStore
+from constellate.constellate.tables import (
+    TableOptions,
+    dataframe_table,
+    page_urls,
+    records_table,
+    store_pages,
+)
+
+
+def names(table):
+    return [column["name"] for column in table["columns"]]
+
+
+def test_series_keeps_index():
+    table = dataframe_table(pd.Series(list("aaabc")).value_counts())
+    assert table["pages"] == [[["a", "b", "c"], [3, 1, 1]]]
+    assert names(table)[1] == "count"
+
+
+def test_default_index_left_out():
+    table = dataframe_table(pd.DataFrame({"x": [1, 2, 3]}))
+    assert names(table) == ["x"]
+    assert table["pages"] == [[[1, 2, 3]]]
+
+
+def test_index_columns():
+    df = pd.DataFrame({"a": [1, 2]}, index=pd.Index([5, 6], name="a"))
+    assert dataframe_table(df)["pages"] == [[[5, 6], [1, 2]]]
+    assert names(dataframe_table(df)) == ["a", "a"]
+
+    grouped = pd.DataFrame({"x": [1, 1, 2], "y": [3, 3, 4]}).groupby(["x", "y"]).size()
+    assert names(dataframe_table(grouped))[:2] == ["x", "y"]
+    assert dataframe_table(grouped)["pages"] == [[[1, 2], [3, 4], [2, 1]]]
+
+
+def test_not_a_table():
+    with pytest.raises(ValueError):
+        dataframe_table((3, 4))
+
+
+def test_pages():
+    df = pd.DataFrame({"x": range(25)})
+    table = dataframe_table(df, TableOptions(page_rows=10, max_rows=22))
+    assert table["total_rows"] == 25
+    assert table["num_rows"] == 22
+    assert [page[0] for page in table["pages"]] == [
+        list(range(10)),
+        list(range(10, 20)),
+        [20, 21],
+    ]
+    # stats are of every row, not just the exported ones
+    assert table["columns"][0]["stats"]["max"] == 24
+
+
+def test_empty():
+    table = dataframe_table(pd.DataFrame({"x": []}))
+    assert table["num_rows"] == 0
+    assert table["pages"] == [[[]]]
+
+
+def test_column_types_and_stats():
+    df = pd.DataFrame(
+        {
+            "i": [1, 2, 3],
+            "f": [0.123456, np.nan, np.inf],
+            "b": [True, False, True],
+            "s": ["x", "y", "x"],
+            "t": pd.to_datetime(["2020-01-01", None, "2020-01-03"]),
+        }
+    )
+    table = dataframe_table(df, TableOptions(precision=2))
+    types = {column["name"]: column["type"] for column in table["columns"]}
+    assert types == {
+        "i": "integer",
+        "f": "number",
+        "b": "boolean",
+        "s": "string",
+        "t": "datetime",
+    }
+    i, f, b, s, t = table["pages"][0]
+    assert f == [0.12, None, None]
+    assert t == ["2020-01-01T00:00:00", None, "2020-01-03T00:00:00"]
+
+    stats = {column["name"]: column["stats"] for column in table["columns"]}
+    assert stats["i"]["mean"] == 2.0
+    assert stats["f"]["nulls"] == 2
+    assert stats["b"]["true"] == 2
+    assert stats["s"]["unique"] == 2 and stats["s"]["top"] == "x"
+
+
+def test_records_table():
+    records = [{"a": 1, "b": "x"}, {"a": 2.5}, {"b": "y", "c": None}]
+    table = records_table(records)
+    assert names(table) == ["a", "b", "c"]
+    assert table["pages"] == [[[1, 2.5, None], ["x", None, "y"], [None, None, None]]]
+
+
+def test_store_pages(tmp_path):
+    assets = AssetStore(tmp_path, min_size=1)
+    table = dataframe_table(pd.DataFrame({"x": range(30)}), TableOptions(page_rows=10))
+    stored = store_pages(table, assets)
+    assert stored["pages"][0] == table["pages"][0]
+    urls = page_urls(stored)
+    assert len(urls) == 2
+    assert [assets.read_json(url) for url in urls] == table["pages"][1:]
+    assert store_pages(stored, assets) == stored
@@ -0,0 +1,76 @@
+"""Tests telling which code depends on the theme and re-styling figures for the other theme."""
+from constellate.constellate.theming import (
+    THEME_SETUP,
+    _hex,
+    _theme_settings,
+    is_theme_dependent,
+    restyle_figure,
+    theme_dependent_names,
+)
+
+SETUP = """
+import numpy as np
+
+def style(ax):
+    ax.set_facecolor('black' if IS_DARK else 'white')
+
+def plot_styled(ax, x):
+    ax.plot(x)
+    style(ax)
+
+def plot_plain(ax, x):
+    ax.plot(np.asarray(x))
+
+if True:
+    import seaborn as sb
+"""
+
+
+def test_own_code():
+    assert not is_theme_dependent("plt.plot([1, 2], color=c1)")
+    assert is_theme_dependent("plt.plot([1, 2], color='w' if IS_DARK else 'k')")
+    assert is_theme_dependent("sns.boxplot(x=[1, 2])")
+    assert is_theme_dependent("from seaborn import boxplot")
+    assert is_theme_dependent("plt.plot(")
+
+
+def test_setup_helpers():
+    assert theme_dependent_names((SETUP,)) == frozenset(["style", "plot_styled", "sb"])
+    setup = [SETUP]
+    assert is_theme_dependent("style(plt.gca())", setup)
+    # through another helper
+    assert is_theme_dependent("plot_styled(plt.gca(), [1, 2])", setup)
+    assert is_theme_dependent("sb.histplot([1, 2])", setup)
+    assert not is_theme_dependent("plot_plain(plt.gca(), [1, 2])", setup)
+    assert not is_theme_dependent("plt.plot(np.arange(3))", setup)
+
+
+def test_helpers_defined_later():
+    setup = ["def outer():\n    return inner()", "def inner():\n    return theme"]
+    assert is_theme_dependent("outer()", setup)
+
+
+def test_unknown_setup():
+    assert is_theme_dependent("plt.plot([1])", ["from helpers import *"])
+    assert is_theme_dependent("plt.plot([1])", ["x = ("])
+
+
+def test_restyle_figure():
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    settings = _theme_settings()
+    light_cs, dark_cs = settings["light"][1], settings["dark"][1]
+    with matplotlib.rc_context():
+        scope = {}
+        exec(THEME_SETUP["light"], scope)
+        fig, ax = plt.subplots()
+        (line,) = ax.plot([1, 2], color=light_cs[1])
+        (custom,) = ax.plot([2, 1], color="#123456")
+
+        matplotlib.rcParams.update(settings["dark"][0])
+        restyle_figure(fig, "light", "dark")
+        assert _hex(line.get_color()) == _hex(dark_cs[1])
+        assert _hex(custom.get_color()) == "#123456"
+        assert _hex(ax.patch.get_facecolor()) == _hex(settings["dark"][0]["axes.facecolor"])
+        plt.close("all")